@@ -1,2 +1,3 @@
 __all__ = ['Gaussian', 'Camel', 'UnconstrainedCamel', 'Uniform', 'Banana',
-           'Rambo', 'RamboOnDiet', 'Sarge', 'ee_qq_ng', 'export_hepmc']
+           'Rambo', 'RamboOnDiet', 'Sarge', 'ee_qq_ng', 'export_hepmc',
+           'PooledDensity']
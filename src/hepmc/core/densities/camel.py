@@ -1,5 +1,4 @@
 from ..density import Density
-from scipy.stats import multivariate_normal as multi_norm
 
 import numpy as np
 
@@ -13,36 +12,54 @@ class UnconstrainedCamel(Density):
     def __init__(self, ndim, mu_a=1/3, mu_b=2/3, a=0.1):
         super().__init__(ndim, False)
         self._mu_a = self._mu_b = None
+        self._cov = self._log_norm = None
         self.mu_a = mu_a
         self.mu_b = mu_b
         self.cov = a**2/2
-    
-    def pdf(self, xs):
-        xs = interpret_array(xs, self.ndim)
-        ndim = xs.shape[1]
 
-        if ndim != self.ndim:
-            raise RuntimeWarning("Mismatching dimensions.")
+    def _log_modes(self, xs):
+        """ Log densities of the two modes and the differences to their means.
+
+        :return: Tuple (log_pdfs, diffs) of shapes (N, 2) and (N, 2, ndim).
+        """
+        diffs = xs[:, np.newaxis, :] - np.stack((self.mu_a, self.mu_b))
+        log_pdfs = (-.5 / self.cov * np.einsum('ijk,ijk->ij', diffs, diffs) -
+                    self._log_norm)
+        return log_pdfs, diffs
 
-        pdf_a = np.atleast_1d(
-            multi_norm.pdf(xs, mean=self.mu_a, cov=self.cov))
-        pdf_b = np.atleast_1d(
-            multi_norm.pdf(xs, mean=self.mu_b, cov=self.cov))
-        return (pdf_a + pdf_b).flatten() / 2
+    def pdf(self, xs):
+        return np.exp(-self.pot(xs))
     
     def pdf_gradient(self, xs):
+        pot, grad = self.pot_and_gradient(xs)
+        return -grad * np.exp(-pot)[:, np.newaxis]
+
+    def pot(self, xs):
+        xs = interpret_array(xs, self.ndim)
+        log_pdfs, _ = self._log_modes(xs)
+        return np.log(2) - np.logaddexp(log_pdfs[:, 0], log_pdfs[:, 1])
+
+    def pot_gradient(self, xs):
+        return self.pot_and_gradient(xs)[1]
+
+    def pot_and_gradient(self, xs):
         xs = interpret_array(xs, self.ndim)
-        ndim = xs.shape[1]
+        log_pdfs, diffs = self._log_modes(xs)
+        log_pdf = np.logaddexp(log_pdfs[:, 0], log_pdfs[:, 1])
+        # relative weights of the modes at each point
+        resp = np.exp(log_pdfs - log_pdf[:, np.newaxis])
+        grad = np.einsum('ij,ijk->ik', resp, diffs) / self.cov
+        return np.log(2) - log_pdf, grad
 
-        if ndim != self.ndim:
-            raise RuntimeWarning("Mismatching dimensions.")
+    @property
+    def cov(self):
+        return self._cov
 
-        pdf_a = np.atleast_1d(
-            multi_norm.pdf(xs, mean=self.mu_a, cov=self.cov))
-        pdf_b = np.atleast_1d(
-            multi_norm.pdf(xs, mean=self.mu_b, cov=self.cov))
-        return ((-xs + self.mu_a) / self.cov * pdf_a[:, np.newaxis] +
-                (-xs + self.mu_b) / self.cov * pdf_b[:, np.newaxis]) / 2
+    @cov.setter
+    def cov(self, value):
+        # both modes share the isotropic covariance cov * identity
+        self._cov = value
+        self._log_norm = .5 * self.ndim * np.log(2 * np.pi * value)
 
     @property
     def mean(self):
@@ -86,7 +103,7 @@ class Camel(UnconstrainedCamel):
     """
     @hypercube_bounded(1, self_has_ndim=True)
     def pdf(self, xs):
-        return super().pdf(xs).flatten()
+        return super().pdf(xs)
 
     def pdf_gradient(self, xs):
         xs = interpret_array(xs, self.ndim)
@@ -98,3 +115,18 @@ class Camel(UnconstrainedCamel):
         res[np.logical_not(in_bounds)] = 0
 
         return res
+
+    @hypercube_bounded(1, null_value=np.inf, self_has_ndim=True)
+    def pot(self, xs):
+        return super().pot(xs)
+
+    def pot_and_gradient(self, xs):
+        xs = interpret_array(xs, self.ndim)
+
+        in_bounds = np.all((0 < xs) * (xs < 1), axis=1)
+
+        pot = np.full(xs.shape[0], np.inf)
+        grad = np.full(xs.shape, np.inf)
+        pot[in_bounds], grad[in_bounds] = super().pot_and_gradient(
+            xs[in_bounds])
+        return pot, grad
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.stats import multivariate_normal as multi_norm
 
 from ..density import Distribution
 from ..util import interpret_array
@@ -13,6 +12,9 @@ class Gaussian(Distribution):
         self._mean = None
         self._cov = None
         self._cov_inv = None
+        self._cov_chol = None
+        self._cov_chol_inv = None
+        self._log_norm = None
         self.mean = mu
 
         if cov is None:
@@ -28,27 +30,32 @@ class Gaussian(Distribution):
                 raise RuntimeWarning("Specified both cov and scale (using cov)")
 
     def pdf(self, xs):
-        xs = interpret_array(xs, self.ndim)
-        prob = multi_norm.pdf(xs, self.mean, self.cov)
-        return np.array(prob, ndmin=1, copy=False, subok=True)
+        return np.exp(-self.pot(xs))
 
     def pdf_gradient(self, xs):
-        xs = interpret_array(xs, self.ndim)
-        return - (np.dot(self._cov_inv, (xs - self.mean)) *
-                  self.pdf(xs)[:, np.newaxis])
+        pot, grad = self.pot_and_gradient(xs)
+        return -grad * np.exp(-pot)[:, np.newaxis]
 
     def pot(self, xs):
         xs = interpret_array(xs, self.ndim)
-        logpdf = -multi_norm.logpdf(xs, self.mean, self.cov)
-        return np.array(logpdf, copy=False, ndmin=1, subok=True)
+        # whitened distance to the mean, (L^-1 (x - mu))^T = (x - mu)^T L^-T
+        white = np.dot(xs - self.mean, self._cov_chol_inv.T)
+        return .5 * np.einsum('ij,ij->i', white, white) + self._log_norm
 
     def pot_gradient(self, xs):
         xs = interpret_array(xs, self.ndim)
-        return np.einsum('ij,kj->ki', self._cov_inv, xs - self.mean)
+        return np.dot(xs - self.mean, self._cov_inv)
+
+    def pot_and_gradient(self, xs):
+        xs = interpret_array(xs, self.ndim)
+        diff = xs - self.mean
+        grad = np.dot(diff, self._cov_inv)
+        pot = .5 * np.einsum('ij,ij->i', diff, grad) + self._log_norm
+        return pot, grad
 
     def rvs(self, sample_size):
-        sample = np.random.multivariate_normal(self.mean, self.cov, sample_size)
-        return sample
+        normal = np.random.standard_normal((sample_size, self.ndim))
+        return self.mean + np.dot(normal, self._cov_chol.T)
 
     @property
     def mean(self):
@@ -72,8 +79,29 @@ class Gaussian(Distribution):
 
     @cov.setter
     def cov(self, cov):
+        cov = np.array(cov, dtype=float)
+        if cov.ndim == 0:
+            cov = cov * np.eye(self.ndim)
+        elif cov.ndim == 1:
+            cov = np.diag(cov)
         self._cov = cov
-        self._cov_inv = np.linalg.inv(self._cov)
+
+        # factorize once, cov = L L^T
+        self._cov_chol = np.linalg.cholesky(cov)
+        self._cov_chol_inv = np.linalg.inv(self._cov_chol)
+        self._cov_inv = np.dot(self._cov_chol_inv.T, self._cov_chol_inv)
+        self._log_norm = (.5 * self.ndim * np.log(2 * np.pi) +
+                          np.sum(np.log(np.diagonal(self._cov_chol))))
+
+    @property
+    def cov_inv(self):
+        """ Inverse of the covariance matrix. """
+        return self._cov_inv
+
+    @property
+    def log_norm(self):
+        """ Logarithm of the normalization, pot = quadratic form + log_norm. """
+        return self._log_norm
 
     def __repr__(self):
         return type(self).__name__ + "(ndim=%s, mu=%s, cov=%s)" % (
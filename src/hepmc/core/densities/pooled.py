@@ -0,0 +1,159 @@
+import os
+import pickle
+import numpy as np
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+from ..density import Density
+from ..util import interpret_array
+
+
+# methods whose result has shape (N, ndim), the others return shape (N,)
+_GRADIENT_METHODS = ('pot_gradient', 'pdf_gradient')
+
+# state of a worker process, set by _init_worker
+_worker = dict()
+
+
+def _init_worker(density, in_name, out_name, capacity):
+    # unpickled also where forked, see PooledDensity
+    density = _worker['density'] = pickle.loads(density)
+    # keep references to the shared memory blocks, so they are not closed
+    _worker['in_shm'] = SharedMemory(name=in_name)
+    _worker['out_shm'] = SharedMemory(name=out_name)
+    _worker['xs'] = np.ndarray((capacity, density.ndim), dtype=np.float64,
+                               buffer=_worker['in_shm'].buf)
+    _worker['out'] = np.ndarray((capacity, density.ndim + 1), dtype=np.float64,
+                                buffer=_worker['out_shm'].buf)
+
+
+def _store(method, result, out):
+    """ Write the result of method into out ([value, gradient] per row). """
+    if method == 'pot_and_gradient':
+        out[:, 0], out[:, 1:] = result
+    elif method in _GRADIENT_METHODS:
+        out[:, 1:] = result
+    else:
+        out[:, 0] = result
+
+
+def _load(method, out):
+    """ Inverse of _store. """
+    if method == 'pot_and_gradient':
+        return out[:, 0], out[:, 1:]
+    elif method in _GRADIENT_METHODS:
+        return out[:, 1:]
+    else:
+        return out[:, 0]
+
+
+def _evaluate(args):
+    method, start, stop = args
+    result = getattr(_worker['density'], method)(_worker['xs'][start:stop])
+    _store(method, result, _worker['out'][start:stop])
+
+
+class PooledDensity(Density):
+
+    def __init__(self, density, processes=None, capacity=100000,
+                 chunk_size=None):
+        """ Evaluate a density in a persistent pool of worker processes.
+
+        The points and the results are exchanged via two shared memory
+        arrays, the workers only receive the method name and an index
+        range. The density itself is pickled and sent to each worker once,
+        when the pool is started, also where processes are forked. Hence
+        attributes a density drops when pickled (such as its own worker
+        pool) are never used in the workers.
+
+        Evaluating a pooled density is not thread safe. Call close() (or
+        use the object as context manager) to stop the workers and
+        release the shared memory. Pickled copies evaluate the density
+        in the calling process.
+
+        :param density: The wrapped density.
+        :param processes: Number of worker processes (default: cpu count).
+        :param capacity: Number of points exchanged at once, larger
+            batches are evaluated in several rounds.
+        :param chunk_size: Number of points a worker evaluates at once.
+            By default each round is split into four chunks per worker.
+        """
+        super().__init__(density.ndim, density.is_symmetric)
+        self.density = density
+        self.processes = processes or os.cpu_count() or 1
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+
+        self._in_shm = SharedMemory(
+            create=True, size=8 * capacity * self.ndim)
+        self._out_shm = SharedMemory(
+            create=True, size=8 * capacity * (self.ndim + 1))
+        self._xs = np.ndarray((capacity, self.ndim), dtype=np.float64,
+                              buffer=self._in_shm.buf)
+        self._out = np.ndarray((capacity, self.ndim + 1), dtype=np.float64,
+                               buffer=self._out_shm.buf)
+
+        self.pool = Pool(self.processes, initializer=_init_worker,
+                         initargs=(pickle.dumps(density), self._in_shm.name,
+                                   self._out_shm.name, capacity))
+
+    def __getstate__(self):
+        """ Drop the pool and the shared memory, they can't be pickled. """
+        self_dict = self.__dict__.copy()
+        for key in ('pool', '_in_shm', '_out_shm', '_xs', '_out'):
+            self_dict[key] = None
+        return self_dict
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Stop the worker processes and release the shared memory. """
+        if self.pool is None:
+            return
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
+        # release the views before closing the shared memory
+        self._xs = self._out = None
+        for shm in (self._in_shm, self._out_shm):
+            shm.close()
+            shm.unlink()
+        self._in_shm = self._out_shm = None
+
+    def _map(self, method, xs):
+        xs = interpret_array(xs, self.ndim)
+        if self.pool is None:
+            return getattr(self.density, method)(xs)
+
+        out = np.empty((xs.shape[0], self.ndim + 1))
+        for begin in range(0, xs.shape[0], self.capacity):
+            count = min(self.capacity, xs.shape[0] - begin)
+            self._xs[:count] = xs[begin:begin + count]
+
+            chunk_size = self.chunk_size
+            if chunk_size is None:
+                chunk_size = -(-count // (4 * self.processes))
+            tasks = [(method, start, min(start + chunk_size, count))
+                     for start in range(0, count, chunk_size)]
+            self.pool.map(_evaluate, tasks, chunksize=1)
+            out[begin:begin + count] = self._out[:count]
+        return _load(method, out)
+
+    def pdf(self, xs):
+        return self._map('pdf', xs)
+
+    def pdf_gradient(self, xs):
+        return self._map('pdf_gradient', xs)
+
+    def pot(self, xs):
+        return self._map('pot', xs)
+
+    def pot_gradient(self, xs):
+        return self._map('pot_gradient', xs)
+
+    def pot_and_gradient(self, xs):
+        return self._map('pot_and_gradient', xs)
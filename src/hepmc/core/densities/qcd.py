@@ -5,10 +5,10 @@ from ..util import interpret_array
 from ..sampling import Sample
 import pkg_resources
 import numpy as np
-from itertools import combinations
 import os
 import multiprocessing
-from multiprocessing.sharedctypes import RawArray
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import Future
 
 # We need these classes for pickle to work with SWIG. Pickle is 
 # used by multiprocessing.
@@ -34,7 +34,21 @@ class PickleableMEProcess(MEProcess, PickleableSWIG):
 
 # e+ e- -> q qbar + n gluons
 class ee_qq_ng(Density):
-    def __init__(self, n_gluons, E_CM, pT_min, angle_min):
+    def __init__(self, n_gluons, E_CM, pT_min, angle_min, processes=None,
+                 chunk_size=100):
+        """ Matrix element of e+ e- -> q qbar + n gluons, computed by Sherpa.
+
+        The matrix elements are evaluated by a pool of worker processes.
+        The phase space points are passed to the workers via shared memory,
+        which is kept and only reallocated when more points are evaluated
+        at once than before. Call close() (or use the object as context
+        manager) to stop the workers and release the shared memory.
+        Pickled copies (and closed densities) evaluate the matrix elements
+        in the calling process.
+
+        :param processes: Number of worker processes (default: cpu count).
+        :param chunk_size: Number of points a worker evaluates at once.
+        """
         self.conversion = 0.389379*1e9  # convert to picobarn
         self.nfinal = 2+n_gluons  # number of final state particles
         ndim = 4 * self.nfinal
@@ -49,19 +63,71 @@ class ee_qq_ng(Density):
         self.pin1 = [E_CM/2., 0., 0., E_CM/2.]
         self.pin2 = [E_CM/2., 0., 0., -E_CM/2.]
 
-        self.pool = multiprocessing.Pool(initializer=self.init_worker)
+        self.processes = processes
+        self.chunk_size = chunk_size
+        # points in, matrix elements out, both shared with the workers
+        self._in_shm = self._out_shm = None
+        self._capacity = 0
+        # the evaluation using the shared memory, see pdf_async
+        self._pending = None
+        self.pool = multiprocessing.Pool(processes, initializer=self.init_worker)
 
     def __getstate__(self):
-        """Remove the pool instance from the __dict__ so that it
-        won't be pickled.
-        """
+        """ Drop the pool and the shared memory, they can't be pickled. """
         self_dict = self.__dict__.copy()
-        del self_dict['pool']
+        for key in ('pool', '_in_shm', '_out_shm', '_pending'):
+            self_dict[key] = None
+        self_dict['_capacity'] = 0
         return self_dict
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Stop the worker processes and release the shared memory. """
+        if self.pool is None:
+            return
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
+        self._pending = None
+        self._release()
+
+    def _release(self):
+        for shm in (self._in_shm, self._out_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self._in_shm = self._out_shm = None
+        self._capacity = 0
+
+    def _reserve(self, count):
+        """ Make sure the shared memory holds at least count points. """
+        if count <= self._capacity:
+            return
+        self._release()
+        self._in_shm = SharedMemory(create=True, size=8 * count * self.ndim)
+        self._out_shm = SharedMemory(create=True, size=8 * count)
+        self._capacity = count
+
     # The first momentum is xs[0:4]
     # The second momentum is xs[4:8], ...
     def pdf(self, xs):
+        return self.pdf_async(xs).result()
+
+    def pdf_async(self, xs):
+        """ Start evaluating the pdf and return immediately.
+
+        The cuts are applied right away, the matrix elements of the points
+        passing them are computed by the worker processes in the background.
+        Since the shared memory is reused, a call waits until the matrix
+        elements of the previous one are computed.
+
+        :return: A concurrent.futures.Future, its result is the pdf.
+        """
         xs = interpret_array(xs, self.ndim)
 
         ndim = xs.shape[1]
@@ -69,18 +135,67 @@ class ee_qq_ng(Density):
         if ndim != self.ndim:
             raise RuntimeWarning("Mismatching dimensions.")
 
-        sample_size = len(xs)
-
-        me = np.zeros(sample_size)
-        pass_cut_idx = np.where(cut_pT(xs, self.pT_min) & cut_angle(xs, self.angle_min))
-        me[pass_cut_idx] = self.pool.map(self.get_me, xs[pass_cut_idx], chunksize=100)
-
-        cross_section = (2. * np.pi) ** (4.-3. * self.nfinal) / (2. * self.E_CM ** 2) * me
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        me = np.zeros(len(xs))
+        pass_cut_idx = np.flatnonzero(self.cut(xs))
+        count = pass_cut_idx.size
+        if count == 0:
+            future.set_result(self.conversion * self.cross_section(me))
+            return future
+
+        if self.pool is None:
+            # a pickled copy, e.g. in a worker of PooledDensity
+            try:
+                if 'process' not in _worker:
+                    self.init_worker()
+                me[pass_cut_idx] = [_matrix_element(x)
+                                    for x in xs[pass_cut_idx]]
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(self.conversion * self.cross_section(me))
+            return future
+
+        if self._pending is not None:
+            self._pending.wait()
+        self._reserve(count)
+        np.ndarray((count, ndim), buffer=self._in_shm.buf)[:] = xs[pass_cut_idx]
+        out_shm = self._out_shm
+
+        def done(_):
+            # the future must be resolved, also if this fails
+            try:
+                me[pass_cut_idx] = np.ndarray(count, buffer=out_shm.buf)
+                result = self.conversion * self.cross_section(me)
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        tasks = [(self._in_shm.name, out_shm.name, (count, ndim), start,
+                  min(start + self.chunk_size, count))
+                 for start in range(0, count, self.chunk_size)]
+        self._pending = self.pool.map_async(
+            _me_chunk, tasks, chunksize=1, callback=done,
+            error_callback=future.set_exception)
+        return future
+
+    def cut(self, xs):
+        """ Mask of the points passing the pT and angle cuts.
+
+        Can be passed as cut to MappedDensity, so points failing the cuts
+        are rejected before the pdf is evaluated.
+        """
+        xs = interpret_array(xs, self.ndim)
+        return cut_pT(xs, self.pT_min) & cut_angle(xs, self.angle_min)
 
-        return self.conversion * cross_section
+    def cross_section(self, me):
+        return (2. * np.pi) ** (4.-3. * self.nfinal) / (2. * self.E_CM ** 2) * me
 
     def init_worker(self):
-        global Process
+        _worker['incoming'] = [self.pin1, self.pin2]
         Generator = PickleableSherpa()
         Generator.InitializeTheRun(4,
                                     [''.encode('ascii'),
@@ -97,37 +212,50 @@ class ee_qq_ng(Density):
         for _ in range(self.n_gluons):
             Process.AddOutFlav(21)
         Process.Initialize()
-
-    def get_me(self, x):
-        Process.SetMomenta([self.pin1, self.pin2] + [x[j*4:j*4+4].tolist() for j in range(self.nfinal)])
-        return Process.CSMatrixElement()
+        _worker['process'] = Process
+
+# state of a worker process, set by ee_qq_ng.init_worker and _attach
+_worker = dict()
+
+def _matrix_element(x):
+    """ Matrix element of a point, called in a worker process. """
+    _worker['process'].SetMomenta(
+        _worker['incoming'] + np.reshape(x, (-1, 4)).tolist())
+    return _worker['process'].CSMatrixElement()
+
+def _attach(in_name, out_name):
+    """ Shared memory blocks of the worker, attached again if replaced. """
+    if _worker.get('shm_names') != (in_name, out_name):
+        _worker['in_shm'] = SharedMemory(name=in_name)
+        _worker['out_shm'] = SharedMemory(name=out_name)
+        _worker['shm_names'] = (in_name, out_name)
+    return _worker['in_shm'], _worker['out_shm']
+
+def _me_chunk(args):
+    """ Compute the matrix elements of the rows start:stop of shared memory. """
+    in_name, out_name, shape, start, stop = args
+    in_shm, out_shm = _attach(in_name, out_name)
+    xs = np.ndarray(shape, buffer=in_shm.buf)
+    me = np.ndarray(shape[0], buffer=out_shm.buf)
+    for i in range(start, stop):
+        me[i] = _matrix_element(xs[i])
 
 def path_to_runcard(n_gluons):
     return pkg_resources.resource_filename('hepmc', 'data/ee_qq_' + str(n_gluons) + 'g.dat')
 
 def cut_pT(xs, pT_min):
-    n_particles = xs.shape[1] // 4
-    pass_cut_flags = np.all([pT(xs[:, i*4:i*4+4]) > pT_min for i in range(n_particles)], axis=0)
-    return pass_cut_flags
+    ps = xs.reshape(xs.shape[0], -1, 4)
+    pT_sq = np.einsum('kpi,kpi->kp', ps[:, :, 1:3], ps[:, :, 1:3])
+    return np.all(pT_sq > pT_min * abs(pT_min), axis=1)
 
 def cut_angle(xs, angle_min):
-    n_particles = xs.shape[1] // 4
-    pass_cut_flags = np.all([angle(xs[:, i*4+1:i*4+4], xs[:, j*4+1:j*4+4]) > angle_min for i, j in combinations(range(n_particles), 2)], axis=0)
-    return pass_cut_flags
-
-# Calculate transverse momentum of 4-vector
-def pT(p):
-    return np.sqrt(p[:, 1]*p[:, 1]+p[:, 2]*p[:, 2])
-
-def unit_vector(v):
-    return v / np.linalg.norm(v, axis=1)[:, np.newaxis]
-
-# Calculate angle between two 4-vectors
-def angle(p, q):
-    p_u = unit_vector(p)
-    q_u = unit_vector(q)
-    cos_angle = np.einsum('ij,ij->i', p_u, q_u)
-    return np.arccos(np.clip(cos_angle, -1., 1.))
+    ps = xs.reshape(xs.shape[0], -1, 4)
+    i, j = np.triu_indices(ps.shape[1], 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ps_u = ps[:, :, 1:] / np.linalg.norm(ps[:, :, 1:], axis=2)[:, :, np.newaxis]
+    # cosines of all pairwise angles, the angle exceeds angle_min iff its cosine is smaller
+    cos_angle = np.einsum('kpi,kqi->kpq', ps_u, ps_u)[:, i, j]
+    return np.all(cos_angle < np.cos(angle_min), axis=1)
 
 def export_hepmc(E_CM, sample, filename):
     n_out = int(sample.data.shape[1]/4)
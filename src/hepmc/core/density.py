@@ -16,6 +16,10 @@ class Proposal(_AnyDensity):
     def proposal(self, state):
         raise NotImplementedError()
 
+    def proposals(self, states):
+        """ Generate one candidate for each row of states. """
+        return np.stack([self.proposal(state) for state in states])
+
     def proposal_pdf(self, state, candidate):
         return None  # may return None if is_symmetric == True
 
@@ -70,6 +74,17 @@ class Density(_AnyDensity):
 
         return res
 
+    def pot_and_gradient(self, xs):
+        """ Potential and its gradient, evaluated together.
+
+        Subclasses that can share work between both (such as the pdf
+        evaluation) should override this.
+
+        :param xs: Points of shape (N, ndim).
+        :return: Tuple (pot, pot_gradient) of shapes (N,) and (N, ndim).
+        """
+        return self.pot(xs), self.pot_gradient(xs)
+
     def pdf(self, xs):
         raise NotImplementedError()
 
@@ -115,9 +130,16 @@ class Distribution(Density, Proposal):
     def proposal(self, state=None):
         return self.rvs(1)[0]
 
+    def proposals(self, states):
+        return self.rvs(len(states))
+
     def proposal_pdf(self, state, candidate):
         return float(self.pdf(candidate))
 
+    def proposal_mlogpdf(self, state, candidate):
+        with np.errstate(divide='ignore'):
+            return -np.log(self.pdf(candidate))
+
     @classmethod
     def make(cls, pdf=None, ndim=None, rvs=None, **kwargs):
         obj = super().make(pdf=pdf, ndim=ndim, **kwargs)
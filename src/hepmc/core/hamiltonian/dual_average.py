@@ -8,6 +8,10 @@ class DualAveragingHMC(HamiltonianUpdate):
     Adapts the stepsize by dual averaging
     """
 
+    adapt_attributes = ('step_size', 'step_size_bar', 'Hbar', 'mu',
+                        'step_size_min', 'step_size_max',
+                        'nsteps_min', 'nsteps_max')
+
     def __init__(self, target_density, p_dist, simulation_length,
                  adapt_schedule, t0=10, stepsize_bar0=1, Hbar0=0, gamma=0.05,
                  kappa=0.75, delta=0.65, sim_class=HamiltonLeapfrog):
@@ -38,12 +42,7 @@ class DualAveragingHMC(HamiltonianUpdate):
         self.mu = np.log(10 * self.step_size)
 
     def simulate_custom(self, current, p0, steps, step_size):
-        old_step_size, old_steps = self.step_size, self.steps
-        self.step_size = step_size
-        self.steps = steps
-        q, p = self.simulate(current, p0)
-        self.step_size, self.steps = old_step_size, old_steps
-        return q, p
+        return self.simulate(current, p0, step_size, steps)
 
     def find_reasonable_step_size(self, current):
         step_size = .25 / self.target.ndim ** (1 / 4)
@@ -56,12 +55,13 @@ class DualAveragingHMC(HamiltonianUpdate):
         p0_pot = self.p_dist.pot(p0)
         # print('p0_pdf:', p0_pdf)
 
-        q, p = self.simulate_custom(current, p0, 1, step_size)
+        q, p, _, q_pot = self.simulate.propagate(current, p0, step_size, 1)
 
         # print('q:', q)
         # print('p:', p)
         #q_pdf = self.target_density.pdf(q)
-        q_pot = self.target_density.pot(q)
+        if q_pot is None:
+            q_pot = self.target_density.pot(q)
         try:
             #p_pdf = self.p_dist.pdf(p)
             p_pot = self.p_dist.pot(p)
@@ -100,9 +100,11 @@ class DualAveragingHMC(HamiltonianUpdate):
         while aprob == 0. or aprob ** a > 2 ** (-a):
             step_size = 2. ** a * step_size
             # print('stepsize:', step_size)
-            q, p = self.simulate_custom(current, p0, 1, step_size)
+            q, p, _, q_pot = self.simulate.propagate(
+                current, p0, step_size, 1)
             #q_pdf = self.target_density.pdf(q)
-            q_pot = self.target_density.pot(q)
+            if q_pot is None:
+                q_pot = self.target_density.pot(q)
             try:
                 #p_pdf = self.p_dist.pdf(p)
                 p_pot = self.p_dist.pot(p)
@@ -47,7 +47,8 @@ class HamiltonianUpdate(MetropolisUpdate):
         if simulate is None:
             self.simulate = sim_class(
                 target_density.pot_gradient,
-                p_dist.pot_gradient, step_size, steps)
+                p_dist.pot_gradient, step_size, steps,
+                pot_and_gradient=target_density.pot_and_gradient)
         else:
             self.simulate = simulate
 
@@ -59,16 +60,35 @@ class HamiltonianUpdate(MetropolisUpdate):
         state.momentum = self.p_dist.proposal()
 
         # second update
-        q, p = self.simulate(state, state.momentum)
+        q, p, diverged, pot = self.simulate.propagate(state, state.momentum)
         # negation makes the update reversible, but method is symmetric
         # in p already so practically irrelevant
         # p *= -1
 
-        if q is None:
-            pot = np.inf
-        else:
+        if diverged[0]:
+            return HamiltonState(None, momentum=None, pot=np.inf)
+        if pot is None:
             pot = self.target_density.pot(q)
-        return HamiltonState(q, momentum=p, pot=pot)
+        return HamiltonState(q[0], momentum=p[0], pot=pot[0])
+
+    def proposals(self, states):
+        states.momentum = self.p_dist.rvs(states.shape[0])
+        qs, ps, diverged, pots = self.simulate.propagate(
+            states, states.momentum)
+
+        if pots is None:
+            # do not evaluate the target for diverged trajectories
+            pots = np.full(qs.shape[0], np.inf)
+            if not np.all(diverged):
+                pots[~diverged] = self.target_density.pot(qs[~diverged])
+        return HamiltonState(qs, momentum=ps, pot=pots)
+
+    def accept(self, state, candidate):
+        """ Log acceptance probability, including the kinetic energy. """
+        if candidate.momentum is None:
+            return -np.inf  # simulation diverged
+        return (state.pot + self.p_dist.pot(state.momentum) -
+                candidate.pot - self.p_dist.pot(candidate.momentum))
 
     def init_state(self, state):
         if not isinstance(state, HamiltonState):
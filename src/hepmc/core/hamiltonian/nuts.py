@@ -11,95 +11,128 @@ class NUTSUpdate(DualAveragingHMC):
     
     def __init__(self, target_density, p_dist, adapt_schedule,
                  t0=10, step_size_bar0=1, Hbar0=0, gamma=0.05, kappa=0.75,
-                 delta=0.65, Emax=1000, sim_class=HamiltonLeapfrog):
+                 delta=0.65, Emax=1000, max_depth=10, sim_class=HamiltonLeapfrog):
         super().__init__(target_density, p_dist, 1, adapt_schedule,
                          t0, step_size_bar0, Hbar0, gamma, kappa, delta)
         self.Emax = Emax
+        self.max_depth = max_depth
         self.alpha = None
         self.n_alpha = None
-    
+
+        # trajectory of the subtree currently being built
+        self._q_traj = np.empty((2 ** (max_depth - 1), target_density.ndim))
+        self._p_traj = np.empty((2 ** (max_depth - 1), target_density.ndim))
+
+    def kinetic(self, p):
+        return self.p_dist.pot(p)[0]
+
     def proposal(self, current):
-        p0 = self.p_dist.proposal()
-        # u = np.random.uniform()
-        #u = np.random.uniform(0, current.pdf / self.p_dist.pdf(p0))
-        u = np.random.uniform(0, np.exp(self.p_dist.pot(p0) - current.pot))
-        # print('u_max:', current.pdf / self.p_dist.pdf(p0))
-        q_minus, q_plus, p_minus, p_plus, q = current, current, p0, p0, current
-        j, n, s = 0, 1, 1
-
-        while s == 1:
+        if getattr(current, 'pot', None) is None:
+            current = self.init_state(current)
+        q0 = np.array(current, dtype=float, ndmin=2)
+        p0 = np.array(self.p_dist.proposal(), dtype=float, ndmin=2)
+
+        # slice variable, log u with u uniform in [0, exp(-H0)]
+        H0 = float(current.pot) + self.kinetic(p0)
+        log_u = np.log(np.random.uniform()) - H0
+
+        # reuse the gradient computed when the state was reached
+        grad0 = None
+        if self.state_cache is not None:
+            grad0 = self.state_cache.get(q0, self.target).get('pot_gradient')
+        if grad0 is None:
+            grad0 = self.target_density.pot_gradient(q0)
+        grad0 = np.array(grad0, dtype=float, ndmin=2)
+
+        # trajectory edges in backward (index 0) and forward (1) direction
+        edge_q, edge_p, edge_grad = [q0, q0], [p0, p0], [grad0, grad0]
+        q, q_pot, q_grad = q0, float(current.pot), grad0
+        n = 1
+        self.last_accepted = False
+
+        for j in range(self.max_depth):
             v = np.random.choice([-1, 1])
-            if v == -1:
-                (q_minus, p_minus, _, _, q_prime, n_prime, s_prime, self.alpha,
-                 self.n_alpha) = self.build_tree(q_minus, p_minus, u, v, j,
-                                                 self.step_size, q, p0,
-                                                 self.Emax)
-            else:
-                (_, _, q_plus, p_plus, q_prime, n_prime, s_prime, self.alpha,
-                 self.n_alpha) = self.build_tree(q_plus, p_plus, u, v, j,
-                                                 self.step_size, q, p0,
-                                                 self.Emax)
+            side = (v + 1) // 2
+            (edge_q[side], edge_p[side], edge_grad[side], q_prime, pot_prime,
+             grad_prime, n_prime, s_prime, self.alpha,
+             self.n_alpha) = self.build_tree(
+                edge_q[side], edge_p[side], edge_grad[side], log_u, v, j, H0)
 
-            if s_prime == 1 and np.random.uniform() < min(1, n_prime/n):
-                q = q_prime
+            if s_prime and np.random.uniform() < n_prime / n:
+                q, q_pot, q_grad = q_prime, pot_prime, grad_prime
+                self.last_accepted = True
 
-            dq = q_plus - q_minus
             n = n + n_prime
-            s = s_prime * (np.dot(dq, p_minus) >= 0) * (np.dot(dq, p_plus) >= 0)
-            j = j + 1
+            dq = edge_q[1] - edge_q[0]
+            if not (s_prime and np.sum(dq * edge_p[0]) >= 0 and
+                    np.sum(dq * edge_p[1]) >= 0):
+                break
 
-        #q_pdf = self.target_density.pdf(q)
-        #return MetropolisState(q, pdf=q_pdf)
-        q_pot = self.target_density.pot(q)
-        return MetropolisState(q, pot=q_pot)
+        if self.state_cache is not None:
+            self.state_cache.update(q[0], self.target, pot=q_pot,
+                                    pot_gradient=q_grad[0])
+        return MetropolisState(q[0], pot=q_pot)
 
     def next_state(self, state, iteration):
         next_state = self.proposal(state)
         self.adapt(iteration, state, next_state, self.alpha/self.n_alpha)
         return next_state
-    
-    def build_tree(self, q, p, u, v, j, step_size, q0, p0, Emax):
-        if j == 0:
-            # Base case - take one leapfrog step in the direction v.
-            q_prime, p_prime = self.simulate_custom(q, p, 1, v * step_size)
-    
-            dE = self.target_density.pdf(q_prime)/self.p_dist.pdf(p_prime)
-            # print('dE:',dE)
-            dE0 = self.target_density.pdf(q0)/self.p_dist.pdf(p0)
-            # print('dE0:',dE0)
-            # print('u:', u)
-            n_prime = (u <= dE)
-            s_prime = (u < Emax*dE)
-            return (q_prime, p_prime, q_prime, p_prime, q_prime, n_prime,
-                    s_prime, min(1, dE/dE0), 1)
-        else:
-            # print('RECURSION!')
-            # Recursion - implicitly build the left and right subtrees.
-            (q_minus, p_minus, q_plus, p_plus, q_prime, n_prime, s_prime,
-             alpha_prime, n_alpha_prime) = self.build_tree(
-                    q, p, u, v, j - 1, step_size, q0, p0, Emax)
-
-            if s_prime == 1:
-                if v == -1:
-                    (q_minus, p_minus, _, _, q_2prime, n_2prime, s_2prime,
-                     alpha_2prime, n_alpha_2prime) = self.build_tree(
-                        q_minus, p_minus, u, v, j - 1, step_size, q0, p0, Emax)
-                else:
-                    (_, _, q_plus, p_plus, q_2prime, n_2prime, s_2prime,
-                     alpha_2prime, n_alpha_2prime) = self.build_tree(
-                        q_plus, p_plus, u, v, j - 1, step_size, q0, p0, Emax)
-                if np.random.uniform() < n_2prime/(n_prime + n_2prime):
-                    q_prime = q_2prime
-    
-                alpha_prime = alpha_prime + alpha_2prime
-                n_alpha_prime = n_alpha_prime + n_alpha_2prime
-    
-                dq = q_plus - q_minus
-                s_prime = (s_2prime * (np.dot(dq, p_minus) >= 0) *
-                           (np.dot(dq, p_plus) >= 0))
-                n_prime = n_prime + n_2prime
-            return (q_minus, p_minus, q_plus, p_plus, q_prime, n_prime,
-                    s_prime, alpha_prime, n_alpha_prime)
-        
-    #def accept(self, state, candidate):
-    #    return 1  # accept all
+
+    def build_tree(self, q, p, grad, log_u, v, j, H0):
+        """ Build a subtree of 2^j leapfrog steps in direction v.
+
+        The leaves are stored in preallocated buffers; the U-turn
+        criterion of each (sub-)subtree is checked as soon as its last leaf
+        is known, comparing it to the first leaf (the checkpoint) of the
+        subtree. A candidate is selected uniformly among the leaves in the
+        slice while the subtree is built.
+
+        :return: Tuple (q, p, grad, q_prime, pot_prime, grad_prime, n_prime,
+            s_prime, alpha, n_alpha) where q, p and grad describe the new
+            edge of the trajectory and q_prime is the candidate with
+            potential pot_prime and gradient grad_prime.
+        """
+        q_traj, p_traj = self._q_traj, self._p_traj
+        step_size = v * self.step_size
+        q_prime = pot_prime = grad_prime = None
+        n_prime = 0
+        alpha = 0.
+
+        for k in range(2 ** j):
+            with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+                q, p, grad, pot = self.simulate.step(
+                    q, p, grad, step_size, with_pot=True)
+            if np.all(np.isfinite(q)) and np.all(np.isfinite(grad)):
+                if pot is None:
+                    pot = self.target_density.pot(q)
+                pot = pot[0]
+                H = pot + self.kinetic(p)
+            else:
+                pot = H = np.inf
+            if np.isnan(H):
+                H = np.inf
+
+            alpha += min(1., np.exp(H0 - H))
+            if log_u <= -H:
+                n_prime += 1
+                if np.random.uniform() * n_prime < 1:
+                    q_prime, pot_prime, grad_prime = q, pot, grad
+
+            if not log_u < self.Emax - H:
+                # divergent trajectory
+                return (q, p, grad, q_prime, pot_prime, grad_prime, n_prime,
+                        False, alpha, k + 1)
+
+            q_traj[k], p_traj[k] = q[0], p[0]
+            # check all subtrees that end with leaf k
+            length = 2
+            while length <= 2 ** j and (k + 1) % length == 0:
+                start = k + 1 - length
+                dq = v * (q_traj[k] - q_traj[start])
+                if dq.dot(p_traj[start]) < 0 or dq.dot(p_traj[k]) < 0:
+                    return (q, p, grad, q_prime, pot_prime, grad_prime,
+                            n_prime, False, alpha, k + 1)
+                length *= 2
+
+        return (q, p, grad, q_prime, pot_prime, grad_prime, n_prime, True,
+                alpha, 2 ** j)
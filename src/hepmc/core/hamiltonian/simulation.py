@@ -3,7 +3,8 @@ import numpy as np
 
 class HamiltonLeapfrog(object):
 
-    def __init__(self, pot_gradient, kin_gradient, step_size, steps):
+    def __init__(self, pot_gradient, kin_gradient, step_size, steps,
+                 pot_and_gradient=None):
         """ Leapfrog method to simulate Hamiltonian propagation.
 
         This method is based on a general structure of the Hamiltonian of
@@ -16,43 +17,139 @@ class HamiltonLeapfrog(object):
             with respect to p.
         :param step_size: Size of a simulation step in "time"-space.
         :param steps: Number of iterations to perform in each call.
+        :param pot_and_gradient: Function returning the potential and its
+            gradient at once. If given, it is used for the last step so that
+            the potential of the end point is known without an additional
+            evaluation.
 
         """
         self.kin_gradient = kin_gradient
         self.pot_gradient = pot_gradient
+        self.pot_and_gradient = pot_and_gradient
         self.step_size = step_size
         self.steps = steps
 
-    def __call__(self, q_init, p_init):
+    def __call__(self, q_init, p_init, step_size=None, steps=None):
         """ Propagate the state q, p using a given number of simulation steps.
 
         :param q_init: Initial space variable.
         :param p_init: Initial momentum variable.
+        :param step_size: Step size to use instead of self.step_size.
+        :param steps: Number of steps to use instead of self.steps.
         :return: Tuple (q_next, p_next) of state after given number of
-            simulation steps.
+            simulation steps, or (None, None) if the simulation diverged.
         """
-        p = np.array(p_init, copy=True, ndmin=1, subok=True)
-        q = np.array(q_init, copy=True, ndmin=1, subok=True)
-        pot_grad = self.pot_gradient(q)[0]
-        try:
-            for i in range(self.steps):
-                p -= self.step_size / 2 * pot_grad
-                q += self.step_size * self.kin_gradient(p)[0]
-                pot_grad = self.pot_gradient(q)[0]
-                p -= self.step_size / 2 * pot_grad
-        except RuntimeWarning:
+        q, p, diverged, _ = self.propagate(
+            np.ravel(q_init), np.ravel(p_init), step_size, steps)
+        if diverged[0]:
             # overflow, division
             return None, None
+        return q[0], p[0]
+
+    def constrain(self, q, p):
+        """ Hook to handle constraints after each position update.
+
+        :param q: Space variables of the active trajectories.
+        :param p: Momentum variables of the active trajectories.
+        :return: Tuple (q, p) of constrained variables.
+        """
         return q, p
 
-class WallHMCLeapfrog(object):
+    def step(self, q, p, pot_grad, step_size, with_pot=False):
+        """ Perform a single leapfrog step of several trajectories.
+
+        :param q: Space variables, shape (n_traj, ndim).
+        :param p: Momentum variables, shape (n_traj, ndim).
+        :param pot_grad: Potential gradient at q, shape (n_traj, ndim).
+        :param step_size: Scalar or array of shape (n_traj, 1).
+        :param with_pot: If true and pot_and_gradient is set, also return
+            the potential at the new position.
+        :return: Tuple (q_next, p_next, pot_grad_next, pot_next) where
+            pot_next is None unless computed.
+        """
+        p = p - step_size / 2 * pot_grad
+        q = q + step_size * self.kin_gradient(p)
+        q, p = self.constrain(q, p)
+        if with_pot and self.pot_and_gradient is not None:
+            pot, pot_grad = self.pot_and_gradient(q)
+        else:
+            pot, pot_grad = None, self.pot_gradient(q)
+        p = p - step_size / 2 * pot_grad
+        return q, p, pot_grad, pot
+
+    def propagate(self, qs, ps, step_size=None, steps=None):
+        """ Propagate several trajectories simultaneously.
+
+        Trajectories for which the position, momentum or potential gradient
+        become non-finite are marked as diverged and are not propagated
+        (nor is the gradient evaluated for them) any further.
+
+        :param qs: Initial space variables, shape (n_traj, ndim).
+        :param ps: Initial momentum variables, shape (n_traj, ndim).
+        :param step_size: Scalar or array of shape (n_traj,) of step sizes.
+            Defaults to self.step_size.
+        :param steps: Number of simulation steps, defaults to self.steps.
+        :return: Tuple (q_next, p_next, diverged, pot_next) where q_next
+            and p_next have shape (n_traj, ndim) and diverged is a boolean
+            mask. pot_next holds the potential at q_next (inf for diverged
+            trajectories) if pot_and_gradient is set, otherwise it is None.
+        """
+        if step_size is None:
+            step_size = self.step_size
+        if steps is None:
+            steps = self.steps
+        p = np.array(ps, dtype=float, copy=True, ndmin=2)
+        q = np.array(qs, dtype=float, copy=True, ndmin=2)
+        step_size = np.broadcast_to(
+            np.asarray(step_size, dtype=float).reshape(-1, 1), (q.shape[0], 1))
+
+        pot = None
+        if self.pot_and_gradient is not None:
+            pot = np.full(q.shape[0], np.inf)
+
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            if steps == 0 and pot is not None:
+                pot, pot_grad = self.pot_and_gradient(q)
+            else:
+                pot_grad = self.pot_gradient(q)
+            diverged = ~np.all(np.isfinite(pot_grad), axis=1)
+
+            for i in range(steps):
+                if np.any(diverged):
+                    active = np.flatnonzero(~diverged)
+                    if active.size == 0:
+                        break
+                else:
+                    active = slice(None)
+
+                q_active, p_active, grad_active, pot_active = self.step(
+                    q[active], p[active], pot_grad[active], step_size[active],
+                    with_pot=(i == steps - 1))
 
-    def __init__(self, pot_gradient, kin_gradient, step_size, steps, lim_lower, lim_upper):
+                q[active], p[active] = q_active, p_active
+                pot_grad[active] = grad_active
+                diverged[active] = ~(np.all(np.isfinite(q_active), axis=1) &
+                                     np.all(np.isfinite(p_active), axis=1) &
+                                     np.all(np.isfinite(grad_active), axis=1))
+                if pot_active is not None:
+                    pot[active] = pot_active
+
+        if pot is not None:
+            pot[diverged] = np.inf
+        return q, p, diverged, pot
+
+
+class WallHMCLeapfrog(HamiltonLeapfrog):
+
+    def __init__(self, pot_gradient, kin_gradient, step_size, steps,
+                 lim_lower, lim_upper, pot_and_gradient=None):
         """ Leapfrog method to simulate Hamiltonian propagation.
 
         This method is based on a general structure of the Hamiltonian of
         H = kinetic(p) + potential(q),
         where q is the "space" and p the "momentum" variable.
+        The trajectories are reflected at the walls of the box given by
+        lim_lower and lim_upper.
 
         :param pot_gradient: Partial derivative of the potential with
             respect to q.
@@ -60,48 +157,27 @@ class WallHMCLeapfrog(object):
             with respect to p.
         :param step_size: Size of a simulation step in "time"-space.
         :param steps: Number of iterations to perform in each call.
+        :param lim_lower: Lower limits of the box, one per dimension.
+        :param lim_upper: Upper limits of the box, one per dimension.
+        :param pot_and_gradient: Function returning the potential and its
+            gradient at once.
 
         """
-        self.kin_gradient = kin_gradient
-        self.pot_gradient = pot_gradient
-        self.step_size = step_size
-        self.steps = steps
+        super().__init__(pot_gradient, kin_gradient, step_size, steps,
+                         pot_and_gradient)
         self.lim_lower = lim_lower
         self.lim_upper = lim_upper
 
-    def __call__(self, q_init, p_init):
-        """ Propagate the state q, p using a given number of simulation steps.
-
-        :param q_init: Initial space variable.
-        :param p_init: Initial momentum variable.
-        :return: Tuple (q_next, p_next) of state after given number of
-            simulation steps.
-        """
-        p = np.array(p_init, copy=True, ndmin=1, subok=True)
-        q = np.array(q_init, copy=True, ndmin=1, subok=True)
-        pot_grad = self.pot_gradient(q)[0]
-        try:
-            for i in range(self.steps):
-                p -= self.step_size / 2 * pot_grad
-                q += self.step_size * self.kin_gradient(p)[0]
-
-                # handle constraints by wall hitting
-                while(True):
-                    l_c = q < self.lim_lower
-                    u_c = q > self.lim_upper
-
-                    if l_c.any():
-                        q[l_c] = 2*self.lim_lower[l_c[0]] - q[l_c]
-                        p[l_c] = -p[l_c]
-                    elif u_c.any():
-                        q[u_c] = 2*self.lim_upper[u_c[0]] - q[u_c]
-                        p[u_c] = -p[u_c]
-                    else:
-                        break
-
-                pot_grad = self.pot_gradient(q)[0]
-                p -= self.step_size / 2 * pot_grad
-        except RuntimeWarning:
-            # overflow, division
-            return None, None
+    def constrain(self, q, p):
+        # handle constraints by wall hitting
+        while True:
+            finite = np.isfinite(q)
+            l_c = finite & (q < self.lim_lower)
+            u_c = finite & (q > self.lim_upper)
+            if not (l_c.any() or u_c.any()):
+                break
+
+            q = np.where(l_c, 2 * self.lim_lower - q, q)
+            q = np.where(u_c, 2 * self.lim_upper - q, q)
+            p = np.where(l_c | u_c, -p, p)
         return q, p
@@ -49,11 +49,16 @@ def arccot(x):
     return np.pi/2 - np.arctan(x)
 
 
-def integrator(q, pot_gradient, v, du, trafo, jac, stepsize, nsteps):
+def integrator(q, pot_gradient, pot_and_gradient, v, du, trafo, jac, stepsize,
+               nsteps):
     cumsinq = np.cumprod(np.sin(q))
 
     # make a half step for velocity
     v = v - stepsize/2 * du/np.concatenate(([1], cumsinq[:-1]**2))
+
+    if nsteps == 0:
+        # no step is made, the potential is that of the initial position
+        u = pot_and_gradient(trafo(q))[0][0]
     
     # alternate full steps for position and momentum
     for l in range(nsteps):
@@ -80,11 +85,14 @@ def integrator(q, pot_gradient, v, du, trafo, jac, stepsize, nsteps):
         
         # make last half step for velocity
         cumsinq = np.cumprod(np.sin(q))
-        du = pot_gradient(trafo(q))[0]*jac
-        if l != nsteps-1:
+        if l == nsteps-1:
+            u, du = pot_and_gradient(trafo(q))
+            u, du = u[0], du[0]*jac
+        else:
+            du = pot_gradient(trafo(q))[0]*jac
             v = v - stepsize * du/np.concatenate(([1], cumsinq[:-1]**2))
     
-    return q, v, du
+    return q, v, du, u
 
 
 class StaticSphericalHMC(HamiltonianUpdate):
@@ -130,8 +138,13 @@ class StaticSphericalHMC(HamiltonianUpdate):
             state.theta = self.x_to_theta(np.array(state, copy=False))
         if state.tag is None:
             state.tag = self.log_weight(state.theta)
+        if state.pot_gradient is None and self.state_cache is not None:
+            self.state_cache.restore(state, self.target)
         if state.pot_gradient is None:
-            state.pot_gradient = self.target_density.pot_gradient(state)[0]
+            pot, pot_gradient = self.target_density.pot_and_gradient(state)
+            state.pot_gradient = pot_gradient[0]
+            if state.pot is None:
+                state.pot = pot
         if state.weight is None:
             state.weight = np.exp(self.log_weight(state.theta))
 
@@ -163,8 +176,10 @@ class StaticSphericalHMC(HamiltonianUpdate):
                     self.stepsize_min)
         
         # integrate
-        q, v, du = integrator(q, self.target_density.pot_gradient, v, du,
-                              self.theta_to_x, self.J_xtheta, stepsize, nsteps)
+        q, v, du, pot = integrator(
+            q, self.target_density.pot_gradient,
+            self.target_density.pot_and_gradient, v, du,
+            self.theta_to_x, self.J_xtheta, stepsize, nsteps)
 
         z = (v*np.concatenate(([1], cumsinq[:-1])) -
              stepsize/2 * du/np.concatenate(([1], cumsinq[:-1])))
@@ -174,7 +189,6 @@ class StaticSphericalHMC(HamiltonianUpdate):
         #H_proposal = U + .5*z.dot(z)
         
         x = self.theta_to_x(q)
-        pot = self.target_density.pot(x)
         #return SphericalHMCState(x, momentum=z, tag=self.log_weight(q),
         #                         pot_gradient=du, pdf=prob, theta=q)
         return SphericalHMCState(x, momentum=z, pot_gradient=du, pot=pot, theta=q)
@@ -184,11 +198,11 @@ class StaticSphericalHMC(HamiltonianUpdate):
         try:
             #prob = (candidate.pdf * self.p_dist.pdf(candidate.momentum) /
             #        state.pdf / self.p_dist.pdf(state.momentum))
-            U_current = self.target_density.pot(state)
+            U_current = state.pot
             #if np.isinf(U_current): # shouldn't be necessary
             #    return 0
             H_current = U_current + .5*state.momentum.dot(state.momentum)
-            U_proposal = self.target_density.pot(candidate)
+            U_proposal = candidate.pot
             if np.isinf(U_proposal):
                 return -np.inf
             H_proposal = U_proposal + .5*candidate.momentum.dot(candidate.momentum)
@@ -211,7 +225,8 @@ class StaticSphericalHMC(HamiltonianUpdate):
             log_accept = self.accept(state, candidate)
 
         #if not np.isinf(log_accept) and np.log(np.random.rand()) < min(0, log_accept):
-        if np.log(np.random.rand()) < log_accept:
+        self.last_accepted = bool(np.log(np.random.rand()) < log_accept)
+        if self.last_accepted:
             next_state = candidate
         else:
             next_state = state
@@ -257,12 +272,15 @@ class StaticSphericalHMC(HamiltonianUpdate):
         weights[0] = state.weight
 
         batch_accept = deque(maxlen=batch_length)
+        accepted = np.zeros(sample_size, dtype=bool)
+        accepted[0] = True
         current_seq = 1 # current sequence length
         max_seq = 1 # maximal sequence length
         skip = 1
         for i in range(1, sample_size):
             state = self.next_state(state, i)
-            if not np.array_equal(state, chain[i - 1]):
+            accepted[i] = self.last_accepted
+            if accepted[i]:
                 batch_accept.append(1)
                 if current_seq > max_seq:
                     max_seq = current_seq
@@ -303,7 +321,8 @@ class StaticSphericalHMC(HamiltonianUpdate):
             chain[tagged[parser]] = parser(chain[tagged[parser]], tags[parser])
 
         #weights = np.exp(log_weights - np.median(log_weights))
-        sample = Sample(data=chain, target=self.target_density, weights=weights)
+        sample = Sample(data=chain, target=self.target_density, weights=weights,
+                        accepted=accepted)
         return sample
 
 
@@ -311,6 +330,10 @@ class DualAveragingSphericalHMC(StaticSphericalHMC):
     """
     Adapts the stepsize by dual averaging
     """
+
+    adapt_attributes = ('stepsize', 'stepsize_bar', 'Hbar', 'mu',
+                        'stepsize_min', 'stepsize_max',
+                        'nsteps_min', 'nsteps_max')
     
     def __init__(self, target_density, simulation_length,
                  adapt_schedule, lim_lower=None, lim_upper=None, t0=10,
@@ -347,7 +370,7 @@ class DualAveragingSphericalHMC(StaticSphericalHMC):
         stepsize = 1.
         
         # initialization
-        current_u = self.target_density.pot(current)
+        current_u = current.pot
         current_du = current.pot_gradient
         
         # sample velocity
@@ -357,12 +380,12 @@ class DualAveragingSphericalHMC(StaticSphericalHMC):
         E_cur = current_u + .5*np.sum(current_z**2)
         
         # integrate one step
-        proposal_q, proposal_z, proposal_du = integrator(
-            current.theta, self.target_density.pot_gradient, current_z,
+        proposal_q, proposal_z, proposal_du, proposal_u = integrator(
+            current.theta, self.target_density.pot_gradient,
+            self.target_density.pot_and_gradient, current_z,
             current_du, self.theta_to_x, self.J_xtheta, stepsize, nsteps=1)
         
         # evaluate energy at the end of the trajectory
-        proposal_u = self.target_density.pot(self.theta_to_x(proposal_q))
         E_prp = proposal_u + .5*np.sum(proposal_z**2)
 
         # aprob = np.exp(-E_cur + E_prp)
@@ -378,10 +401,10 @@ class DualAveragingSphericalHMC(StaticSphericalHMC):
         while aprob**a > 2**(-a):
             stepsize = 2.**a * stepsize
             # print('stepsize:', stepsize)
-            proposal_q, proposal_z, proposal_du = integrator(
-                current.theta, self.target_density.pot_gradient, current_z,
+            proposal_q, proposal_z, proposal_du, proposal_u = integrator(
+                current.theta, self.target_density.pot_gradient,
+                self.target_density.pot_and_gradient, current_z,
                 proposal_du, self.theta_to_x, self.J_xtheta, stepsize, nsteps=1)
-            proposal_u = self.target_density.pot(self.theta_to_x(proposal_q))
             E_prp = proposal_u + .5*np.sum(proposal_z**2)
             aprob = np.exp(-E_cur + E_prp)
             #aprob = DualAveragingSphericalHMC.accept(
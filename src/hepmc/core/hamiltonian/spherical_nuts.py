@@ -3,10 +3,16 @@ from .spherical_hmc import DualAveragingSphericalHMC, \
 import numpy as np
 
 
-def integrator(q, pot_gradient, z, trafo, jac, stepsize, nsteps):
+def integrator(q, pot_gradient, pot_and_gradient, z, trafo, jac, stepsize,
+               nsteps):
     cumsinq = np.cumprod(np.sin(q))
     v = z / np.concatenate(([1], cumsinq[:-1]))
-    du = pot_gradient(trafo(q))[0] * jac
+    if nsteps == 0:
+        # no step is made, the potential is that of the initial position
+        u, du = pot_and_gradient(trafo(q))
+        u, du = u[0], du[0] * jac
+    else:
+        du = pot_gradient(trafo(q))[0] * jac
     
     # make a half step for velocity
     v = v - stepsize/2 * du/np.concatenate(([1], cumsinq[:-1]**2))
@@ -36,14 +42,17 @@ def integrator(q, pot_gradient, z, trafo, jac, stepsize, nsteps):
         
         # make last half step for velocity
         cumsinq = np.cumprod(np.sin(q))
-        du = pot_gradient(trafo(q))[0] * jac
-        if l != nsteps-1:
+        if l == nsteps-1:
+            u, du = pot_and_gradient(trafo(q))
+            u, du = u[0], du[0] * jac
+        else:
+            du = pot_gradient(trafo(q))[0] * jac
             v = v - stepsize * du/np.concatenate(([1], cumsinq[:-1]**2))
     
     z = v*np.concatenate(([1], cumsinq[:-1])) - \
         stepsize/2 * du/np.concatenate(([1], cumsinq[:-1]))
     
-    return q, z
+    return q, z, u
 
 
 class SphericalNUTS(DualAveragingSphericalHMC):
@@ -61,6 +70,7 @@ class SphericalNUTS(DualAveragingSphericalHMC):
         self.Emax = Emax
         self.alpha = None
         self.n_alpha = None
+        self.moved = None
         
     def proposal(self, current):
         # initialization
@@ -74,21 +84,27 @@ class SphericalNUTS(DualAveragingSphericalHMC):
         u = np.random.uniform()
         z_minus = z_plus = current.momentum = z0
 
+        # energy at the start of the trajectory
+        E0 = -self.target_density.pot(self.theta_to_x(q))[0] - \
+            .5*np.sum(z0**2)
+
         j, n, s = 0, 1, 1
+        self.moved = False
 
         while s == 1:
             v = np.random.choice([-1, 1])
             if v == -1:
                 (q_minus, z_minus, _, _, q_prime, n_prime, s_prime,
                  self.alpha, self.n_alpha) = self.build_tree(
-                    q_minus, z_minus, u, v, j, self.stepsize, q, z0, self.Emax)
+                    q_minus, z_minus, u, v, j, self.stepsize, E0, self.Emax)
             else:
                 (_, _, q_plus, z_plus, q_prime, n_prime, s_prime, self.alpha,
                  self.n_alpha) = self.build_tree(
-                    q_plus, z_plus, u, v, j, self.stepsize, q, z0, self.Emax)
+                    q_plus, z_plus, u, v, j, self.stepsize, E0, self.Emax)
 
             if s_prime == 1 and np.random.uniform() < min(1, n_prime/n):
                 q = q_prime
+                self.moved = True
 
             dq = q_plus - q_minus
             n = n + n_prime
@@ -99,17 +115,15 @@ class SphericalNUTS(DualAveragingSphericalHMC):
         prob = self.target_density.pdf(x)
         return SphericalHMCState(x, tag=self.log_weight(q), pdf=prob, theta=q)
 
-    def build_tree(self, q, z, u, v, j, stepsize, q0, z0, Emax):
+    def build_tree(self, q, z, u, v, j, stepsize, E0, Emax):
         if j == 0:
             # Base case - take one leapfrog step in the direction v.
-            q_prime, z_prime = integrator(
-                q, self.target_density.pot_gradient, z, self.theta_to_x,
+            q_prime, z_prime, u_prime = integrator(
+                q, self.target_density.pot_gradient,
+                self.target_density.pot_and_gradient, z, self.theta_to_x,
                 self.J_xtheta, v*stepsize, nsteps=1)
     
-            E = -self.target_density.pot(self.theta_to_x(q_prime)) - \
-                .5*np.sum(z_prime**2)
-            E0 = -self.target_density.pot(self.theta_to_x(q0)) - \
-                 .5*np.sum(z0**2)
+            E = -u_prime - .5*np.sum(z_prime**2)
             dE = E - E0
             
             n_prime = (np.log(u) - dE <= 0)
@@ -120,16 +134,16 @@ class SphericalNUTS(DualAveragingSphericalHMC):
             # Recursion - implicitly build the left and right subtrees.
             (q_minus, z_minus, q_plus, z_plus, q_prime, n_prime, s_prime,
              alpha_prime, n_alpha_prime) = self.build_tree(
-                q, z, u, v, j - 1, stepsize, q0, z0, Emax)
+                q, z, u, v, j - 1, stepsize, E0, Emax)
             if s_prime == 1:
                 if v == -1:
                     (q_minus, z_minus, _, _, q_2prime, n_2prime, s_2prime,
                      alpha_2prime, n_alpha_2prime) = self.build_tree(
-                        q_minus, z_minus, u, v, j - 1, stepsize, q0, z0, Emax)
+                        q_minus, z_minus, u, v, j - 1, stepsize, E0, Emax)
                 else:
                     (_, _, q_plus, z_plus, q_2prime, n_2prime, s_2prime,
                      alpha_2prime, n_alpha_2prime) = self.build_tree(
-                        q_plus, z_plus, u, v, j - 1, stepsize, q0, z0, Emax)
+                        q_plus, z_plus, u, v, j - 1, stepsize, E0, Emax)
                 if np.random.uniform() < n_2prime/max(n_prime + n_2prime, 1.):
                     q_prime = q_2prime
     
@@ -146,6 +160,12 @@ class SphericalNUTS(DualAveragingSphericalHMC):
     def accept(self, state, candidate):
         return 1  # accept all
 
+    def next_state(self, state, iteration):
+        next_state = super().next_state(state, iteration)
+        # the candidate is always accepted, but may be the current point
+        self.last_accepted = self.last_accepted and self.moved
+        return next_state
+
     def adapt(self, iteration, prev, current, accept):
         super().adapt(iteration, prev, current, self.alpha / self.n_alpha)
 
@@ -6,9 +6,14 @@ from ..sampling import Sample
 from ..util import is_power_of_ten
 
 
-def integrator(q, pot_gradient, v, du, lim_lower, lim_upper, stepsize, nsteps):
+def integrator(q, pot_gradient, pot_and_gradient, v, du, lim_lower, lim_upper,
+               stepsize, nsteps):
     # make a half step for velocity
     v = v - stepsize/2 * du
+
+    if nsteps == 0:
+        # no step is made, the potential is that of the initial position
+        u = pot_and_gradient(q)[0][0]
     
     # alternate full steps for position and momentum
     for l in range(nsteps):
@@ -29,10 +34,14 @@ def integrator(q, pot_gradient, v, du, lim_lower, lim_upper, stepsize, nsteps):
             else:
                 break
 
-        # make full step for velocity
-        du = pot_gradient(q)[0]
+        # make full step for velocity, the potential is only needed at the end
+        if l == nsteps-1:
+            u, du = pot_and_gradient(q)
+            u, du = u[0], du[0]
+        else:
+            du = pot_gradient(q)[0]
         if np.isinf(du).any():
-            return None, None, None            
+            return None, None, None, None
 
         if l != nsteps-1:
             v = v - stepsize * du
@@ -40,7 +49,7 @@ def integrator(q, pot_gradient, v, du, lim_lower, lim_upper, stepsize, nsteps):
     # make last half step for velocity
     v = v - stepsize/2 * du
     
-    return q, v, du
+    return q, v, du, u
 
 
 class WallHMC(HamiltonianUpdate):
@@ -97,24 +106,24 @@ class WallHMC(HamiltonianUpdate):
                     self.stepsize_min)
         
         # integrate
-        q, v, du = integrator(q, self.target_density.pot_gradient, v, du,
-                              self.lim_lower, self.lim_upper, stepsize, nsteps)
+        q, v, du, u = integrator(
+            q, self.target_density.pot_gradient,
+            self.target_density.pot_and_gradient, v, du,
+            self.lim_lower, self.lim_upper, stepsize, nsteps)
 
         if q is None:
             return None
 
-        #pot = self.target_density.pot(q)
-        #return HamiltonState(q, momentum=v, pot_gradient=du, pot=pot)
-        return HamiltonState(q, momentum=v)
+        return HamiltonState(q, momentum=v, pot=u)
 
     def accept(self, state, candidate):
         """Return the logarithm of the acceptance probability."""
         try:
-            U_current = self.target_density.pot(state)
+            U_current = state.pot
             #if np.isinf(U_current): # shouldn't be necessary
             #    return 0
             H_current = U_current + .5*state.momentum.dot(state.momentum)
-            U_proposal = self.target_density.pot(candidate)
+            U_proposal = candidate.pot
             if np.isinf(U_proposal):
                 return -np.inf
             H_proposal = U_proposal + .5*candidate.momentum[0].dot(candidate.momentum[0])
@@ -128,6 +137,7 @@ class WallHMC(HamiltonianUpdate):
     def next_state(self, state, iteration):
         candidate = self.proposal(state)
         if candidate is None:
+            self.last_accepted = False
             return state
 
         try:
@@ -139,7 +149,8 @@ class WallHMC(HamiltonianUpdate):
             log_accept = self.accept(state, candidate)
 
         #if not np.isinf(log_accept) and np.log(np.random.rand()) < min(0, log_accept):
-        if np.log(np.random.rand()) < log_accept:
+        self.last_accepted = bool(np.log(np.random.rand()) < log_accept)
+        if self.last_accepted:
             next_state = candidate
         else:
             next_state = state
@@ -1,2 +1,2 @@
 __all__ = ['PlainMC', 'ImportanceMC', 'MultiChannelMC', 'StratifiedMC',
-           'VegasMC', 'GridVolumes', 'MultiChannel']
+           'VegasMC', 'GridVolumes', 'MultiChannel', 'IntegrationSample']
@@ -1,10 +1,15 @@
+import os
 import numpy as np
+from multiprocessing import Pool
 from typing import Tuple, Optional
 from tqdm import tqdm
 
-from ..util import online_variance, is_power_of_ten
+from ..util import online_variance, is_power_of_ten, adaptive_batch_size
 from ..density import Distribution
 from ..sampling import Sample
+from .integration import (IntegrationSample, _save_state, _load_state,
+                          _check_state)
+from .multi_channel import ChannelsSample
 
 
 class ImportanceMC(object):
@@ -17,7 +22,7 @@ class ImportanceMC(object):
     equivalent to plain MC.
     """
 
-    def __init__(self, target: Distribution, dist: Distribution, name: str = "MC Importance") -> None:
+    def __init__(self, target: Distribution, dist: Distribution, name: str = "MC Importance", max_batch_size: int = 1000000) -> None:
         """
         Parameters
         ----------
@@ -28,12 +33,23 @@ class ImportanceMC(object):
         name
             Name of the method that can be used as label in
             plotting routines (can be changed to name parameters).
+        max_batch_size
+            Maximal number of points generated at once, limiting the
+            memory used by a batch.
         """
         self.method_name = name
 
         self.target = target
         self.ndim = target.ndim
         self.dist = dist
+        self.max_batch_size = max_batch_size
+
+        # points generated and points with non-zero target in all calls
+        self.trials = 0
+        self.nonzero = 0
+        # non-zero points generated in excess, used first in the next call
+        self._surplus_xs = np.empty((0, self.ndim))
+        self._surplus_ys = np.empty(0)
 
     ## sequential version
     #def __call__(self, target, eval_count) -> Tuple[Sample, float, float]:
@@ -92,15 +108,21 @@ class ImportanceMC(object):
     #    return sample
 
     # numpy version
-    def integrate(self, sample_size, batch_size: Optional[int] = 10000) -> Tuple[Sample, float, float]:
+    def integrate(self, sample_size, batch_size: Optional[int] = None) -> Tuple[Sample, float, float]:
         """Approximate the integral of the target distribution.
 
+        By default, the number of points generated at once is chosen from
+        the fraction of points with non-zero target observed so far, such
+        that each batch is expected to yield the remaining number of points.
+        Points generated in excess are kept and used in the next call.
+
         Parameters
         ----------
         sample_size
             The size of the sample to be generated.
         batch_size
-            Number of proposals to be generated at once.
+            Fixed number of proposals to be generated at once (instead of
+            choosing it adaptively).
 
         Returns
         -------
@@ -110,46 +132,45 @@ class ImportanceMC(object):
         xs = np.empty((sample_size, self.ndim))
         ys = np.empty(sample_size)
 
-        n_todo = sample_size
-        trials = 0
-        #indices = np.arange(eval_count)
-        #while indices.size > 0:
-        with tqdm(total=sample_size) as pbar:
-            while n_todo > 0:
-                #trials += indices.size
-                #x = self.dist.rvs(indices.size)
-                x = self.dist.rvs(batch_size)
+        # points left over from the previous call
+        n_done = min(sample_size, self._surplus_ys.size)
+        xs[:n_done] = self._surplus_xs[:n_done]
+        ys[:n_done] = self._surplus_ys[:n_done]
+        self._surplus_xs = self._surplus_xs[n_done:]
+        self._surplus_ys = self._surplus_ys[n_done:]
+
+        with tqdm(total=sample_size, initial=n_done) as pbar:
+            while n_done < sample_size:
+                n_todo = sample_size - n_done
+                size = batch_size or adaptive_batch_size(
+                    n_todo, self.nonzero, self.trials, self.max_batch_size)
+                x = self.dist.rvs(size)
                 y = self.target.pdf(x)
-                #in_bounds = y != 0.
                 in_bounds = np.where(y != 0.)[0]
-                n_accept = in_bounds.size
-                #xs[indices[in_bounds]] = x[in_bounds]
-                #ys[indices[in_bounds]] = y[in_bounds]
-                #indices = indices[np.logical_not(in_bounds)]
-                if n_accept <= n_todo:
-                    xs[sample_size-n_todo:sample_size-n_todo+n_accept] = x[in_bounds]
-                    ys[sample_size-n_todo:sample_size-n_todo+n_accept] = y[in_bounds]
-                    trials += batch_size
-                else:
-                    n_accept = n_todo
-                    in_bounds = in_bounds[:n_todo]
-                    xs[sample_size-n_todo:] = x[in_bounds]
-                    ys[sample_size-n_todo:] = y[in_bounds]
-                    last_index = in_bounds[-1]
-                    trials += last_index + 1
-                n_todo -= n_accept
+                self.trials += size
+                self.nonzero += in_bounds.size
+
+                n_accept = min(in_bounds.size, n_todo)
+                xs[n_done:n_done+n_accept] = x[in_bounds[:n_accept]]
+                ys[n_done:n_done+n_accept] = y[in_bounds[:n_accept]]
+                if n_accept < in_bounds.size:
+                    self._surplus_xs = x[in_bounds[n_accept:]]
+                    self._surplus_ys = y[in_bounds[n_accept:]]
+                n_done += n_accept
                 pbar.update(n_accept)
 
-        print('Sampling efficiency:', sample_size/trials)
+        # fraction of the sampling distribution where the target is non-zero
+        efficiency = self.nonzero / self.trials
+        print('Sampling efficiency:', efficiency)
         weights = ys / self.dist.pdf(xs)
-        integral = sample_size/trials * weights.mean()
-        stderr = np.sqrt(weights.var() * sample_size/trials**2)
+        integral = efficiency * weights.mean()
+        stderr = efficiency * np.sqrt(weights.var() / sample_size)
         sample = Sample(data=xs, target=self.target, pdf=ys, weights=weights)
 
         return sample, integral, stderr
 
     # numpy version
-    def sample(self, sample_size, batch_size: Optional[int] = 10000) -> Sample:
+    def sample(self, sample_size, batch_size: Optional[int] = None) -> Sample:
         """Generate a sample of the target distribution.
 
         Parameters
@@ -157,7 +178,7 @@ class ImportanceMC(object):
         sample_size
             The size of the sample to be generated.
         batch_size
-            Number of proposals to be generated at once.
+            Fixed number of proposals to be generated at once.
 
         Returns
         -------
@@ -168,10 +189,35 @@ class ImportanceMC(object):
         sample, _, _ = self.integrate(sample_size, batch_size)
         return sample
 
+# state of a worker process, set by _init_worker
+_worker = dict()
+
+
+def _init_worker(channels, fn):
+    _worker['channels'] = channels
+    _worker['fn'] = fn
+
+
+def _sample_shard(args):
+    """ Sample, weight and evaluate the points of one shard.
+
+    The shard contains sizes[i] points of channel i, returned in the
+    order of the channels.
+    """
+    sizes, channels_weight, seed = args
+    np.random.seed(seed)
+    channels = _worker['channels']
+    channels.channels_weight[:] = channels_weight
+
+    xs = np.concatenate([channels.channels[i].rvs(sizes[i])
+                         for i in np.where(sizes > 0)[0]])
+    return xs, channels.pdf(xs), _worker['fn'](*xs.transpose())
+
+
 class MultiChannelMC(object):
 
     def __init__(self, channels, b=.5, name="MC Multi C.",
-                 var_weighted=False):
+                 var_weighted=False, processes=1, shards=None, seed=None):
         """ Multi channel Monte Carlo integration.
 
         Use multiple importance sampling channels to approximate the integral.
@@ -201,11 +247,29 @@ class MultiChannelMC(object):
             iterations with their variance (to obtain the best estimate).
             Note that this can lead to a bias if the variances and estimates
             are correlated.
+        :param processes: Number of worker processes sampling the channels
+            and evaluating the channel pdfs and the integrand. If 1, all
+            work is done in the calling process, if None the cpu count
+            is used. Where processes are not forked, the channels and the
+            integrand must be picklable.
+        :param shards: Number of shards the points of an iteration are
+            split into (default: four per worker process).
+        :param seed: Seed for the parallel iterations. Using the same
+            seed reproduces the same result, independent of the number
+            of processes.
         """
         self.method_name = name
         self.channels = channels
         self.var_weighted = var_weighted
         self.b = b
+        self.processes = processes
+        self.shards = shards
+        self.seed = seed
+
+        # pool and random state used during a parallel call
+        self._pool = None
+        self._seeds = None
+        self._shard_count = None
 
     def get_interface_ratios(self, sub_eval_count=100, r1=0, r2=1, r3=0):
         """ Get an interface to the integration that only takes a sample size.
@@ -260,6 +324,23 @@ class MultiChannelMC(object):
 
         return interface
 
+    def save_state(self, file_path):
+        """ Store the current channel weights.
+
+        :param file_path: Path of the file, by convention ending in .npz.
+        """
+        _save_state(file_path, self,
+                    {'channels_weight': self.channels.channels_weight})
+
+    def load_state(self, file_path):
+        """ Restore the channel weights stored by save_state.
+
+        Call the integrator with apriori=False to use the loaded weights.
+        """
+        channels_weight = _load_state(file_path, self)['channels_weight']
+        _check_state('channel count', channels_weight.size, self.channels.count)
+        self.channels.channels_weight[:] = channels_weight
+
     def iterate(self, fn, eval_count, update_weights=True, get_estimate=True):
         """ One iteration of the algorithm with sample size eval_count.
 
@@ -273,10 +354,13 @@ class MultiChannelMC(object):
             sample variance of the estimate w_est. Otherwise return nothing.
             The variance of the estimate is (w_est - est^2) / eval_count
         """
-        # a ChannelSample object
-        sample = self.channels.sample(eval_count)
+        if self._pool is None:
+            # a ChannelSample object
+            sample = self.channels.sample(eval_count)
+            fn_values = fn(*sample.data.transpose())
+        else:
+            sample, fn_values = self._sample_parallel(eval_count)
 
-        fn_values = fn(*sample.data.transpose())
         weights = sample.weights
         # weighted samples of fn
         weighted = (fn_values / weights)
@@ -284,16 +368,58 @@ class MultiChannelMC(object):
         w_fn = (np.add.reduceat(weighted ** 2, sample.channel_bounds) /
                 sample.count_per_channel)
 
-        if update_weights:
+        if update_weights and sample.active_channel_count > 0:
             factors = sample.channel_weights * np.power(w_fn, self.b)
             self.channels.update_channel_weights(factors / np.sum(factors))
 
         if get_estimate:
-            estimate = np.mean(weighted)
+            estimate = np.mean(weighted) if eval_count > 0 else 0.
             w_est = np.sum(sample.channel_weights * w_fn)
             # return estimate, w_est
             return sample.data, fn_values, weights, estimate, w_est
 
+    def _sample_parallel(self, eval_count):
+        """ Generate and evaluate the points of an iteration in the pool.
+
+        The points ordered by channel are split into shards of (almost)
+        equal size, so a channel can be spread over several shards.
+        Concatenating the shards in order restores the channel order
+        of the serial version, hence the statistics of the iteration do
+        not depend on the order in which the workers finish.
+
+        :return: Tuple of the ChannelsSample and the integrand values.
+        """
+        channels_weight = self.channels.channels_weight
+        if eval_count == 0:
+            sample = ChannelsSample(
+                channels_weight, np.empty((0, self.channels.ndim)),
+                np.empty(0), np.zeros(self.channels.count, dtype=int))
+            self.channels.current_sample = sample
+            return sample, np.empty(0)
+
+        rng = np.random.default_rng(self._seeds.spawn(1)[0])
+        sample_sizes = rng.multinomial(eval_count, channels_weight)
+
+        shard_count = min(self._shard_count, eval_count)
+        shard_bounds = np.linspace(0, eval_count, shard_count + 1).astype(int)
+        channel_bounds = np.concatenate([[0], np.cumsum(sample_sizes)])
+        # number of points of each channel in each shard
+        shard_sizes = np.diff(np.clip(
+            channel_bounds[np.newaxis, :], shard_bounds[:-1, np.newaxis],
+            shard_bounds[1:, np.newaxis]), axis=1)
+
+        seeds = [child.generate_state(4)
+                 for child in self._seeds.spawn(shard_count)]
+        tasks = [(sizes, channels_weight, seed)
+                 for sizes, seed in zip(shard_sizes, seeds)]
+        xs, pdf, fn_values = zip(*self._pool.map(_sample_shard, tasks,
+                                                 chunksize=1))
+
+        sample = ChannelsSample(channels_weight, np.concatenate(xs),
+                                np.concatenate(pdf), sample_sizes)
+        self.channels.current_sample = sample
+        return sample, np.concatenate(fn_values)
+
     def __call__(self, fn, eval_count_1, eval_count_2, eval_count_3,
                  apriori=True):
         """ Approximate the integral of fn over the [0,1]^ndim hypercube.
@@ -311,37 +437,61 @@ class MultiChannelMC(object):
         if apriori:
             self.channels.reset()
 
+        if self.processes == 1:
+            return self._integrate(fn, eval_count_1, eval_count_2,
+                                   eval_count_3)
+
+        self._seeds = np.random.SeedSequence(self.seed)
+        self._shard_count = self.shards or 4 * (self.processes or
+                                                os.cpu_count() or 1)
+        try:
+            with Pool(self.processes, initializer=_init_worker,
+                      initargs=(self.channels, fn)) as self._pool:
+                return self._integrate(fn, eval_count_1, eval_count_2,
+                                       eval_count_3)
+        finally:
+            self._pool = None
+            self._seeds = None
+
+    def _integrate(self, fn, eval_count_1, eval_count_2, eval_count_3):
         for eval_count in eval_count_1:
             self.iterate(fn, eval_count, True, False)
 
-        sample = IntegrationSample()
         eval_counts = np.concatenate([eval_count_2, eval_count_3])
-        eval_counts = eval_counts.astype(np.int)
+        eval_counts = eval_counts.astype(int)
         m2 = len(eval_count_2)  # number of iterations in phase 2
         ws_est = np.empty(eval_counts.size)
         estimates = np.empty(eval_counts.size)
+        data, function_values, sample_weights = [], [], []
 
         for j, eval_count in zip(range(eval_counts.size), eval_counts):
             xs, values, weights, est, w = self.iterate(fn, eval_count, j < m2)
             estimates[j], ws_est[j] = est, w
-            sample.extend_array('function_values', values)
-            sample.extend_array('weights', weights)
-            sample.extend_array('data', xs)
-
-        if sample.function_values is not None:
-            if self.var_weighted:
-                # sample variance of individual iterations
-                variances = (ws_est - estimates ** 2) / eval_counts
-                norm = np.sum(eval_counts / variances)
-                total_est = np.sum(eval_counts * estimates / variances) / norm
-                var = np.sum(eval_counts ** 2 / variances) / norm ** 2
-            else:
-                total_evaluations = np.sum(eval_counts)
-                total_est = np.sum(estimates * eval_counts) / total_evaluations
-                var = (np.sum(eval_counts * ws_est / total_evaluations) -
-                       total_est ** 2) / total_evaluations
-
-            sample.integral = total_est
-            sample.integral_err = np.sqrt(var)
+            function_values.append(values)
+            sample_weights.append(weights)
+            data.append(xs)
+
+        if not data:
+            return IntegrationSample(data=np.empty((0, self.channels.ndim)))
+
+        sample = IntegrationSample(
+            data=np.concatenate(data),
+            function_values=np.concatenate(function_values),
+            weights=np.concatenate(sample_weights))
+
+        if self.var_weighted:
+            # sample variance of individual iterations
+            variances = (ws_est - estimates ** 2) / eval_counts
+            norm = np.sum(eval_counts / variances)
+            total_est = np.sum(eval_counts * estimates / variances) / norm
+            var = np.sum(eval_counts ** 2 / variances) / norm ** 2
+        else:
+            total_evaluations = np.sum(eval_counts)
+            total_est = np.sum(estimates * eval_counts) / total_evaluations
+            var = (np.sum(eval_counts * ws_est / total_evaluations) -
+                   total_est ** 2) / total_evaluations
+
+        sample.integral = total_est
+        sample.integral_err = np.sqrt(var)
 
         return sample
@@ -1,3 +1,4 @@
+import os
 import numpy as np
 from typing import Tuple
 
@@ -5,6 +6,59 @@ from ..sampling import Sample
 from ..density import Density
 
 
+# version of the files written by _save_state
+STATE_VERSION = 1
+
+
+def _save_state(file_path, integrator, arrays):
+    """ Store the arrays describing the state of an integrator.
+
+    The file is a compressed numpy .npz archive, which in addition
+    contains the format version and the type of the integrator.
+    It is replaced atomically.
+    """
+    arrays = dict(arrays, version=STATE_VERSION,
+                  integrator=type(integrator).__name__)
+    with open(file_path + '.tmp', 'wb') as fp:
+        np.savez_compressed(fp, **arrays)
+    os.replace(file_path + '.tmp', file_path)
+
+
+def _load_state(file_path, integrator):
+    """ Load the arrays stored by _save_state for this integrator. """
+    with np.load(file_path, allow_pickle=False) as archive:
+        arrays = dict(archive)
+    if arrays.pop('version') != STATE_VERSION:
+        raise RuntimeError("Unknown integrator state version.")
+    name = str(arrays.pop('integrator'))
+    if name != type(integrator).__name__:
+        raise RuntimeError("The file contains the state of a %s." % name)
+    return arrays
+
+
+def _check_state(name, stored, expected):
+    if np.any(np.asarray(stored) != np.asarray(expected)):
+        raise RuntimeError("Stored %s %s does not match %s." %
+                           (name, stored, expected))
+
+
+class IntegrationSample(Sample):
+
+    def __init__(self, function_values=None, integral=None, integral_err=None,
+                 **kwargs):
+        """ Sample generated in a Monte Carlo integration.
+
+        :param function_values: Values of the integrand at the sample points.
+        :param integral: The integral estimate.
+        :param integral_err: The estimated standard error of the integral.
+        :param kwargs: Arguments passed on to Sample (data, weights, ...).
+        """
+        super().__init__(**kwargs)
+        self.function_values = function_values
+        self.integral = integral
+        self.integral_err = integral_err
+
+
 class PlainMC(object):
     """ Plain Monte Carlo integration method.
 
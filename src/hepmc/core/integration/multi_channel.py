@@ -1,8 +1,11 @@
 import numpy as np
 from matplotlib import pyplot as plt
+from scipy.special import logsumexp, softmax
 
 from ..density import Distribution
+from ..densities.gaussian import Gaussian
 from ..sampling import Sample
+from ..util import interpret_array
 
 
 class ChannelsSample(Sample):
@@ -55,12 +58,58 @@ class ChannelsSample(Sample):
         self.active_channel_count = self.active_channels.size
         self.channel_bounds = np.array(
             [np.sum(self.count_per_channel[0:i])
-             for i in range(self.active_channel_count)])
+             for i in range(self.active_channel_count)], dtype=int)
+
+
+class _GaussianStack(object):
+
+    # maximal number of entries of the (point, channel, ndim) arrays
+    block_entries = 2 ** 20
+
+    def __init__(self, channels):
+        """ Evaluate several Gaussian channels at once.
+
+        The quadratic forms (x - mu_k)^T A_k (x - mu_k), with A_k the
+        inverse covariance of channel k, are evaluated for all channels
+        in one einsum over the stacked means and inverse covariances.
+        """
+        self.means = np.array([c.mean for c in channels])
+        self.cov_inv = np.array([c.cov_inv for c in channels])
+        self.log_norm = np.array([c.log_norm for c in channels])
+
+    def _blocks(self, xs):
+        """ Blocks of points and A_k (x - mu_k), shape (n, count, ndim). """
+        count, ndim = self.means.shape
+        size = max(1, self.block_entries // (count * ndim))
+        for start in range(0, xs.shape[0], size):
+            block = slice(start, start + size)
+            diff = xs[block, np.newaxis, :] - self.means
+            yield block, diff, np.einsum('kij,nkj->nki', self.cov_inv, diff)
+
+    def pot(self, xs):
+        """ Potentials of all channels, shape (channel count, N). """
+        pot = np.empty((self.means.shape[0], xs.shape[0]))
+        for block, diff, cov_inv_diff in self._blocks(xs):
+            pot[:, block] = (.5 * np.einsum('nki,nki->kn', diff, cov_inv_diff) +
+                             self.log_norm[:, np.newaxis])
+        return pot
+
+    def weighted_pot_gradient(self, xs, weights):
+        """ Sum over k of weights[k] * (gradient of the potential k).
+
+        :param weights: Weights per channel and point, shape (count, N).
+        :return: Array of shape (N, ndim).
+        """
+        grad = np.empty(xs.shape)
+        for block, diff, cov_inv_diff in self._blocks(xs):
+            grad[block] = np.einsum('kn,nki->ni', weights[:, block],
+                                    cov_inv_diff)
+        return grad
 
 
 class MultiChannel(Distribution):
 
-    def __init__(self, channels, channels_weight=None):
+    def __init__(self, channels, channels_weight=None, cache_size=2):
         """ Channels construct for multi channel Monte Carlo.
 
         Contains several importance sampling channels (distributions and
@@ -70,6 +119,11 @@ class MultiChannel(Distribution):
         :param channels: List of distributions.
         :param channels_weight: Initial weight of the channels. By default
             assign equal weight to all channels.
+        :param cache_size: Number of recent point arrays for which the
+            log pdfs of the individual channels are kept. They do not
+            depend on the channel weights, so they are reused after the
+            weights are updated. Arrays are recognized by identity, they
+            must not be modified in place while cached.
         """
         ndim = channels[0].ndim
         for c in channels:
@@ -88,6 +142,10 @@ class MultiChannel(Distribution):
         self.init_channel_weights = np.copy(self.channels_weight)
 
         self.channels = channels
+        self.cache_size = cache_size
+        # pairs (xs, log pdfs), most recent last
+        self._cache = []
+        self._stack = None
 
         # later store information of generated sample
         self.current_sample = None  # ChannelSample
@@ -96,26 +154,107 @@ class MultiChannel(Distribution):
         """ Revert weights to initial values. """
         self.channels_weight[:] = self.init_channel_weights
 
+    def reset_cache(self):
+        """ Drop cached values, required if the channels are modified. """
+        self._cache.clear()
+        self._stack = None
+
+    def _stacked(self):
+        """ Indices of the Gaussian channels and their _GaussianStack. """
+        if self._stack is None:
+            indices = np.array([i for i, c in enumerate(self.channels)
+                                if type(c) is Gaussian], dtype=int)
+            stack = None
+            if indices.size:
+                stack = _GaussianStack([self.channels[i] for i in indices])
+            others = np.setdiff1d(np.arange(self.count), indices)
+            self._stack = indices, stack, others
+        return self._stack
+
+    def channel_log_pdfs(self, xs):
+        """ Log of the pdf of each channel, shape (self.count, N).
+
+        Gaussian channels are evaluated together, the others one by one
+        (via their potential).
+        The results for the last cache_size arrays xs are cached.
+        """
+        xs = interpret_array(xs, self.ndim)
+        for index, (cached_xs, log_pdfs) in enumerate(self._cache):
+            if cached_xs is xs and cached_xs.shape == xs.shape:
+                self._cache.append(self._cache.pop(index))
+                return log_pdfs
+
+        log_pdfs = np.empty((self.count, xs.shape[0]))
+        indices, stack, others = self._stacked()
+        if indices.size:
+            log_pdfs[indices] = -stack.pot(xs)
+        for i in others:
+            # the potential stays finite where the pdf underflows
+            log_pdfs[i] = -self.channels[i].pot(xs)
+
+        if self.cache_size > 0:
+            self._cache.append((xs, log_pdfs))
+            del self._cache[:-self.cache_size]
+        return log_pdfs
+
+    def _log_weighted(self, xs):
+        """ Log of channel_weight_i * channel_pdf_i(x), shape (count, N). """
+        with np.errstate(divide='ignore'):
+            log_weights = np.log(self.channels_weight)
+        return log_weights[:, np.newaxis] + self.channel_log_pdfs(xs)
+
+    def pot(self, xs):
+        return -logsumexp(self._log_weighted(xs), axis=0)
+
     def pdf(self, xs):
         """  Overall probability of sample points x.
 
         Returns overall probability density of sampling a given point x:
-        sum_i channel_weight_i * channel_pdf_i(x)
+        sum_i channel_weight_i * channel_pdf_i(x), summed in log space.
 
         :param xs: Total of self.ndim numpy array of equal lengths N.
         :return: Probabilities for each sample point. Numpy array
             of length N.
         """
-        p = 0
-        for i in range(self.count):
-            p += self.channels_weight[i] * self.channels[i].pdf(xs)
-        return p
+        return np.exp(-self.pot(xs))
 
     def pdf_gradient(self, xs):
-        p = 0
-        for i in range(self.count):
-            p += self.channels_weight[i] * self.channels[i].pdf_gradient(xs)
-        return p
+        xs = interpret_array(xs, self.ndim)
+        weighted = np.exp(self._log_weighted(xs))
+        indices, stack, others = self._stacked()
+        grad = np.zeros(xs.shape)
+        if indices.size:
+            grad -= stack.weighted_pot_gradient(xs, weighted[indices])
+        for i in others:
+            grad += self.channels_weight[i] * self.channels[i].pdf_gradient(xs)
+        return grad
+
+    def pot_gradient(self, xs):
+        """ Gradient of the potential, computed in log space.
+
+        It is the sum of the channel potential gradients, weighted with
+        the responsibilities softmax(log(channel_weight_i * channel_pdf_i)),
+        which remain finite where the pdfs underflow.
+        """
+        xs = interpret_array(xs, self.ndim)
+        log_weighted = self._log_weighted(xs)
+        indices, stack, others = self._stacked()
+        with np.errstate(invalid='ignore'):
+            responsibilities = softmax(log_weighted, axis=0)
+        grad = np.zeros(xs.shape)
+        if indices.size:
+            grad += stack.weighted_pot_gradient(xs, responsibilities[indices])
+        for i in others:
+            # the gradient may be infinite where the channel pdf is 0
+            nonzero = responsibilities[i] > 0
+            grad[nonzero] += (responsibilities[i, nonzero, np.newaxis] *
+                              self.channels[i].pot_gradient(xs[nonzero]))
+        # as in Density.pot_gradient where the pdf is 0
+        grad[np.all(np.isneginf(log_weighted), axis=0)] = np.inf
+        return grad
+
+    def proposal_mlogpdf(self, state, candidate):
+        return self.pot(candidate)
 
     def plot_pdf(self, label="total pdf"):
         """ Plot the overall probability distribution. """
@@ -142,6 +281,7 @@ class MultiChannel(Distribution):
         sample_channel_indices = np.where(sample_sizes > 0)[0]
 
         sample_points = np.concatenate(
+            [np.empty((0, self.ndim))] +
             [self.channels[i].rvs(sample_sizes[i])
              for i in sample_channel_indices])
 
@@ -1,5 +1,6 @@
 import numpy as np
-from .integration import IntegrationSample
+from .integration import (IntegrationSample, _save_state, _load_state,
+                          _check_state)
 from .stratified_volume import GridVolumes
 
 
@@ -42,6 +43,34 @@ class StratifiedMC(object):
         self.ndim = volumes.ndim
         self.volumes = volumes
 
+    def save_state(self, file_path):
+        """ Store the division of the volume (bounds and base counts).
+
+        :param file_path: Path of the file, by convention ending in .npz.
+        """
+        arrays = {'bounds_%d' % d: bounds
+                  for d, bounds in enumerate(self.volumes.bounds)}
+        indices = list(self.volumes.base_counts.keys())
+        arrays['count_indices'] = np.array(indices, dtype=int).reshape(
+            len(indices), self.ndim)
+        arrays['counts'] = np.array(
+            [self.volumes.base_counts[index] for index in indices], dtype=int)
+        arrays['default_base_count'] = self.volumes.default_base_count
+        _save_state(file_path, self, arrays)
+
+    def load_state(self, file_path):
+        """ Restore the division of the volume stored by save_state. """
+        arrays = _load_state(file_path, self)
+        _check_state('ndim', sum(name.startswith('bounds_') for name in arrays),
+                     self.ndim)
+        self.volumes.base_counts = {
+            tuple(int(i) for i in index): int(count)
+            for index, count in zip(arrays['count_indices'], arrays['counts'])}
+        self.volumes.default_base_count = int(arrays['default_base_count'])
+        # setting the bounds updates the total base count
+        self.volumes.bounds = [arrays['bounds_%d' % d]
+                               for d in range(self.ndim)]
+
     def get_interface_infer_multiple(self):
         """ Construct an interface that only takes fn and a total sample size.
 
@@ -73,19 +102,24 @@ class StratifiedMC(object):
             multiple * self.volumes.total_base_count.
         :return: Tuple (integral_estimate, error_estimate).
         """
-        sample = StratifiedSample()
         total_count = self.volumes.total_base_count * multiple
         int_est = 0
         var_est = 0
+        data, function_values = [], []
+        sub_sizes, sub_weights = [], []
         for sub_eval_count, xs, vol in self.volumes.iterate(multiple):
             values = fn(*xs.transpose())
             int_est += vol * np.mean(values)
             var_est += np.var(values) * vol ** 2 / sub_eval_count
-            sample.sub_sizes.append(sub_eval_count)
-            sample.sub_weights.append(sub_eval_count / vol / total_count)
-            sample.extend_array('data', xs)
-            sample.extend_array('function_values', values)
-
-        sample.integral = int_est
-        sample.integral_err = np.sqrt(var_est)
+            sub_sizes.append(sub_eval_count)
+            sub_weights.append(sub_eval_count / vol / total_count)
+            data.append(xs)
+            function_values.append(values)
+
+        sample = StratifiedSample(data=np.concatenate(data),
+                                  function_values=np.concatenate(function_values),
+                                  integral=int_est,
+                                  integral_err=np.sqrt(var_est))
+        sample.sub_sizes = sub_sizes
+        sample.sub_weights = sub_weights
         return sample
@@ -68,19 +68,23 @@ class GridVolumes(Distribution):
         vols = np.prod([self._sizes[d][indices[d]]
                         for d in range(self.ndim)], axis=0)
 
-        counts = [self.get_count(index) for index in indices.transpose()]
-        return np.array(counts) / self.total_base_count / vols
+        counts = np.full(indices.shape[1], self.default_base_count)
+        for index, count in self.base_counts.items():
+            counts[np.all(indices == np.reshape(index, (-1, 1)), axis=0)] = count
+        return counts / self.total_base_count / vols
 
-    @hypercube_bounded(1, self_has_ndim=True)
-    def pdf(self, xs):
+    def find_bins(self, xs):
+        """ Bin indices of the points xs, shape (ndim, N). """
         xs = interpret_array(xs, self.ndim)
-        # bin indices for all x values in each dimension
-        indices = np.empty(xs.transpose().shape, dtype=np.int)
+        indices = np.empty(xs.transpose().shape, dtype=int)
         for dim in range(self.ndim):
-            indices[dim] = np.argmax(xs[:, dim, np.newaxis] <
-                                     self.bounds[dim], axis=1) - 1
+            indices[dim] = np.searchsorted(self.bounds[dim], xs[:, dim],
+                                           side='right') - 1
+        return indices
 
-        return self.pdf_indices(indices)
+    @hypercube_bounded(1, self_has_ndim=True)
+    def pdf(self, xs):
+        return self.pdf_indices(self.find_bins(xs))
 
     def pdf_gradient(self, xs):
         raise NotImplementedError("Density is a step function.")
@@ -106,7 +110,7 @@ class GridVolumes(Distribution):
 
         :return: array of shape ndim x N of bin indices.
         """
-        indices = np.empty((self.ndim, count), dtype=np.int)
+        indices = np.empty((self.ndim, count), dtype=int)
         for d in range(self.ndim):
             indices[d] = np.random.randint(0, self.bounds[d].size - 1, count)
 
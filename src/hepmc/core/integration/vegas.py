@@ -1,41 +1,88 @@
 import numpy as np
-from .integration import IntegrationSample
+from .integration import (IntegrationSample, _save_state, _load_state,
+                          _check_state)
 from .stratified_volume import GridVolumes
-from ..util import damped_update
 
 
 class VegasSample(IntegrationSample):
 
     def __init__(self, **kwargs):
+        """ Sample of a VEGAS integration.
+
+        Besides the combined estimate, it holds the estimates and errors
+        of the individual iterations, their chi^2/dof and the adaptation
+        state of the integrator at the end (see VegasMC.state).
+        """
         self.chi2 = None
+        self.iteration_estimates = None
+        self.iteration_errors = None
+        self.state = None
         super().__init__(**kwargs)
 
 
 class VegasMC(object):
 
-    def __init__(self, ndim=1, divisions=1, c=3,
-                 name="MC VEGAS", var_weighted=False):
+    def __init__(self, ndim=1, divisions=1, alpha=1.5,
+                 name="MC VEGAS", var_weighted=False, beta=None, strata=None):
         """ VEGAS Monte Carlo integration algorithm.
 
+        If beta is given, the VEGAS+ algorithm is used: the unit hypercube
+        (before it is mapped by the adapted grid) is divided into strata^ndim
+        hypercubes, and the function evaluations of each iteration are
+        distributed among them proportional to sigma^beta, where sigma is
+        the standard deviation of the integral over the cube estimated in
+        the previous iteration.
+
         :param ndim: Dimensionality of the integral.
         :param divisions: Number of divisions of the volume along
             each dimension. The total number of 'boxes' is divisions^ndim
-        :param c: Damping parameter (greater implies less damping), used in
-            adapting the division sizes. See damped_update of this module.
+        :param alpha: Damping exponent of the grid refinement (smaller
+            implies more damping, 0 disables the adaptation), see refine.
         :param name: Method name used for plotting.
         :param var_weighted: If true, weight the estimates from different
             iterations with their variance (to obtain the best estimate).
             Note that this can lead to a bias if the variances and estimates
             are correlated.
+        :param beta: Exponent of the adaptive stratification, usually
+            between 0 (equal allocation) and 1 (optimal in theory),
+            or None to disable the stratification.
+        :param strata: Number of strata along each dimension. By default
+            chosen such that there are about four evaluations per cube.
         """
         # the configuration is defined by the sizes of the bins
         self.ndim = ndim
         self.volumes = GridVolumes(ndim=ndim, divisions=divisions)
         # number of bins along each axis
         self.divisions = divisions
-        self.c = c
+        self.alpha = alpha
         self.var_weighted = var_weighted
         self.method_name = name
+        self.beta = beta
+        self.strata = strata
+        # stratification state: strata per dimension and errors of the cubes
+        self._strata = strata
+        self.hcube_sigma = None
+
+    @property
+    def state(self):
+        """ The adaptation state, set it to warm-start an integration.
+
+        Contains the bounds of the grid and the stratification of VEGAS+.
+        Pass apriori=False when calling the integrator after setting it.
+        """
+        return {
+            'bounds': [np.copy(b) for b in self.volumes.bounds],
+            'strata': self._strata,
+            'hcube_sigma': (None if self.hcube_sigma is None
+                            else np.copy(self.hcube_sigma)),
+        }
+
+    @state.setter
+    def state(self, state):
+        self.volumes.bounds = [np.copy(b) for b in state['bounds']]
+        self._strata = state['strata']
+        self.hcube_sigma = (None if state['hcube_sigma'] is None
+                            else np.copy(state['hcube_sigma']))
 
     def get_interface_infer_multiple(self, sub_eval_count):
         """ Construct an interface that only takes fn and a total sample size.
@@ -71,51 +118,185 @@ class VegasMC(object):
 
         return vols * self.volumes.partition_count
 
+    def refine(self, contributions):
+        """ Adapt the grid to the contributions of the bins.
+
+        The standard VEGAS refinement: the contributions of neighbouring
+        bins are averaged, compressed with the damping exponent alpha and
+        the bounds are moved such that each new bin gets an equal share
+        of the compressed contributions (interpolating linearly in the
+        old bins).
+
+        :param contributions: Array of shape (ndim, divisions), the sum
+            of the squared weighted function values in each bin of each
+            marginal grid.
+        """
+        if self.alpha == 0:
+            return
+        # smooth with the neighbouring bins
+        smooth = np.copy(contributions)
+        if self.divisions > 1:
+            smooth[:, 1:-1] = (contributions[:, :-2] + contributions[:, 1:-1] +
+                               contributions[:, 2:]) / 3
+            smooth[:, 0] = (contributions[:, 0] + contributions[:, 1]) / 2
+            smooth[:, -1] = (contributions[:, -2] + contributions[:, -1]) / 2
+
+        bounds = []
+        for d in range(self.ndim):
+            total = np.sum(smooth[d])
+            if not total > 0:
+                bounds.append(self.volumes.bounds[d])
+                continue
+            r = smooth[d] / total
+            importance = np.zeros(self.divisions)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                importance[r > 0] = ((1 - r[r > 0]) / -np.log(r[r > 0])) ** self.alpha
+            importance[r == 1] = 1.
+            cumulative = np.concatenate(([0], np.cumsum(importance)))
+            levels = np.linspace(0, cumulative[-1], self.divisions + 1)
+            new_bounds = np.interp(levels, cumulative, self.volumes.bounds[d])
+            new_bounds[0], new_bounds[-1] = 0., 1.
+            bounds.append(new_bounds)
+        self.volumes.bounds = bounds
+
+    def save_state(self, file_path):
+        """ Store the adaptation state (see state) in file_path.
+
+        :param file_path: Path of the file, by convention ending in .npz.
+        """
+        state = self.state
+        arrays = {'bounds_%d' % d: bounds
+                  for d, bounds in enumerate(state['bounds'])}
+        arrays['strata'] = -1 if state['strata'] is None else state['strata']
+        if state['hcube_sigma'] is not None:
+            arrays['hcube_sigma'] = state['hcube_sigma']
+        _save_state(file_path, self, arrays)
+
+    def load_state(self, file_path):
+        """ Restore the adaptation state stored by save_state.
+
+        Call the integrator with apriori=False to use the loaded state.
+        """
+        arrays = _load_state(file_path, self)
+        _check_state('ndim', sum(name.startswith('bounds_') for name in arrays),
+                     self.ndim)
+        bounds = [arrays['bounds_%d' % d] for d in range(self.ndim)]
+        _check_state('divisions', [b.size - 1 for b in bounds],
+                     self.divisions)
+        strata = int(arrays['strata'])
+        self.state = {
+            'bounds': bounds,
+            'strata': None if strata < 0 else strata,
+            'hcube_sigma': arrays.get('hcube_sigma'),
+        }
+
+    def stratified_iteration(self, fn, eval_count):
+        """ One VEGAS+ iteration with about eval_count function evaluations.
+
+        Updates the errors of the hypercubes used in the next iteration.
+
+        :return: Tuple (indices, samples_t, values, weights, estimate,
+            variance, contributions), where indices are the grid bins of the
+            points samples_t (shape (ndim, N)), weights the inverse sampling
+            densities and contributions the squared weighted function values
+            divided by the sampling density in the unmapped hypercube.
+        """
+        if self._strata is None:
+            self._strata = max(1, int((eval_count / 4) ** (1 / self.ndim)))
+        strata = self._strata
+        cube_count = strata ** self.ndim
+        if self.hcube_sigma is None or self.hcube_sigma.size != cube_count:
+            self.hcube_sigma = np.ones(cube_count)
+
+        # allocate the evaluations, at least two per hypercube
+        share = self.hcube_sigma ** self.beta
+        if np.sum(share) > 0:
+            share = share / np.sum(share)
+        else:
+            share = np.full(cube_count, 1 / cube_count)
+        counts = 2 + (max(0, eval_count - 2 * cube_count) * share).astype(int)
+        cubes = np.repeat(np.arange(cube_count), counts)
+
+        # uniform points in the hypercubes, mapped by the grid
+        ys = (np.array(np.unravel_index(cubes, (strata,) * self.ndim)) +
+              np.random.rand(self.ndim, cubes.size)) / strata
+        indices = np.minimum((ys * self.divisions).astype(int),
+                             self.divisions - 1)
+        samples_t = np.empty(ys.shape)
+        for d in range(self.ndim):
+            samples_t[d] = (self.volumes.bounds[d][indices[d]] +
+                            self.volumes.sizes[d][indices[d]] *
+                            (ys[d] * self.divisions - indices[d]))
+
+        values = fn(*samples_t)
+        jacobian = self.weights_at(indices)
+        weighted = values * jacobian
+
+        # mean and variance of the weighted values in each hypercube
+        means = np.bincount(cubes, weighted, minlength=cube_count) / counts
+        variances = (np.bincount(cubes, weighted ** 2, minlength=cube_count) /
+                     counts - means ** 2)
+        variances = np.maximum(variances, 0) * counts / (counts - 1)
+        volume = 1. / cube_count
+        estimate = volume * np.sum(means)
+        variance = volume ** 2 * np.sum(variances / counts)
+        self.hcube_sigma = volume * np.sqrt(variances)
+
+        # sampling density in the unmapped hypercube
+        density = (counts / cubes.size / volume)[cubes]
+        return (indices, samples_t, values, jacobian / density, estimate,
+                variance, weighted ** 2 / density)
+
     def __call__(self, fn, sub_eval_count, iterations, apriori=True, chi=False):
         """ Approximate the integral of fn using stratified sampling.
 
         :param fn: Integrand.
         :param sub_eval_count: Number of function evaluations per iteration.
         :param iterations: Number of iterations.
-        :param apriori: If true, reset the sizes of the division.
-        :param chi: Indicate whether chi^2 over the estimates of all
-            iterations should be computed. Can only do this if iterations >= 2.
-        :return: If chi=False tuple (integral_estimate, error_estimate),
-            otherwise the tuple (integral_estimate, error_estimate, chi^2/dof).
+        :param apriori: If true, reset the sizes of the division and the
+            stratification.
+        :param chi: Require the chi^2 over the estimates of all
+            iterations. Can only do this if iterations >= 2.
+        :return: VegasSample with the integral estimate and error, the
+            estimates of the iterations, their chi^2/dof (if iterations >= 2)
+            and the adaptation state.
         """
         if apriori:
             # start anew
             self.volumes.reset()
+            self._strata = self.strata
+            self.hcube_sigma = None
 
         assert not chi or iterations > 1, "Can only compute chi^2 if there" \
                                           "is more than one iteration "
 
-        sample = IntegrationSample()
         est_j = np.zeros(iterations)  # The estimate in each iteration j
         var_j = np.zeros(iterations)  # sample estimate of the variance of est_j
-        # keep track of contributions of each marginalized bin to the estimate
-        estimates = np.zeros((self.ndim, self.divisions))
+        # keep track of contributions of each marginalized bin to the variance
+        contributions = np.empty((self.ndim, self.divisions))
+        data, function_values, sample_weights = [], [], []
 
         for j in range(iterations):
-            indices = self.volumes.random_bins(sub_eval_count)
-            samples_t = self.volumes.sample_indices(indices)
-            values = fn(*samples_t)
-            weights = self.weights_at(indices)
-            weighted = values * weights
-            sample.extend_array('data', samples_t)
-            sample.extend_array('function_values', values)
-            sample.extend_array('weights', weights)
-            for div in range(self.divisions):
-                estimates[:, div] = np.mean(weighted * (indices == div), axis=1)
-            est_j[j] = np.mean(weighted)
-            var_j[j] = np.var(weighted) / sub_eval_count
-
-            inv_sizes = damped_update(est_j[j] / self.volumes.sizes,
-                                      self.divisions * estimates, self.c, j)
-            sizes = 1 / inv_sizes
-            # normalize
-            sizes /= np.add.reduce(sizes, axis=1)[:, np.newaxis]
-            self.volumes.sizes = sizes
+            if self.beta is None:
+                indices = self.volumes.random_bins(sub_eval_count)
+                samples_t = self.volumes.sample_indices(indices)
+                values = fn(*samples_t)
+                weights = self.weights_at(indices)
+                weighted = values * weights
+                est_j[j] = np.mean(weighted)
+                var_j[j] = np.var(weighted) / sub_eval_count
+                squared = weighted ** 2
+            else:
+                (indices, samples_t, values, weights, est_j[j], var_j[j],
+                 squared) = self.stratified_iteration(fn, sub_eval_count)
+            data.append(samples_t.transpose())
+            function_values.append(values)
+            sample_weights.append(weights)
+            for d in range(self.ndim):
+                contributions[d] = np.bincount(indices[d], squared,
+                                               minlength=self.divisions)
+
+            self.refine(contributions)
 
         # note: weighting with sub_eval_count here is redundant,
         # but illustrates how this algorithm could be expanded
@@ -132,10 +313,15 @@ class VegasMC(object):
             var = (np.sum(sub_eval_count ** 2 * var_j) /
                    (iterations * sub_eval_count) ** 2)
 
-        sample.integral = total_est
-        sample.integral_err = np.sqrt(var)
+        sample = VegasSample(data=np.concatenate(data),
+                             function_values=np.concatenate(function_values),
+                             weights=np.concatenate(sample_weights),
+                             integral=total_est, integral_err=np.sqrt(var))
+        sample.iteration_estimates = est_j
+        sample.iteration_errors = np.sqrt(var_j)
+        sample.state = self.state
 
-        if chi:
+        if iterations > 1:
             # chi^2/dof, have "iteration" values that are combined,
             # so here dof = iterations - 1
             chi2 = np.sum((est_j - total_est) ** 2 / var_j) / (iterations - 1)
@@ -1,3 +1,4 @@
 __all__ = ['MarkovSample', 'MarkovUpdate', 'MixingMarkovUpdate', 'CompositeMarkovUpdate',
            'MetropolisUpdate', 'DefaultMetropolis', 'AdaptiveMetropolisUpdate',
-           'StochasticOptimizeUpdate']
+           'StochasticOptimizeUpdate', 'DelayedAcceptanceMetropolis',
+           'ParallelChains', 'ChainsSample']
@@ -1,24 +1,159 @@
+import os
+import copy
+import pickle
 import numpy as np
-from collections import deque
-from ..sampling import Sample
+from collections import OrderedDict
+from ..sampling import Sample, SampleWriter
 from ..util import is_power_of_ten
 from ..density import Density
 from tqdm import tqdm
 
+class StateCache(object):
+
+    def __init__(self, size=16):
+        """ Bounded LRU cache of values computed for chain states.
+
+        Values such as the potential and its gradient are normally attached
+        to the state object as attributes. These are lost where states are
+        converted, e.g. by the masks and in/out maps of MixingMarkovUpdate.
+        The cache keeps them for the size most recent states, keyed on the
+        target and the bytes of the (flattened) state. The key holds the
+        target itself (hashed by identity), which keeps it alive while it is
+        cached, so its id cannot be reused by another target.
+
+        :param size: Maximal number of states kept.
+        """
+        self.size = size
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(state, target):
+        return target, np.asarray(state, dtype=float).tobytes()
+
+    def get(self, state, target):
+        """ Values stored for the state (empty dict if unknown). """
+        key = self._key(state, target)
+        if key not in self._entries:
+            return dict()
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def update(self, state, target, **values):
+        """ Store values (ignoring None) for the state. """
+        values = {name: value for name, value in values.items()
+                  if value is not None}
+        if not values or self.size <= 0:
+            return
+        key = self._key(state, target)
+        self._entries.setdefault(key, dict()).update(values)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def restore(self, state, target):
+        """ Set attributes of the state that are None from the cache. """
+        for name, value in self.get(state, target).items():
+            if getattr(state, name, None) is None:
+                setattr(state, name, value)
+        return state
+
+
 # MARKOV CHAIN
 class MarkovUpdate(object):
     """Basic update mechanism of a Markov chain. """
 
+    # attributes that make up the state of the adaptation (see get_adapt_state)
+    adapt_attributes = ()
+
     def __init__(self, target: Density, is_adaptive: bool = False) -> None:
         self.target = target
         self.is_adaptive = is_adaptive
 
         # will hold information if update was used as a sampler
         self.sample_info = None
+        # whether the candidate(s) of the last step were accepted;
+        # remains None for updates that do not report acceptance
+        self.last_accepted = None
+        # shared by the updates of a MixingMarkovUpdate (see StateCache)
+        self.state_cache = None
+
+    def set_state_cache(self, state_cache):
+        self.state_cache = state_cache
 
     def init_adapt(self, initial_state):
         pass
 
+    def get_adapt_state(self) -> dict:
+        """Return a copy of the adaptation state, e.g. to store a checkpoint.
+
+        By default this contains the attributes listed in adapt_attributes.
+        """
+        return {name: copy.deepcopy(getattr(self, name))
+                for name in self.adapt_attributes}
+
+    def set_adapt_state(self, adapt_state: dict) -> None:
+        """Restore an adaptation state obtained from get_adapt_state."""
+        for name, value in adapt_state.items():
+            setattr(self, name, value)
+
+    def save_checkpoint(self, file_path: str, state, phase: str, iteration: int) -> None:
+        """Store what is needed to continue a chain bit-identically.
+
+        The checkpoint is written to '<file_path>-checkpoint.pkl' and contains
+        the current state (including attributes such as the potential), the
+        adaptation state and the state of the numpy random generator, which
+        is used by all updates.
+
+        Parameters
+        ----------
+        file_path
+            Path of the streamed sample, see sample.
+        state
+            Current state of the chain.
+        phase
+            Either 'burnin' or 'sampling'.
+        iteration
+            Number of steps performed in the phase.
+        """
+        checkpoint = {
+            'version': 1,
+            'phase': phase,
+            'iteration': iteration,
+            'state': np.array(state),
+            'state_attributes': dict(getattr(state, '__dict__', {})),
+            'adapt_state': self.get_adapt_state(),
+            'random_state': np.random.get_state(),
+        }
+        # replace the checkpoint atomically, it must never be half written
+        path = file_path + '-checkpoint.pkl'
+        with open(path + '.tmp', 'wb') as fp:
+            pickle.dump(checkpoint, fp)
+        os.replace(path + '.tmp', path)
+
+    def load_checkpoint(self, file_path: str):
+        """Restore a checkpoint written by save_checkpoint.
+
+        The adaptation state and the numpy random state are set.
+
+        Returns
+        -------
+        tuple
+            (state, phase, iteration) as passed to save_checkpoint.
+        """
+        with open(file_path + '-checkpoint.pkl', 'rb') as fp:
+            checkpoint = pickle.load(fp)
+        if checkpoint['version'] != 1:
+            raise RuntimeError("Unknown checkpoint version %s." %
+                               checkpoint['version'])
+
+        state = self.init_state(checkpoint['state'])
+        for name, value in checkpoint['state_attributes'].items():
+            setattr(state, name, value)
+        self.set_adapt_state(checkpoint['adapt_state'])
+        # last, since init_state may draw random numbers
+        np.random.set_state(checkpoint['random_state'])
+        return state, checkpoint['phase'], checkpoint['iteration']
+
     def init_state(self, state):
         """Sets the needed attributes (e.g. the potential) of a state.
 
@@ -26,9 +161,19 @@ class MarkovUpdate(object):
         """
         return state
 
+    def init_states(self, states):
+        """Sets the needed attributes of a (n_chains, ndim) array of states.
+
+        This abstract implementation does nothing.
+        """
+        return states
+
     def next_state(self, state, iteration: int):
         """Get the next state in the Markov chain.
 
+        Implementations set self.last_accepted to indicate whether
+        a new state was accepted.
+
         Returns
         -------
         MarkovState
@@ -36,6 +181,25 @@ class MarkovUpdate(object):
         """
         raise NotImplementedError("AbstractMarkovUpdate is abstract.")
 
+    def next_states(self, states, iteration: int):
+        """Advance several independent chains by one step in lockstep.
+
+        Parameters
+        ----------
+        states
+            Array of shape (n_chains, ndim), one row per chain.
+
+        Implementations set self.last_accepted to a boolean array of length
+        n_chains.
+
+        Returns
+        -------
+        ndarray
+            The next states, again of shape (n_chains, ndim).
+        """
+        raise NotImplementedError(
+            type(self).__name__ + " cannot advance several chains at once.")
+
     def generator(self, sample_size: int, init_state, lag=1):
         """Returns a generator that yields new states sequentially."""
         i = 0
@@ -46,54 +210,170 @@ class MarkovUpdate(object):
             yield state
             i += 1
 
-    def sample(self, sample_size: int, init_state, burnin: int = 0, batch_length=100, lag=1) -> Sample:
-        init_state = self.init_state(init_state)
-        self.init_adapt(init_state)  # initial adaptation
-        batch_accept = deque(maxlen=batch_length)
-        n_accepted = 0
-        previous = init_state
-
-        if burnin > 0:
-            with tqdm(total=burnin, desc="Burn-in (lag=1)") as pbar:
-                for i, state in enumerate(self.generator(burnin, init_state)):
-                    if not np.array_equal(state, previous):
-                        batch_accept.append(1)
-                        n_accepted += 1
-                    else:
-                        batch_accept.append(0)
-
-                    if ((i+1) % batch_length) == 0:
-                        batch_accept_rate = sum(batch_accept)/batch_length
-                        total_accept_rate = n_accepted / (i+1)
-                        pbar.set_postfix({"batch acc. rate" : batch_accept_rate, "total acc. rate" : total_accept_rate})
-
-                        pbar.update(batch_length)
-
-                    previous = state
-        init_state = state
-        n_accepted = 0
-
-        data = np.empty((sample_size, self.target.ndim))
-        with tqdm(total=sample_size, desc='Sampling (lag={})'.format(lag)) as pbar:
-            for i, state in enumerate(self.generator(sample_size, init_state, lag)):
-                data[i] = state
+    def _advance(self, state, iteration: int, lag: int = 1):
+        """Perform lag steps; return the new state and if any was accepted."""
+        accepted = False
+        for j in range(lag):
+            previous = state
+            state = self.next_state(state, iteration)
+            if self.last_accepted is None:
+                # update does not report acceptance, compare states instead
+                accepted |= not np.array_equal(state, previous)
+            else:
+                accepted |= bool(self.last_accepted)
+        return state, accepted
 
-                if not np.array_equal(state, previous):
-                    batch_accept.append(1)
-                    n_accepted += 1
-                else:
-                    batch_accept.append(0)
+    def _run(self, state, size, record=None, batch_length=100, lag=1, desc=None, progress=True, start=0):
+        """Run the chain from step start up to step size.
+
+        If given, record(i, state, accepted) is called after each step.
+        """
+        n_accepted = batch_accepted = 0
+        with tqdm(total=size, initial=start, desc=desc, disable=not progress) as pbar:
+            for i in range(start, size):
+                state, accepted = self._advance(state, i, lag)
+                n_accepted += accepted
+                batch_accepted += accepted
+                if record is not None:
+                    record(i, state, accepted)
 
                 if ((i+1) % batch_length) == 0:
-                    batch_accept_rate = sum(batch_accept)/batch_length
-                    total_accept_rate = n_accepted / (i+1)
+                    batch_accept_rate = batch_accepted / batch_length
+                    total_accept_rate = n_accepted / (i+1-start)
                     pbar.set_postfix({"batch acc. rate" : batch_accept_rate, "total acc. rate" : total_accept_rate})
 
+                    batch_accepted = 0
                     pbar.update(batch_length)
+        return state
 
-                previous = state
+    def sample(self, sample_size: int, init_state, burnin: int = 0, batch_length=100, lag=1, out: str = None, chunk_size: int = 10000, resume: str = None) -> Sample:
+        """Generate a Markov chain.
+
+        Parameters
+        ----------
+        sample_size
+            Number of points in the chain.
+        init_state
+            Initial state of the chain.
+        burnin
+            Number of steps discarded at the beginning of the chain.
+        batch_length
+            Number of steps over which the reported batch acceptance rate
+            is computed.
+        lag
+            Number of steps between consecutive points of the chain.
+        out
+            If given, the chain is not kept in memory but streamed to disk
+            by a SampleWriter with this file path, which also stores the
+            accept flags and the potential of the states (if available).
+            Each time a chunk is written (and every chunk_size burn-in
+            steps) a checkpoint is stored next to it, see save_checkpoint.
+        chunk_size
+            Number of points written to disk at once if out is given.
+        resume
+            Output path of an interrupted call with otherwise identical
+            arguments. The chain is continued from the last checkpoint,
+            exactly as if it had not been interrupted.
 
-        return Sample(data=data, target=self.target)
+        Returns
+        -------
+        Sample
+            The chain. If out is given, it is opened via Sample.load.
+        """
+        if resume is not None:
+            out = resume
+            state, phase, start = self.load_checkpoint(resume)
+        else:
+            state = self.init_state(init_state)
+            self.init_adapt(state)  # initial adaptation
+            phase, start = 'burnin', 0
+
+        if phase == 'burnin':
+            record = None
+            if out is not None:
+                def record(i, state, state_accepted):
+                    if (i + 1) % chunk_size == 0:
+                        self.save_checkpoint(out, state, 'burnin', i + 1)
+
+            if burnin > 0:
+                state = self._run(state, burnin, record, batch_length,
+                                  desc="Burn-in (lag=1)", start=start)
+            start = 0
+
+        desc = 'Sampling (lag={})'.format(lag)
+        if out is None:
+            data = np.empty((sample_size, self.target.ndim))
+            accepted = np.empty(sample_size, dtype=bool)
+
+            def record(i, state, state_accepted):
+                data[i] = state
+                accepted[i] = state_accepted
+
+            self._run(state, sample_size, record, batch_length, lag, desc)
+            return Sample(data=data, target=self.target, accepted=accepted)
+
+        fields = ['accepted']
+        if getattr(state, 'pot', None) is not None:
+            fields.append('pot')
+        current = [state]
+
+        def checkpoint(writer):
+            self.save_checkpoint(out, current[0], 'sampling', writer.size)
+
+        with SampleWriter(out, sample_size, self.target.ndim, fields,
+                          self.target, chunk_size,
+                          size=start if phase == 'sampling' else None,
+                          on_flush=checkpoint) as writer:
+
+            def record(i, state, state_accepted):
+                current[0] = state
+                writer.append(state, accepted=state_accepted,
+                              pot=getattr(state, 'pot', None))
+
+            self._run(state, sample_size, record, batch_length, lag, desc,
+                      start=start)
+        return Sample.load(out, self.target)
+
+    def sample_chains(self, sample_size: int, init_states, burnin: int = 0, lag=1) -> list:
+        """Generate several independent chains simultaneously.
+
+        All chains are advanced in lockstep via next_states, such that the
+        target (and its gradient) is evaluated once per step for all chains.
+
+        Parameters
+        ----------
+        sample_size
+            Number of points generated in each chain.
+        init_states
+            Array of shape (n_chains, ndim) containing the initial states.
+        burnin
+            Number of steps discarded at the beginning of each chain.
+        lag
+            Number of steps between consecutive points of the chains.
+
+        Returns
+        -------
+        list
+            One Sample per chain.
+        """
+        states = self.init_states(
+            np.array(init_states, dtype=float, ndmin=2))
+        n_chains = states.shape[0]
+
+        for i in tqdm(range(burnin), desc="Burn-in (lag=1)"):
+            states = self.next_states(states, i)
+
+        data = np.empty((n_chains, sample_size, self.target.ndim))
+        accepted = np.zeros((n_chains, sample_size), dtype=bool)
+        for i in tqdm(range(sample_size),
+                      desc='Sampling {} chains (lag={})'.format(n_chains, lag)):
+            for j in range(lag):
+                states = self.next_states(states, i)
+                accepted[:, i] |= self.last_accepted
+            data[:, i] = states
+
+        return [Sample(data=data[c], target=self.target, accepted=accepted[c])
+                for c in range(n_chains)]
 
 class CompositeMarkovUpdate(MarkovUpdate):
 
@@ -112,7 +392,7 @@ class CompositeMarkovUpdate(MarkovUpdate):
                 if update.target is not None:
                     target = update.target
                     break
-        super().__init__(ndim, is_adaptive=is_adaptive, target=target)
+        super().__init__(target, is_adaptive=is_adaptive)
 
         self.updates = updates
         self.masks = [None if masks is None or i not in masks else masks[i]
@@ -123,27 +403,44 @@ class CompositeMarkovUpdate(MarkovUpdate):
             state = update.init_state(initial_state)
             update.init_adapt(state)
 
+    def get_adapt_state(self):
+        return {'updates': [update.get_adapt_state()
+                            for update in self.updates]}
+
+    def set_adapt_state(self, adapt_state):
+        for update, state in zip(self.updates, adapt_state['updates']):
+            update.set_adapt_state(state)
+
     def next_state(self, state, iteration):
+        accepted = False
         for mechanism, mask in zip(self.updates, self.masks):
             if mask is None:
                 state = mechanism.next_state(state, iteration)
             else:
                 state = np.copy(state)
                 state[mask] = mechanism.next_state(state[mask], iteration)
+            if accepted is None or mechanism.last_accepted is None:
+                # unknown, the sampler compares the states instead
+                accepted = None
+            else:
+                accepted |= bool(mechanism.last_accepted)
 
+        self.last_accepted = accepted
         return state
 
 
 class MixingMarkovUpdate(MarkovUpdate):
 
     def __init__(self, updates, weights=None, masks=None,
-                 in_maps=None, out_maps=None, target=None):
+                 in_maps=None, out_maps=None, target=None, cache_size=16):
         """ Mix a number of update mechanisms, choosing one in each step.
 
         :param updates: List of update mechanisms (AbstractMarkovUpdate).
         :param weights: List of weights for each of the mechanisms (sum to 1).
         :param masks: Slice object, specify if updates only affect slice of
             state.
+        :param cache_size: Number of recent states for which the updates
+            share potentials and gradients (see StateCache).
         """
         is_adaptive = any(update.is_adaptive for update in updates)
         if target is None:
@@ -164,6 +461,13 @@ class MixingMarkovUpdate(MarkovUpdate):
         self.in_maps = in_maps or dict()
         self.out_maps = out_maps or dict()
 
+        self.set_state_cache(StateCache(cache_size))
+
+    def set_state_cache(self, state_cache):
+        super().set_state_cache(state_cache)
+        for update in self.updates:
+            update.set_state_cache(state_cache)
+
     def init_adapt(self, initial_state):
         for i, update in enumerate(self.updates):
             try:
@@ -173,6 +477,14 @@ class MixingMarkovUpdate(MarkovUpdate):
             state = update.init_state(init)
             update.init_adapt(state)
 
+    def get_adapt_state(self):
+        return {'updates': [update.get_adapt_state()
+                            for update in self.updates]}
+
+    def set_adapt_state(self, adapt_state):
+        for update, state in zip(self.updates, adapt_state['updates']):
+            update.set_adapt_state(state)
+
     def next_state(self, state, iteration):
         update_index = np.random.choice(self.updates_count, p=self.weights)
         update = self.updates[update_index]
@@ -189,6 +501,7 @@ class MixingMarkovUpdate(MarkovUpdate):
             state = np.copy(state)
             state[mask] = update.next_state(state[mask], iteration)
             next_state = state
+        self.last_accepted = update.last_accepted
 
         try:
             return self.out_maps[update_index](next_state).flatten()
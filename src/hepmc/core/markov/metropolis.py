@@ -1,6 +1,6 @@
 import numpy as np
 
-from ..density import Density
+from ..density import Density, Distribution
 from .base import MarkovUpdate
 from ..proposals import Gaussian
 
@@ -57,6 +57,16 @@ class MetropolisUpdate(MarkovUpdate):
         """
         raise NotImplementedError("MetropolisLikeUpdate is abstract.")
 
+    def proposals(self, states):
+        """ Generate one candidate for each row of states.
+
+        :param states: The current states of several chains,
+            shape (n_chains, ndim).
+        :return: Candidates of type MetropolisState with pot set.
+        """
+        raise NotImplementedError(
+            type(self).__name__ + " does not implement batched proposals.")
+
     def proposal_pdf(self, state, candidate):
         pass  # Implement for Hasting update.
 
@@ -66,11 +76,36 @@ class MetropolisUpdate(MarkovUpdate):
     def init_state(self, state):
         if not isinstance(state, MetropolisState):
             state = MetropolisState(state)
+        if state.pot is None and self.state_cache is not None:
+            self.state_cache.restore(state, self.target)
         if state.pot is None:
             state.pot = self.target.pot(state)
+            if self.state_cache is not None:
+                self.state_cache.update(state, self.target, pot=state.pot)
 
         return super().init_state(state)
 
+    def init_states(self, states):
+        if not isinstance(states, MetropolisState):
+            states = MetropolisState(states)
+        if states.pot is None:
+            states.pot = self.target.pot(states)
+
+        return super().init_states(states)
+
+    def next_states(self, states, iteration):
+        if self.is_adaptive:
+            raise NotImplementedError("Adaptive updates cannot advance "
+                                      "several chains in lockstep.")
+        candidates = self.proposals(states)
+        accept = self.accept(states, candidates)
+
+        accepted = np.log(np.random.rand(states.shape[0])) < accept
+        self.last_accepted = accepted
+        return MetropolisState(
+            np.where(accepted[:, np.newaxis], candidates, states),
+            pot=np.where(accepted, candidates.pot, states.pot))
+
     def next_state(self, state, iteration):
         candidate = self.proposal(state)
 
@@ -82,21 +117,26 @@ class MetropolisUpdate(MarkovUpdate):
             state = self.init_state(state)
             accept = self.accept(state, candidate)
 
-        if np.log(np.random.rand()) < accept:
+        self.last_accepted = bool(np.log(np.random.rand()) < accept)
+        if self.last_accepted:
             next_state = candidate
         else:
             next_state = state
 
         if self.is_adaptive:
-            accept = max(1., np.exp(accept))
+            accept = min(1., np.exp(accept))
             self.adapt(iteration, state, next_state, accept)
 
+        if self.state_cache is not None:
+            self.state_cache.update(next_state, self.target,
+                                    pot=next_state.pot)
         return next_state
 
 
 class DefaultMetropolis(MetropolisUpdate):
 
-    def __init__(self, target, proposal=None, cov=None, adaptive=False):
+    def __init__(self, target, proposal=None, cov=None, adaptive=False,
+                 buffer_size=0):
         """ Use the Metropolis algorithm to generate a sample.
 
         Example:
@@ -109,23 +149,122 @@ class DefaultMetropolis(MetropolisUpdate):
             Either a function accepting a numpy array of shape (ndim,) or
             a Density object.
         :param proposal: A Proposal object.
+        :param buffer_size: If positive, candidates are drawn ahead of time
+            in blocks of this size, together with their potentials and
+            proposal potentials. Only possible for proposals that do not
+            depend on the state (Distribution objects, e.g. MultiChannel).
         """
         if proposal is None:
             proposal = Gaussian(target.ndim, cov)
         self._proposal = proposal
 
+        if buffer_size > 0 and not isinstance(proposal, Distribution):
+            raise ValueError("Only proposals independent of the state "
+                             "(Distribution objects) can be buffered.")
+        self.buffer_size = buffer_size
+        self.clear_buffer()
+
         # must be at the and since it calls proposal_pdf to see if it works
         super().__init__(target,
                          adaptive=adaptive, hasting=not proposal.is_symmetric)
 
+    def clear_buffer(self):
+        """ Discard buffered candidates, required if the proposal changes. """
+        self._buffer = None
+        self._buffer_index = 0
+        # identifies proposal potentials computed for the current buffer
+        self._buffer_key = object()
+
+    @staticmethod
+    def _shuffled(xs, pot, proposal_pot):
+        """ Apply one random permutation to the candidates and their values.
+
+        Samplers like MultiChannel.rvs return the points ordered (e.g. by
+        channel), consecutive candidates must be independent however.
+        """
+        order = np.random.permutation(xs.shape[0])
+        return xs[order], pot[order], proposal_pot[order]
+
+    def _fill_buffer(self):
+        xs = self._proposal.rvs(self.buffer_size)
+        self._buffer = self._shuffled(
+            xs, self.target.pot(xs), self._proposal.proposal_mlogpdf(None, xs))
+        self._buffer_index = 0
+
+    def extend_buffer(self, xs, pot, proposal_pot):
+        """ Use the given candidates before any newly generated ones.
+
+        The candidates must be distributed according to the proposal in
+        its current state, e.g. points sampled from it before. Their order
+        does not matter, they are shuffled.
+
+        :param xs: Candidates of shape (N, ndim).
+        :param pot: Target potentials of the candidates.
+        :param proposal_pot: Proposal potentials (minus log pdf).
+        """
+        if self.buffer_size <= 0:
+            raise ValueError("Candidates are not buffered (buffer_size 0).")
+        given = self._shuffled(
+            np.asarray(xs, dtype=float).reshape(-1, self.target.ndim),
+            np.asarray(pot, dtype=float), np.asarray(proposal_pot, dtype=float))
+        if self._buffer is not None:
+            given = tuple(
+                np.concatenate([values, buffered[self._buffer_index:]])
+                for values, buffered in zip(given, self._buffer))
+        self._buffer = given
+        self._buffer_index = 0
+
+    def _take_buffered(self, count):
+        """ Take count candidates from the buffer, refilling it if needed.
+
+        :return: MetropolisState of shape (count, ndim) with pot and
+            proposal_pot set.
+        """
+        parts = []
+        while count > 0:
+            if (self._buffer is None or
+                    self._buffer_index == self._buffer[0].shape[0]):
+                self._fill_buffer()
+            start = self._buffer_index
+            stop = min(start + count, self._buffer[0].shape[0])
+            parts.append([values[start:stop] for values in self._buffer])
+            self._buffer_index = stop
+            count -= stop - start
+
+        xs, pot, proposal_pot = (np.concatenate(values)
+                                 for values in zip(*parts))
+        candidates = MetropolisState(xs, pot)
+        candidates.proposal_pot = (self._buffer_key, proposal_pot)
+        return candidates
+
     def proposal(self, state):
+        if self.buffer_size > 0:
+            candidate = self._take_buffered(1)
+            key, proposal_pot = candidate.proposal_pot
+            candidate = MetropolisState(candidate[0], candidate.pot[0])
+            candidate.proposal_pot = (key, proposal_pot[0])
+            return candidate
+
         #candidate = self._proposal.proposal(np.asarray(state))
         candidate = self._proposal.proposal(state)
         return MetropolisState(candidate, self.target.pot(candidate))
 
+    def proposals(self, states):
+        if self.buffer_size > 0:
+            return self._take_buffered(len(states))
+
+        candidates = self._proposal.proposals(states)
+        return MetropolisState(candidates, self.target.pot(candidates))
+
     def proposal_pdf(self, state, candidate):
         return self._proposal.proposal_pdf(state, candidate)
 
     # minus log pdf
     def proposal_mlogpdf(self, state, candidate):
+        if self.buffer_size > 0:
+            # independent of state, reuse the value computed for the buffer
+            key, proposal_pot = getattr(candidate, 'proposal_pot',
+                                        (None, None))
+            if key is self._buffer_key:
+                return proposal_pot
         return self._proposal.proposal_mlogpdf(state, candidate)
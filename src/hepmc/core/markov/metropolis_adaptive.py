@@ -6,6 +6,8 @@ class StochasticOptimizeUpdate(DefaultMetropolis):
     """
     Adapts the cov of a local proposal distribution by dual averaging
     """
+
+    adapt_attributes = ('accepted', 'generated')
     def __init__(self, target_density, local_dist, target_rate=0.6,
                  adapt_schedule=None, kappa=0.75, mult=0.005, t0=1):
         super().__init__(target_density.ndim, target_density, adaptive=True,
@@ -28,6 +30,16 @@ class StochasticOptimizeUpdate(DefaultMetropolis):
         self.accepted = 0
         self.generated = 0
 
+    def get_adapt_state(self):
+        adapt_state = super().get_adapt_state()
+        adapt_state['local_cov'] = np.copy(self.local_dist.cov)
+        return adapt_state
+
+    def set_adapt_state(self, adapt_state):
+        adapt_state = dict(adapt_state)
+        self.local_dist.cov = adapt_state.pop('local_cov')
+        super().set_adapt_state(adapt_state)
+
     def adapt(self, t, prev, current, accept):
         if t > self.t0:
             Ht = self.target_rate - self.accepted / self.generated
@@ -37,7 +49,7 @@ class StochasticOptimizeUpdate(DefaultMetropolis):
     def next_state(self, state, iteration):
         next_state = super().next_state(state, iteration)
         self.generated += 1
-        self.accepted += not np.array_equal(state, next_state)
+        self.accepted += self.last_accepted
         return next_state
 
 
@@ -46,6 +58,8 @@ class AdaptiveMetropolisUpdate(DefaultMetropolis):
     Adaptive Metropolis-Hastings sampler according to Haario et al. (2001)
     """
 
+    adapt_attributes = ('mean', 'mean_previous', 'cov')
+
     def __init__(self, target: Density, proposal: Density,
             t_initial: int, adapt_schedule) -> None:
         super().__init__(target, proposal)
@@ -66,6 +80,16 @@ class AdaptiveMetropolisUpdate(DefaultMetropolis):
         self.mean_previous = None
         self.cov = self._proposal.cov
     
+    def get_adapt_state(self) -> dict:
+        adapt_state = super().get_adapt_state()
+        adapt_state['proposal_cov'] = np.copy(self._proposal.cov)
+        return adapt_state
+
+    def set_adapt_state(self, adapt_state: dict) -> None:
+        adapt_state = dict(adapt_state)
+        self._proposal.cov = adapt_state.pop('proposal_cov')
+        super().set_adapt_state(adapt_state)
+
     def adapt(self, t: int, prev, current, accept: float) -> None:
         """Adapt the proposal."""
         t = t+1
@@ -0,0 +1,116 @@
+import numpy as np
+
+from .metropolis import DefaultMetropolis, MetropolisState
+
+
+class DelayedAcceptanceMetropolis(DefaultMetropolis):
+    """
+    Two-stage delayed acceptance Metropolis-Hastings (Christen & Fox, 2005)
+    """
+
+    def __init__(self, target, surrogate_pot, proposal=None, cov=None):
+        """ Screen candidates with a cheap surrogate of the target potential.
+
+        In the first stage a candidate y is accepted with the
+        Metropolis(-Hastings) probability of the surrogate density
+        exp(-surrogate_pot). Only candidates passing the first stage are
+        evaluated with the target and accepted with probability
+        min(1, exp(pot(x) - pot(y) - surrogate_pot(x) + surrogate_pot(y))),
+        which corrects for the surrogate such that detailed balance with
+        respect to the target holds.
+
+        Example:
+            >>> params = basis.extreme_learning_train(xs, pots, 100)
+            >>> surrogate = lambda xs: basis.eval(*params, xs)
+            >>> update = DelayedAcceptanceMetropolis(target, surrogate)
+
+        :param target: Desired (unnormalized) probability distribution.
+        :param surrogate_pot: Function mapping points of shape (N, ndim)
+            to approximations of target.pot, e.g. an extreme learning
+            fit of the potential (see surrogate.extreme_learning).
+        :param proposal: A Proposal object (default: Gaussian).
+        :param cov: Covariance of the default Gaussian proposal.
+        """
+        super().__init__(target, proposal, cov)
+        self.surrogate_pot = surrogate_pot
+
+        # candidates generated and candidates passing the first stage
+        self.generated = 0
+        self.screened = 0
+
+    @property
+    def screening_rate(self):
+        """ Fraction of candidates evaluated with the target. """
+        return self.screened / max(1, self.generated)
+
+    def _surrogate(self, state):
+        """ Surrogate potential of a single state, stored on the state. """
+        # tagged with the surrogate, other updates may use different ones
+        surrogate, value = getattr(state, 'surrogate_pot', (None, None))
+        if surrogate is not self.surrogate_pot:
+            value = float(self.surrogate_pot(
+                np.array(state, dtype=float, ndmin=2))[0])
+            state.surrogate_pot = (self.surrogate_pot, value)
+        return value
+
+    def _first_stage(self, states, candidates, surrogate_states,
+                     surrogate_candidates):
+        """ Log acceptance probability of the surrogate stage. """
+        log_accept = surrogate_states - surrogate_candidates
+        if self.is_hasting:
+            log_accept = (log_accept +
+                          self.proposal_mlogpdf(states, candidates) -
+                          self.proposal_mlogpdf(candidates, states))
+        return log_accept
+
+    def next_state(self, state, iteration):
+        state = self.init_state(state)
+        # the target is only evaluated if the candidate passes stage one
+        candidate = MetropolisState(self._proposal.proposal(state))
+
+        surrogate_state = self._surrogate(state)
+        surrogate_candidate = self._surrogate(candidate)
+        log_accept = self._first_stage(state, candidate, surrogate_state,
+                                       surrogate_candidate)
+
+        self.generated += 1
+        self.last_accepted = False
+        if np.log(np.random.rand()) < log_accept:
+            self.screened += 1
+            candidate.pot = self.target.pot(candidate)
+            with np.errstate(invalid='ignore'):
+                log_accept = (state.pot - candidate.pot -
+                              surrogate_state + surrogate_candidate)
+            self.last_accepted = bool(np.log(np.random.rand()) < log_accept)
+
+        next_state = candidate if self.last_accepted else state
+        if self.state_cache is not None:
+            self.state_cache.update(next_state, self.target,
+                                    pot=next_state.pot)
+        return next_state
+
+    def next_states(self, states, iteration):
+        states = self.init_states(states)
+        count = states.shape[0]
+        candidates = MetropolisState(self._proposal.proposals(states))
+
+        surrogate_states = self.surrogate_pot(np.asarray(states))
+        surrogate_candidates = self.surrogate_pot(np.asarray(candidates))
+        log_accept = self._first_stage(states, candidates, surrogate_states,
+                                       surrogate_candidates)
+        screened = np.log(np.random.rand(count)) < log_accept
+
+        pot = np.full(count, np.inf)
+        if np.any(screened):
+            pot[screened] = self.target.pot(candidates[screened])
+        with np.errstate(invalid='ignore'):
+            log_accept = (states.pot - pot -
+                          surrogate_states + surrogate_candidates)
+        accepted = screened & (np.log(np.random.rand(count)) < log_accept)
+
+        self.generated += count
+        self.screened += np.count_nonzero(screened)
+        self.last_accepted = accepted
+        return MetropolisState(
+            np.where(accepted[:, np.newaxis], candidates, states),
+            pot=np.where(accepted, pot, states.pot))
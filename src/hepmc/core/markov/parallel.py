@@ -0,0 +1,141 @@
+import copy
+import numpy as np
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from tqdm import tqdm
+
+from ..sampling import Sample
+from .base import MarkovUpdate
+
+
+class ChainsSample(Sample):
+
+    def __init__(self, chain_bounds, **kwargs):
+        """ Sample obtained by concatenating several independent chains.
+
+        :param chain_bounds: Starting index of each chain in self.data.
+            Starts with zero, the last chain ends at the end of the sample.
+        """
+        super().__init__(**kwargs)
+        self.chain_bounds = np.asarray(chain_bounds)
+
+    @property
+    def chain_count(self):
+        return self.chain_bounds.size
+
+    def chain(self, index):
+        """ Return the points of a single chain as Sample. """
+        bounds = np.append(self.chain_bounds, self.size)
+        chain = slice(bounds[index], bounds[index + 1])
+        accepted = None if self.accepted is None else self.accepted[chain]
+        return Sample(data=self.data[chain], target=self.target,
+                      accepted=accepted)
+
+
+# state of a worker process, set by _init_worker
+_worker = dict()
+
+
+def _init_worker(update, data_name, accepted_name, shape):
+    _worker['update'] = update
+    # keep references to the shared memory blocks, so they are not closed
+    _worker['data_shm'] = SharedMemory(name=data_name)
+    _worker['accepted_shm'] = SharedMemory(name=accepted_name)
+    _worker['data'] = np.ndarray(
+        shape, dtype=np.float64, buffer=_worker['data_shm'].buf)
+    _worker['accepted'] = np.ndarray(
+        shape[:2], dtype=np.bool_, buffer=_worker['accepted_shm'].buf)
+
+
+def _run_chain(args):
+    index, init_state, seed, burnin, lag = args
+    np.random.seed(seed)
+    # the update of a worker runs several chains, its state (e.g. the
+    # adaptation) must not carry over from one to the next
+    update = copy.deepcopy(_worker['update'])
+
+    state = update.init_state(init_state)
+    update.init_adapt(state)
+    if burnin > 0:
+        state = update._run(state, burnin, progress=False)
+
+    data = _worker['data'][index]
+    accepted = _worker['accepted'][index]
+
+    def record(i, state, state_accepted):
+        data[i] = state
+        accepted[i] = state_accepted
+
+    update._run(state, data.shape[0], record, lag=lag, progress=False)
+    return index
+
+
+class ParallelChains(object):
+
+    def __init__(self, update: MarkovUpdate, processes=None, seed=None) -> None:
+        """ Run independent chains of a Markov update in worker processes.
+
+        Each chain is run by MarkovUpdate in a separate process, using its
+        own seed for the (global) numpy random state and its own copy of
+        the update, so the chains do not depend on how they are distributed
+        over the workers. The workers write the generated points directly
+        into shared memory.
+
+        Where processes are not forked (e.g. on Windows), the update
+        must be picklable.
+
+        :param update: The Markov update used in every chain.
+        :param processes: Number of worker processes (default: cpu count).
+        :param seed: Seed from which the seeds of the chains are derived.
+            Using the same seed reproduces the same chains.
+        """
+        self.update = update
+        self.target = update.target
+        self.processes = processes
+        self.seed = seed
+
+    def chain_seeds(self, chain_count):
+        """ Independent seeds for chain_count chains. """
+        children = np.random.SeedSequence(self.seed).spawn(chain_count)
+        return [child.generate_state(4) for child in children]
+
+    def sample(self, sample_size: int, init_states, burnin: int = 0, lag=1) -> ChainsSample:
+        """ Generate one chain of length sample_size per initial state.
+
+        :param sample_size: Number of points generated in each chain.
+        :param init_states: Initial states, shape (chain_count, ndim).
+        :param burnin: Number of steps discarded at the beginning of each chain.
+        :param lag: Number of steps between consecutive points of the chains.
+        :return: ChainsSample containing all chains one after the other.
+        """
+        init_states = np.array(init_states, dtype=float, ndmin=2)
+        chain_count = init_states.shape[0]
+        shape = (chain_count, sample_size, self.target.ndim)
+
+        data_shm = SharedMemory(create=True, size=max(1, 8 * np.prod(shape)))
+        accepted_shm = SharedMemory(create=True,
+                                    size=max(1, chain_count * sample_size))
+        try:
+            tasks = [(index, init_states[index], seed, burnin, lag)
+                     for index, seed in enumerate(self.chain_seeds(chain_count))]
+            with Pool(self.processes, initializer=_init_worker,
+                      initargs=(self.update, data_shm.name,
+                                accepted_shm.name, shape)) as pool:
+                for _ in tqdm(pool.imap_unordered(_run_chain, tasks),
+                              total=chain_count, desc='Chains'):
+                    pass
+
+            data = np.ndarray(shape, dtype=np.float64, buffer=data_shm.buf)
+            accepted = np.ndarray(shape[:2], dtype=np.bool_,
+                                  buffer=accepted_shm.buf)
+            # copy out of the shared memory before it is released
+            data = data.reshape(chain_count * sample_size, -1).copy()
+            accepted = accepted.flatten()
+        finally:
+            data_shm.close()
+            data_shm.unlink()
+            accepted_shm.close()
+            accepted_shm.unlink()
+
+        return ChainsSample(np.arange(chain_count) * sample_size, data=data,
+                            target=self.target, accepted=accepted)
@@ -34,7 +34,11 @@ class LogitDensity(Density):
         pot = self.density.pot(ps)
         return pot
 
-    #def pot_gradient(self, xs):
-    #    ps = expit(xs)
-    #    grad = self.density.pot_gradient(ps)
-    #    return grad
+    def pot_gradient(self, xs):
+        return self.pot_and_gradient(xs)[1]
+
+    def pot_and_gradient(self, xs):
+        ps = expit(xs)
+        pot, grad = self.density.pot_and_gradient(ps)
+        # chain rule, d expit(x) / dx = expit(x) * (1 - expit(x))
+        return pot, grad * ps * (1 - ps)
@@ -1,5 +1,5 @@
 from ..density import Density
-from ..util import hypercube_bounded
+from ..util import hypercube_bounded, interpret_array
 from ..markov.base import MarkovUpdate
 import numpy as np
 
@@ -21,6 +21,22 @@ class PhaseSpaceMapping(object):
     def map_inverse(self, xs):
         raise NotImplementedError
 
+    def map_and_jacobian(self, xs):
+        """ Map xs and compute the Jacobian of the map.
+
+        :return: Tuple (ps, jacobian) of shapes (N, ndim_out) and
+            (N, ndim_out, ndim).
+        """
+        raise NotImplementedError
+
+    def map_jvp(self, xs, vs):
+        """ Jacobian-vector product, push tangent vectors vs at xs forward. """
+        return np.einsum('kij,kj->ki', self.map_and_jacobian(xs)[1], vs)
+
+    def map_vjp(self, xs, vs):
+        """ Vector-Jacobian product, pull gradients vs at map(xs) back to xs. """
+        return np.einsum('kij,ki->kj', self.map_and_jacobian(xs)[1], vs)
+
     def input_remapper(self, other):
         """ this returns mapping: xs -> other^-1 ( self ( xs ) ) """
         class Mapping(PhaseSpaceMapping):
@@ -40,17 +56,67 @@ class PhaseSpaceMapping(object):
 class MappedDensity(Density):
     """
     Map the inputs before they are passed to the density
+
+    If a cut is given, it is applied to the mapped points and the density
+    is only evaluated where it passes (elsewhere the pdf is zero).
+    The number of points the cut was applied to and the number of points
+    passing it are counted in cut_trials and cut_passed. Only pdf and pot
+    evaluations are counted, the gradient methods do not change them.
+
+    The gradients of the potential require the mapping to implement
+    map_and_jacobian.
     """
-    def __init__(self, density, mapping, norm=1):
+    def __init__(self, density, mapping, norm=1, cut=None):
         super().__init__(mapping.ndim)
         self.density = density
         self.mapping = mapping
         self.norm = norm
+        self.cut = cut
+        self.cut_trials = 0
+        self.cut_passed = 0
+
+    @property
+    def cut_efficiency(self):
+        """ Fraction of the points so far that passed the cut. """
+        if self.cut_trials == 0:
+            return np.nan
+        return self.cut_passed / self.cut_trials
+
+    def _cut(self, ps, count=True):
+        """ Mask of the mapped points ps that pass the cut.
+
+        :param count: Whether to add the points to the cut statistics.
+        """
+        if self.cut is None:
+            return np.ones(ps.shape[0], dtype=bool)
+        passed = np.asarray(self.cut(ps), dtype=bool)
+        if count:
+            self.cut_trials += passed.size
+            self.cut_passed += np.count_nonzero(passed)
+        return passed
+
+    def _map_cut(self, xs):
+        """ Map xs and return the mapped points passing the cut and a mask. """
+        ps = self.mapping.map(xs)
+        passed = self._cut(ps)
+        return ps[passed], passed
+
+    def _map_cut_jacobian(self, xs):
+        """ As _map_cut, with the Jacobians of the map at the passing points.
+
+        The points are mapped only once, by map_and_jacobian. They are
+        not added to the cut statistics.
+        """
+        ps, jacobian = self.mapping.map_and_jacobian(xs)
+        passed = self._cut(ps, count=False)
+        return ps[passed], jacobian[passed], passed
 
     @hypercube_bounded(1, self_has_ndim=True)
     def pdf(self, xs):
-        ps = self.mapping.map(xs)
-        pdf = self.density.pdf(ps) / self.mapping.pdf(xs)
+        ps, passed = self._map_cut(xs)
+        pdf = np.zeros(xs.shape[0])
+        if ps.shape[0] > 0:
+            pdf[passed] = self.density.pdf(ps) / self.mapping.pdf(xs[passed])
         if self.norm is not None:
             return pdf / self.norm
         return pdf
@@ -61,14 +127,45 @@ class MappedDensity(Density):
 
     @hypercube_bounded(1, null_value=np.inf, self_has_ndim=True)
     def pot(self, xs):
-        ps = self.mapping.map(xs)
-        pot = self.density.pot(ps)
-        return pot - np.log(self.norm) - np.log(self.mapping.pdf(xs))
+        ps, passed = self._map_cut(xs)
+        pot = np.full(xs.shape[0], np.inf)
+        if ps.shape[0] > 0:
+            pot[passed] = (self.density.pot(ps) - np.log(self.norm) -
+                           np.log(self.mapping.pdf(xs[passed])))
+        return pot
 
     def pot_gradient(self, xs):
-        ps = self.mapping.map(xs)
-        grad = self.density.pot_gradient(ps)
-        return grad - self.mapping.pdf_gradient(xs) / self.mapping.pdf(xs)
+        xs = interpret_array(xs, self.ndim)
+        ps, jacobian, passed = self._map_cut_jacobian(xs)
+        grad = np.full(xs.shape, np.inf)
+        if ps.shape[0] > 0:
+            xs = xs[passed]
+            grad_ps = self.density.pot_gradient(ps)
+            grad[passed] = (np.einsum('kij,ki->kj', jacobian, grad_ps) -
+                            self.mapping.pdf_gradient(xs) /
+                            np.reshape(self.mapping.pdf(xs), (-1, 1)))
+        return grad
+
+    def pot_and_gradient(self, xs):
+        xs = interpret_array(xs, self.ndim)
+        in_bounds = np.all((0 < xs) * (xs < 1), axis=1)
+
+        pot = np.full(xs.shape[0], np.inf)
+        grad = np.full(xs.shape, np.inf)
+        # points in bounds that pass the cut
+        valid = np.flatnonzero(in_bounds)
+        if valid.size > 0:
+            ps, jacobian, passed = self._map_cut_jacobian(xs[valid])
+            valid = valid[passed]
+        if valid.size > 0:
+            xs_valid = xs[valid]
+            map_pdf = self.mapping.pdf(xs_valid)
+            pot_ps, grad_ps = self.density.pot_and_gradient(ps)
+            pot[valid] = pot_ps - np.log(self.norm) - np.log(map_pdf)
+            grad[valid] = (np.einsum('kij,ki->kj', jacobian, grad_ps) -
+                           self.mapping.pdf_gradient(xs_valid) /
+                           np.reshape(map_pdf, (-1, 1)))
+        return pot, grad
 
 # class MappedMarkov(MarkovUpdate):
 #
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.optimize import brentq
 from math import gamma
 from ..util import interpret_array
 from .mapping import PhaseSpaceMapping
@@ -12,7 +11,7 @@ class Rambo(PhaseSpaceMapping):
     def __init__(self, e_cm, nparticles):
         self.e_cm = e_cm
         self.nparticles = nparticles
-        super().__init__(nparticles * 4)
+        super().__init__(nparticles * 4, nparticles * 4)
 
     def pdf(self, xs):
         nparticles = self.nparticles
@@ -60,8 +59,89 @@ class Rambo(PhaseSpaceMapping):
     def pdf_gradient(self, xs):
         return 0
 
-    def map_inverse(self, xs):
-        raise NotImplementedError
+    def map_and_jacobian(self, xs):
+        xs = interpret_array(xs, self.ndim)
+        nparticles = self.nparticles
+        e_cm = self.e_cm
+        count = xs.shape[0]
+        xs = xs.reshape(count, nparticles, 4)
+
+        q = map_fourvector_rambo(xs)
+        # dq[k, p, i, d] is the derivative of q[k, p, i] by input d
+        dq = np.einsum('kpij,pr->kpirj', map_fourvector_rambo_jacobian(xs),
+                       np.eye(nparticles)).reshape(count, nparticles, 4, -1)
+        Q = np.add.reduce(q, axis=1)
+        dQ = np.add.reduce(dq, axis=1)
+
+        M = np.sqrt(np.einsum('kd,dd,kd->k', Q, MINKOWSKI, Q))
+        dM = np.einsum('ki,ij,kjd->kd', Q, MINKOWSKI, dQ) / M[:, np.newaxis]
+        b = -Q[:, 1:] / M[:, np.newaxis]
+        db = -(dQ[:, 1:] + b[:, :, np.newaxis] * dM[:, np.newaxis, :]) / (
+            M[:, np.newaxis, np.newaxis])
+        x = e_cm / M
+        dx = -x[:, np.newaxis] * dM / M[:, np.newaxis]
+        gamma = Q[:, 0] / M
+        dgamma = (dQ[:, 0] - gamma[:, np.newaxis] * dM) / M[:, np.newaxis]
+        a = 1. / (1. + gamma)
+        da = -(a ** 2)[:, np.newaxis] * dgamma
+
+        q0, dq0 = q[:, :, 0], dq[:, :, 0]
+        q3, dq3 = q[:, :, 1:], dq[:, :, 1:]
+        bdotq = np.einsum('ki,kpi->kp', b, q3)
+        dbdotq = (np.einsum('kid,kpi->kpd', db, q3) +
+                  np.einsum('ki,kpid->kpd', b, dq3))
+
+        p = np.empty((count, nparticles, 4))
+        dp = np.empty(dq.shape)
+
+        energy = gamma[:, np.newaxis] * q0 + bdotq
+        p[:, :, 0] = x[:, np.newaxis] * energy
+        dp[:, :, 0] = (dx[:, np.newaxis, :] * energy[:, :, np.newaxis] +
+                       x[:, np.newaxis, np.newaxis] * (
+                           dgamma[:, np.newaxis, :] * q0[:, :, np.newaxis] +
+                           gamma[:, np.newaxis, np.newaxis] * dq0 + dbdotq))
+
+        momentum = (q3 + b[:, np.newaxis, :] * q0[:, :, np.newaxis] +
+                    (a[:, np.newaxis] * bdotq)[:, :, np.newaxis] *
+                    b[:, np.newaxis, :])
+        p[:, :, 1:] = x[:, np.newaxis, np.newaxis] * momentum
+
+        # make dimensions match (samples * nparticles * space dim * inputs)
+        b, db = b[:, np.newaxis, :, np.newaxis], db[:, np.newaxis]
+        q0, dq0 = q0[:, :, np.newaxis, np.newaxis], dq0[:, :, np.newaxis]
+        bdotq, dbdotq = bdotq[:, :, np.newaxis, np.newaxis], dbdotq[:, :, np.newaxis]
+        a, da = a[:, np.newaxis, np.newaxis, np.newaxis], da[:, np.newaxis, np.newaxis]
+        dmomentum = (dq3 + db * q0 + b * dq0 + (da * bdotq + a * dbdotq) * b +
+                     a * bdotq * db)
+        dp[:, :, 1:] = (dx[:, np.newaxis, np.newaxis, :] * momentum[..., np.newaxis] +
+                        x[:, np.newaxis, np.newaxis, np.newaxis] * dmomentum)
+
+        return (p.reshape(count, nparticles * 4),
+                dp.reshape(count, nparticles * 4, nparticles * 4))
+
+    def map_inverse(self, ps):
+        """ A point in the unit hypercube that is mapped to ps.
+
+        The map is not one-to-one, 4 * nparticles random numbers fix
+        the nparticles momenta together with a boost and a scaling.
+        The point returned corresponds to intermediate momenta at rest
+        with total energy 2 * nparticles (the expectation value), and
+        the last two random numbers of each momentum are set equal.
+        """
+        ps = interpret_array(ps, self.ndim)
+        nparticles = self.nparticles
+        count = ps.shape[0]
+
+        q = ps.reshape(count, nparticles, 4)
+        q = q * (2. * nparticles / q[:, :, 0].sum(axis=1))[:, np.newaxis, np.newaxis]
+
+        xs = np.empty((count, nparticles, 4))
+        xs[:, :, 0] = .5 * (q[:, :, 3] / q[:, :, 0] + 1)
+        phi = np.arctan2(q[:, :, 2], q[:, :, 1])
+        xs[:, :, 1] = phi / (2 * np.pi) + (phi < 0)
+        xs[:, :, 2] = xs[:, :, 3] = np.exp(-.5 * q[:, :, 0])
+
+        return xs.reshape(count, nparticles * 4)
 
 
 class RamboOnDiet(PhaseSpaceMapping):
@@ -69,7 +149,7 @@ class RamboOnDiet(PhaseSpaceMapping):
     def __init__(self, e_cm, nparticles):
         self.e_cm = e_cm
         self.nparticles = nparticles
-        super().__init__(nparticles * 3 - 4)
+        super().__init__(nparticles * 3 - 4, nparticles * 4)
 
     def map(self, xs):
         xs = interpret_array(xs, self.ndim)
@@ -89,13 +169,7 @@ class RamboOnDiet(PhaseSpaceMapping):
         for i in range(2, nparticles + 1):
             Q_prev[:, :] = Q[:, :]
             if i != nparticles:
-                u[:, i - 2] = [
-                    brentq(lambda x: ((nparticles + 1 - i) *
-                                      x ** (2 * (nparticles - i)) -
-                                      (nparticles - i) *
-                                      x ** (2 * (nparticles + 1 - i)) - r_i),
-                           0., 1.)
-                    for r_i in xs[:, i - 2]]
+                u[:, i - 2] = solve_mass_ratio(xs[:, i - 2], nparticles - i)
                 M[:, i - 1] = np.product(u[:, :i - 1], axis=1) * e_cm
 
             cos_theta = 2 * xs[:, nparticles - 6 + 2 * i] - 1
@@ -116,6 +190,75 @@ class RamboOnDiet(PhaseSpaceMapping):
 
         return p.reshape((xs.shape[0], nparticles * 4))
 
+    def map_and_jacobian(self, xs):
+        xs = interpret_array(xs, self.ndim)
+        nparticles = self.nparticles
+        e_cm = self.e_cm
+        count = xs.shape[0]
+        ndim = self.ndim
+
+        # derivatives by the inputs are stored along an additional last axis
+        p = np.empty((count, nparticles, 4))
+        dp = np.empty((count, nparticles, 4, ndim))
+
+        Q = np.tile([e_cm, 0, 0, 0], (count, 1))
+        dQ = np.zeros((count, 4, ndim))
+        M_prev = np.full(count, float(e_cm))
+        dM_prev = np.zeros((count, ndim))
+
+        for i in range(2, nparticles + 1):
+            if i != nparticles:
+                k = nparticles - i
+                u = solve_mass_ratio(xs[:, i - 2], k)
+                # implicit derivative, r = (k+1) u^(2k) - k u^(2(k+1))
+                du = 1. / (2 * k * (k + 1) * u ** (2 * k - 1) * (1 - u ** 2))
+                M = M_prev * u
+                dM = dM_prev * u[:, np.newaxis]
+                dM[:, i - 2] += M_prev * du
+            else:
+                M = np.zeros(count)
+                dM = np.zeros((count, ndim))
+
+            i_theta = nparticles - 6 + 2 * i
+            i_phi = nparticles - 5 + 2 * i
+            cos_theta = 2 * xs[:, i_theta] - 1
+            sin_theta = np.sqrt(1 - cos_theta ** 2)
+            phi = 2 * np.pi * xs[:, i_phi]
+
+            # 4 * M_prev * two_body_decay_factor(M_prev, M, 0)
+            q = (M_prev ** 2 - M ** 2) / (2 * M_prev)
+            dq = .5 * ((1 + (M / M_prev) ** 2)[:, np.newaxis] * dM_prev -
+                       (2 * M / M_prev)[:, np.newaxis] * dM)
+
+            direction = np.stack([np.ones(count), sin_theta * np.cos(phi),
+                                  sin_theta * np.sin(phi), cos_theta], axis=1)
+            ph = q[:, np.newaxis] * direction
+            dph = direction[:, :, np.newaxis] * dq[:, np.newaxis, :]
+            dsin_theta = -2 * cos_theta / sin_theta
+            dph[:, 1, i_theta] += q * dsin_theta * np.cos(phi)
+            dph[:, 2, i_theta] += q * dsin_theta * np.sin(phi)
+            dph[:, 3, i_theta] += 2 * q
+            dph[:, 1, i_phi] -= 2 * np.pi * ph[:, 2]
+            dph[:, 2, i_phi] += 2 * np.pi * ph[:, 1]
+
+            Q_rest = np.empty((count, 4))
+            dQ_rest = np.empty((count, 4, ndim))
+            Q_rest[:, 0] = np.sqrt(q ** 2 + M ** 2)
+            dQ_rest[:, 0] = (q[:, np.newaxis] * dq + M[:, np.newaxis] * dM) / (
+                Q_rest[:, 0, np.newaxis])
+            Q_rest[:, 1:] = -ph[:, 1:]
+            dQ_rest[:, 1:] = -dph[:, 1:]
+
+            p[:, i - 2], dp[:, i - 2] = boost_tangent(Q, dQ, ph, dph)
+            Q, dQ = boost_tangent(Q, dQ, Q_rest, dQ_rest)
+            M_prev, dM_prev = M, dM
+
+        p[:, nparticles - 1] = Q
+        dp[:, nparticles - 1] = dQ
+
+        return (p.reshape(count, nparticles * 4),
+                dp.reshape(count, nparticles * 4, ndim))
+
     def map_inverse(self, p):
         count = p.size // (self.nparticles * 4)
         p = p.reshape((count, self.nparticles, 4))
@@ -172,10 +315,113 @@ def map_fourvector_rambo(xs):
     return q
 
 
+def map_fourvector_rambo_jacobian(xs):
+    """ Jacobian of map_fourvector_rambo for each four-vector.
+
+    :return: Array of shape xs.shape + (4,), the derivatives of
+        the components q[..., i] by the inputs xs[..., j] are at [..., i, j].
+    """
+    c = 2. * xs[:, :, 0] - 1.
+    phi = 2. * np.pi * xs[:, :, 1]
+    s = np.sqrt(1 - c ** 2)
+    energy = -np.log(xs[:, :, 2] * xs[:, :, 3])
+
+    # derivatives of the energy, the cosine, sine and phi by the inputs
+    denergy = np.zeros(xs.shape)
+    denergy[:, :, 2] = -1. / xs[:, :, 2]
+    denergy[:, :, 3] = -1. / xs[:, :, 3]
+    dc = np.zeros(xs.shape)
+    dc[:, :, 0] = 2.
+    ds = -(c / s)[:, :, np.newaxis] * dc
+    dphi = np.zeros(xs.shape)
+    dphi[:, :, 1] = 2. * np.pi
+
+    energy, c, s = (energy[:, :, np.newaxis], c[:, :, np.newaxis],
+                    s[:, :, np.newaxis])
+    cos_phi, sin_phi = np.cos(phi)[:, :, np.newaxis], np.sin(phi)[:, :, np.newaxis]
+
+    dq = np.empty(xs.shape + (4,))
+    dq[:, :, 0] = denergy
+    dq[:, :, 1] = (denergy * s + energy * ds) * cos_phi - energy * s * sin_phi * dphi
+    dq[:, :, 2] = (denergy * s + energy * ds) * sin_phi + energy * s * cos_phi * dphi
+    dq[:, :, 3] = denergy * c + energy * dc
+
+    return dq
+
+
+def solve_mass_ratio(r, k, xtol=1e-14, max_iter=100):
+    """ Solve (k+1) u^(2k) - k u^(2(k+1)) = r for u in [0, 1].
+
+    Vectorized safeguarded Newton iteration in y = u^2, where the left hand
+    side (k+1) y^k - k y^(k+1) increases monotonically from 0 to 1.
+    Newton steps leaving the bracket of the root are replaced by bisection.
+
+    :param r: Array of values in [0, 1].
+    :param k: Positive integer exponent.
+    :return: Array of solutions u, same shape as r.
+    """
+    shape = np.shape(r)
+    r = np.asarray(r, dtype=float).reshape(-1)
+    # start from the leading order expansions around y = 0 and y = 1
+    y = np.where(r < .5, (r / (k + 1)) ** (1. / k),
+                 1 - np.sqrt(2 * (1 - r) / (k * (k + 1))))
+    y = np.clip(y, 0., 1.)
+    lo = np.zeros(r.size)
+    hi = np.ones(r.size)
+
+    active = np.arange(r.size)
+    for _ in range(max_iter):
+        if active.size == 0:
+            break
+        y_a, r_a = y[active], r[active]
+        f = (k + 1) * y_a ** k - k * y_a ** (k + 1) - r_a
+        lo_a = np.where(f < 0, y_a, lo[active])
+        hi_a = np.where(f > 0, y_a, hi[active])
+
+        df = k * (k + 1) * y_a ** (k - 1) * (1 - y_a)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y_new = np.where(f == 0, y_a, y_a - f / df)
+        bisect = ~((lo_a <= y_new) & (y_new <= hi_a))
+        y_new[bisect] = .5 * (lo_a[bisect] + hi_a[bisect])
+
+        y[active], lo[active], hi[active] = y_new, lo_a, hi_a
+        # stop at the step size tolerance or when rounding errors dominate
+        done = ((np.abs(y_new - y_a) <= xtol) | (hi_a - lo_a <= xtol) |
+                (np.abs(f) <= 4 * np.finfo(float).eps * r_a))
+        active = active[~done]
+
+    return np.sqrt(y).reshape(shape)
+
+
 def two_body_decay_factor(M_i_minus_1, M_i, m_i_minus_1):
     return 1./(8*M_i_minus_1**2) * np.sqrt((M_i_minus_1**2 - (M_i+m_i_minus_1)**2)*(M_i_minus_1**2 - (M_i-m_i_minus_1)**2))
 
 
+def boost_tangent(q, dq, ph, dph):
+    """ Boost ph by q as in boost, together with the derivatives.
+
+    :param dq: Derivatives of q, shape (N, 4, ndim).
+    :param dph: Derivatives of ph, shape (N, 4, ndim).
+    :return: Tuple of the boosted vectors and their derivatives.
+    """
+    p = boost(q, ph)
+    dp = np.empty(dph.shape)
+
+    rsq = np.sqrt(np.einsum('kd,dd,kd->k', q, MINKOWSKI, q))
+    drsq = np.einsum('ki,ij,kjd->kd', q, MINKOWSKI, dq) / rsq[:, np.newaxis]
+
+    dp[:, 0] = ((np.einsum('kid,ki->kd', dq, ph) +
+                 np.einsum('ki,kid->kd', q, dph)) -
+                p[:, 0, np.newaxis] * drsq) / rsq[:, np.newaxis]
+    c1 = (ph[:, 0] + p[:, 0]) / (rsq + q[:, 0])
+    dc1 = ((dph[:, 0] + dp[:, 0]) -
+           c1[:, np.newaxis] * (drsq + dq[:, 0])) / (rsq + q[:, 0])[:, np.newaxis]
+    dp[:, 1:] = (dph[:, 1:] + dc1[:, np.newaxis, :] * q[:, 1:, np.newaxis] +
+                 c1[:, np.newaxis, np.newaxis] * dq[:, 1:])
+
+    return p, dp
+
+
 def boost(q, ph):
     p = np.empty(q.shape)
 
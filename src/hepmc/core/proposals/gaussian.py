@@ -26,6 +26,10 @@ class Gaussian(Proposal):
         sample = np.random.multivariate_normal(state, self.cov)
         return sample
 
+    def proposals(self, states):
+        return states + np.random.multivariate_normal(
+            np.zeros(self.ndim), self.cov, len(states))
+
     def proposal_pdf(self, state, candidate):
         prob = multi_norm.pdf(candidate, state, self.cov)  # symmetric
         return prob
@@ -28,6 +28,11 @@ class UniformLocal(Proposal):
         base_capped = np.minimum(base, self.high - self.delta)
         return base_capped + np.random.rand() * self.delta
 
+    def proposals(self, states):
+        base = np.maximum(self.low, states - self.delta / 2)
+        base_capped = np.minimum(base, self.high - self.delta)
+        return base_capped + np.random.rand(len(states), 1) * self.delta
+
     def proposal_pdf(self, state, candidate):
         return 1 / np.prod(self.delta)  # symmetric
 
@@ -10,7 +10,8 @@ little or nothing is known.
 from typing import Optional, Callable
 import numpy as np
 from tqdm import tqdm
-from .util import interpret_array, effective_sample_size, bin_wise_chi2
+from .util import interpret_array, effective_sample_size, bin_wise_chi2, \
+    adaptive_batch_size
 from .sample_plotting import plot1d, plot2d
 from ..core.density import Density
 
@@ -31,7 +32,7 @@ class Sample(object):
     a weight member. If the weights haven't been filled by the sampler, a normalized 
     vector containing the same value in every entry will be returned.
     """
-    def __init__(self, data: any, target: Optional[Density] = None, pdf: Optional[any] = None, pot: Optional[any] = None, weights: Optional[any] = None) -> None:
+    def __init__(self, data: any, target: Optional[Density] = None, pdf: Optional[any] = None, pot: Optional[any] = None, weights: Optional[any] = None, accepted: Optional[any] = None) -> None:
         """
         Parameters
         ----------
@@ -47,6 +48,8 @@ class Sample(object):
             values of target potential (minus log pdf) evaluated at data points
         weights : ndarray, optional
             1D array containing the weights
+        accepted : ndarray, optional
+            1D boolean array, true where a Markov chain accepted a new state
         """
         # check that arrays are actually numpy arrays and have the right dimension
         try:
@@ -66,6 +69,7 @@ class Sample(object):
         self._pdf = pdf
         self._pot = pot
         self._weights = weights
+        self._accepted = accepted
 
         self._bin_wise_chi2 = None
         self._effective_sample_size = None
@@ -110,6 +114,10 @@ class Sample(object):
             self._weights = np.full(self.size, 1./self.size)
         return self._weights
 
+    @property
+    def accepted(self):
+        return self._accepted
+
     @property
     def size(self):
         return self.data.shape[0]
@@ -150,7 +158,10 @@ class Sample(object):
     @property
     def acceptance_rate(self):
         if self._acceptance_rate is None:
-            self._acceptance_rate = np.unique(self.data, axis=0).shape[0] / self.size
+            if self._accepted is not None:
+                self._acceptance_rate = np.count_nonzero(self._accepted) / self.size
+            else:
+                self._acceptance_rate = np.unique(self.data, axis=0).shape[0] / self.size
         return self._acceptance_rate
 
     def plot(self):
@@ -173,6 +184,33 @@ class Sample(object):
         with open(os.path.join(path, name + '.json'), 'w') as fp:
             json.dump(info, fp, indent=2)
 
+    @classmethod
+    def load(cls, file_path: str, target: Optional[Density] = None, mmap_mode: Optional[str] = 'r') -> 'Sample':
+        """Open a sample stored by save or by a SampleWriter.
+
+        The arrays are memory-mapped rather than read into memory. Only the
+        points recorded in the JSON header are used, so a sample that is
+        still being written (or whose run was interrupted) can be opened.
+
+        Parameters
+        ----------
+        file_path
+            Path without the '.json' and '-data.npy' suffixes.
+        target
+            The target density of the sample.
+        mmap_mode
+            Passed to np.load, use None to load the arrays into memory.
+        """
+        with open(file_path + '.json') as fp:
+            info = json.load(fp)
+        size = int(info['size'])
+
+        data = np.load(file_path + '-data.npy', mmap_mode=mmap_mode)[:size]
+        values = {field: np.load(file_path + '-' + field + '.npy',
+                                 mmap_mode=mmap_mode)[:size]
+                  for field in info.get('fields', [])}
+        return cls(data=data, target=target, **values)
+
     def _data_table(self):
         titles = [entry[1] for entry in self._sample_info]
         entries = []
@@ -202,6 +240,156 @@ class Sample(object):
         return (type(self).__name__ + '\n\t' + '\n\t'.join(
             '%s: %s' % (t, e) for t, e in zip(*self._data_table())))
 
+class SampleWriter(object):
+    """Stream a sample to disk in fixed-size chunks.
+
+    The points are written to a memory-mapped '<file_path>-data.npy' of
+    shape (capacity, ndim), the optional per-point fields (pdf, pot, weights
+    and accepted) to '<file_path>-<field>.npy'. Points are collected in a
+    buffer of chunk_size points; whenever it is full, it is copied to the
+    files, which are flushed, and the JSON header '<file_path>.json' is
+    updated with the number of points written so far.
+
+    The result can be opened with Sample.load at any time.
+    """
+
+    field_types = {'pdf': np.float64, 'pot': np.float64,
+                   'weights': np.float64, 'accepted': np.bool_}
+
+    def __init__(self, file_path: str, capacity: int, ndim: int, fields=(), target: Optional[Density] = None, chunk_size: int = 10000, size: Optional[int] = None, on_flush: Optional[Callable] = None) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            Path of the output without suffixes, as in Sample.save.
+        capacity
+            Maximal number of points.
+        ndim
+            Dimensionality of the points.
+        fields
+            Names of the additional per-point arrays to store, any of
+            'pdf', 'pot', 'weights' and 'accepted'.
+        target
+            The target density, only its repr is stored in the header.
+        chunk_size
+            Number of points written to disk at once.
+        size
+            If given, continue writing to existing files (created with
+            the same arguments) after their first size points.
+        on_flush
+            Called with the writer after each flush.
+        """
+        for field in fields:
+            if field not in self.field_types:
+                raise ValueError("Unknown sample field '%s'." % field)
+
+        self.file_path = file_path
+        self.capacity = capacity
+        self.ndim = ndim
+        self.fields = list(fields)
+        self.target = target
+        self.chunk_size = chunk_size
+        self.on_flush = on_flush
+        # number of points on disk
+        self.size = 0 if size is None else size
+
+        mode = 'w+' if size is None else 'r+'
+        self._arrays = {'data': np.lib.format.open_memmap(
+            file_path + '-data.npy', mode=mode, dtype=np.float64,
+            shape=(capacity, ndim))}
+        self._buffers = {'data': np.empty((chunk_size, ndim))}
+        for field in self.fields:
+            dtype = self.field_types[field]
+            self._arrays[field] = np.lib.format.open_memmap(
+                file_path + '-' + field + '.npy', mode=mode, dtype=dtype,
+                shape=(capacity,))
+            self._buffers[field] = np.empty(chunk_size, dtype=dtype)
+        self._buffered = 0
+
+        if self._arrays['data'].shape != (capacity, ndim):
+            raise RuntimeError("Existing sample file has a different shape.")
+
+        self._write_header(complete=False)
+
+    def append(self, data, **values) -> None:
+        """Append one point or an array of shape (n, ndim) of points.
+
+        The keyword arguments give the values of the fields for the points,
+        missing (or None) values are stored as NaN (False for accepted).
+        """
+        data = interpret_array(data, self.ndim)
+        count = data.shape[0]
+        if self.size + self._buffered + count > self.capacity:
+            raise RuntimeError("Sample file is full (capacity %d)." % self.capacity)
+
+        columns = {'data': data}
+        for field in self.fields:
+            value = values.get(field)
+            if value is None:
+                value = False if field == 'accepted' else np.nan
+            columns[field] = np.broadcast_to(np.ravel(value), (count,))
+
+        start = 0
+        while start < count:
+            n = min(count - start, self.chunk_size - self._buffered)
+            for name, column in columns.items():
+                self._buffers[name][self._buffered:self._buffered + n] = \
+                    column[start:start + n]
+            self._buffered += n
+            start += n
+            if self._buffered == self.chunk_size:
+                self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered points to disk and update the header."""
+        self._flush()
+        if self.on_flush is not None:
+            self.on_flush(self)
+
+    def _flush(self):
+        n = self._buffered
+        if n > 0:
+            for name, array in self._arrays.items():
+                array[self.size:self.size + n] = self._buffers[name][:n]
+                array.flush()
+            self.size += n
+            self._buffered = 0
+        self._write_header(complete=False)
+
+    def close(self) -> None:
+        """Flush the remaining points and mark the sample as complete."""
+        self.flush()
+        self._write_header(complete=True)
+        self._arrays = {}
+
+    def _write_header(self, complete):
+        info = {
+            'type': Sample.__name__,
+            'target': repr(self.target),
+            'size': self.size,
+            'capacity': self.capacity,
+            'ndim': self.ndim,
+            'fields': self.fields,
+            'complete': complete,
+        }
+        # replace the header atomically, it must never be half written
+        tmp_path = self.file_path + '.json.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(info, fp, indent=2)
+        os.replace(tmp_path, self.file_path + '.json')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # keep everything generated before the failure
+            self._flush()
+            self._arrays = {}
+
+
 class UniformSampler(object):
     """Uniform sampler.
     
@@ -232,7 +420,7 @@ class AcceptRejectSampler(object):
     """
 
     def __init__(self, target: Density, 
-            sampling_dist: Density, bound: float) -> None:
+            sampling_dist: Density, bound: float, max_batch_size: int = 1000000) -> None:
         """
         Parameters
         ----------
@@ -244,18 +432,32 @@ class AcceptRejectSampler(object):
         bound
             Constant such that target_pdf(x)/sampling_pdf(x) <= bound
             for all x in the range of sampling.
+        max_batch_size
+            Maximal number of proposals generated at once, limiting the
+            memory used by a batch.
         """
         self.target = target
         self.sampling_dist = sampling_dist
         self.bound = bound
         self.ndim = target.ndim
+        self.max_batch_size = max_batch_size
+
+        # proposals generated and accepted in all calls to sample
+        self.trials = 0
+        self.accepted = 0
+        # points accepted in excess, used first in the next call to sample
+        self._surplus_x = np.empty((0, self.ndim))
+        self._surplus_weights = np.empty(0)
 
-    def sample(self, sample_size: int, batch_size: Optional[int] = 10000) -> Sample:
+    def sample(self, sample_size: int, batch_size: Optional[int] = None) -> Sample:
         """
         Generate a partially unweighted sample of the target distribution.
 
-        The parameter batch_size can be used to benefit from numpy and 
-        parallel sampling.
+        The proposals are generated in batches to benefit from numpy and 
+        parallel sampling. By default, the size of each batch is chosen
+        from the acceptance rate observed so far, such that it is expected
+        to yield the remaining number of points. Points accepted in excess
+        are kept and used in the next call.
 
         The average unweighting efficiency is printed at the end.
 
@@ -264,7 +466,8 @@ class AcceptRejectSampler(object):
         sample_size
             The size of the sample to be generated.
         batch_size
-            Number of proposals to be generated at once.
+            Fixed number of proposals to be generated at once (instead of
+            choosing it adaptively).
 
         Returns
         -------
@@ -274,31 +477,37 @@ class AcceptRejectSampler(object):
         x = np.empty((sample_size, self.ndim))
         weights = np.empty(sample_size)
 
-        n_todo = sample_size
-        trials = 0
-        with tqdm(total=sample_size) as pbar:
-            while n_todo > 0:
-                proposals = self.sampling_dist.rvs(batch_size)
+        # points left over from the previous call
+        n_done = min(sample_size, self._surplus_weights.size)
+        x[:n_done] = self._surplus_x[:n_done]
+        weights[:n_done] = self._surplus_weights[:n_done]
+        self._surplus_x = self._surplus_x[n_done:]
+        self._surplus_weights = self._surplus_weights[n_done:]
+
+        with tqdm(total=sample_size, initial=n_done) as pbar:
+            while n_done < sample_size:
+                n_todo = sample_size - n_done
+                size = batch_size or adaptive_batch_size(
+                    n_todo, self.accepted, self.trials, self.max_batch_size)
+                proposals = self.sampling_dist.rvs(size)
                 aprob = self.target.pdf(proposals) / self.sampling_dist.pdf(proposals) / self.bound
-                u = np.random.rand(batch_size)
+                u = np.random.rand(size)
                 accept = np.where(u < aprob)[0]
-                n_accept = accept.size
-                if n_accept <= n_todo:
-                    x[sample_size-n_todo:sample_size-n_todo+n_accept] = proposals[accept]
-                    weights[sample_size-n_todo:sample_size-n_todo+n_accept] = aprob[accept]
-                    trials += batch_size
-                else:
-                    n_accept = n_todo
-                    accept = accept[:n_todo]
-                    x[sample_size-n_todo:] = proposals[accept]
-                    weights[sample_size-n_todo:] = aprob[accept]
-                    last_index = accept[-1]
-                    trials += last_index+1
-                n_todo -= n_accept
+                self.trials += size
+                self.accepted += accept.size
+
+                n_accept = min(accept.size, n_todo)
+                x[n_done:n_done+n_accept] = proposals[accept[:n_accept]]
+                weights[n_done:n_done+n_accept] = aprob[accept[:n_accept]]
+                if n_accept < accept.size:
+                    self._surplus_x = proposals[accept[n_accept:]]
+                    self._surplus_weights = aprob[accept[n_accept:]]
+                n_done += n_accept
                 pbar.update(n_accept)
             
         weights[weights < 1.] = 1.
         weights /= weights.sum()
 
-        print('Unweighting eff.:', sample_size/trials)
+        if self.trials > 0:
+            print('Unweighting eff.:', self.accepted/self.trials)
         return Sample(data=x, target=self.target, weights=weights)
@@ -72,6 +72,30 @@ def damped_update(old, new, damping_onset, inertia):
             old * (inertia + 1) / (inertia + 1 + damping_onset))   # new
 
 
+def adaptive_batch_size(todo, accepted, trials, max_size=None):
+    """ Number of proposals expected to yield todo accepted points.
+
+    The acceptance probability is estimated by accepted / trials from the
+    proposals generated so far. Without any trials, an efficiency of one
+    is assumed (which gives the smallest batch that can suffice). If no
+    proposal has been accepted yet, one accepted proposal is assumed, so
+    that the batch size grows with each unsuccessful batch.
+
+    :param todo: Number of accepted points still needed.
+    :param accepted: Number of proposals accepted so far.
+    :param trials: Number of proposals generated so far.
+    :param max_size: Upper bound for the batch size (to limit memory use).
+    :return: The batch size, at least one.
+    """
+    if trials > 0:
+        size = int(np.ceil(todo * trials / max(accepted, 1)))
+    else:
+        size = todo
+    if max_size is not None:
+        size = min(size, max_size)
+    return max(size, 1)
+
+
 def hypercube_bounded(index, null_value=0, shape=lambda xs: xs.shape[0],
                       self_has_ndim=False):
     """ Use as decorator if a function only returns none-null results [0,1]^dim.
@@ -127,3 +151,22 @@ def is_power_of_ten(x):
     while (x > 9 and x % 10 == 0):
         x /= 10;
     return x == 1
+
+
+def replace_gradient(density, pot_gradient):
+    """ Replace the potential gradient of a density instance.
+
+    The potential itself is kept. Since densities may implement a fused
+    pot_and_gradient that would not see the new gradient, it is replaced
+    as well.
+
+    :param density: Density whose gradient is replaced.
+    :param pot_gradient: Function mapping points of shape (N, ndim) to
+        gradients of the same shape, e.g. an extreme learning surrogate.
+    """
+    density.pot_gradient = pot_gradient
+
+    def pot_and_gradient(xs):
+        # looked up on each call, so wrappers such as Counted apply
+        return density.pot(xs), density.pot_gradient(xs)
+    density.pot_and_gradient = pot_and_gradient
@@ -9,13 +9,15 @@ import numpy as np
 from ..core.densities import Gaussian
 from ..core.proposals import UniformLocal
 from ..core.markov import MixingMarkovUpdate, DefaultMetropolis
+from ..core.markov.metropolis import MetropolisState
 from ..core.integration import MultiChannelMC
 from ..hamiltonian import HamiltonianUpdate
 
 
 # Multi Channel Markov Chain Monte Carlo (combine integral and sampling)
 class BasicMC3(object):
-    def __init__(self, target, channels, sample_local, beta=.5):
+    def __init__(self, target, channels, sample_local, beta=.5,
+                 buffer_size=1000):
         """ Base implementation of Multi-channel Markov chain Monte Carlo.
 
         :param target: Function to integrate and sample according to.
@@ -24,18 +26,21 @@ class BasicMC3(object):
         :param beta: Parameter used to decide between update mechanisms.
             The importance sampling Metropolis update is chosen with probability
             beta. Value must be between 0 and 1.
+        :param buffer_size: Number of importance sampling candidates
+            (and their target potentials) generated at once.
         """
         self.ndim = channels.ndim
         self.target = target
         self.channels = channels
         self.mc_importance = MultiChannelMC(channels)
 
-        self.sample_is = DefaultMetropolis(self.ndim, target, channels)
+        self.sample_is = DefaultMetropolis(target, channels,
+                                           buffer_size=buffer_size)
 
         self.sample_local = sample_local
 
         updates = [self.sample_is, self.sample_local]
-        self.mixing_sampler = MixingMarkovUpdate(self.ndim, updates)
+        self.mixing_sampler = MixingMarkovUpdate(updates)
         self.beta = beta
 
         self.integration_sample = None
@@ -43,14 +48,52 @@ class BasicMC3(object):
     def integrate(self, *eval_sizes):
         """ Execute multi channel integration and optimization.
 
+        The points of the last phase are sampled with the final channel
+        weights, they are used as first candidates of the importance
+        sampling update (reusing the target values).
+
         :param eval_sizes: Tuple of three lists of integers, giving the
             sample sizes of each iteration of the three phases of multi channel
             importance sampling (see MonteCarloMultiImportance).
         :return: The integral and error approximates.
         """
         self.integration_sample = self.mc_importance(self.target, *eval_sizes)
+        # buffered candidates were drawn with the old channel weights
+        self.sample_is.clear_buffer()
+
+        final_count = int(np.sum(eval_sizes[2]))
+        if final_count > 0 and self.sample_is.buffer_size > 0:
+            sample = self.integration_sample
+            final = slice(sample.size - final_count, sample.size)
+            # the points are ordered by channel, extend_buffer shuffles them
+            with np.errstate(divide='ignore'):
+                self.sample_is.extend_buffer(
+                    sample.data[final],
+                    -np.log(sample.function_values[final]),
+                    -np.log(sample.weights[final]))
         return self.integration_sample
 
+    def initial_state(self):
+        """ Find an initial state with non-zero target.
+
+        Resample the points of the integration (if any), with probability
+        proportional to their importance weight, which reuses their target
+        value. Otherwise try up to 1000 importance sampling candidates.
+        """
+        sample = self.integration_sample
+        if sample is not None and np.any(sample.function_values > 0):
+            weights = sample.function_values / sample.weights
+            index = np.random.choice(sample.size, p=weights / np.sum(weights))
+            return MetropolisState(sample.data[index],
+                                   -np.log(sample.function_values[index]))
+
+        for it in range(1000):
+            candidate = self.sample_is.proposal(None)
+            if np.isfinite(candidate.pot):
+                return candidate
+        raise RuntimeError("Could not find a suitable initial value "
+                           "using the multi channel distribution.")
+
     def sample(self, sample_size, initial=None, **kwargs):
         """ Generate a sample according to the function self.target using MC3.
 
@@ -60,16 +103,8 @@ class BasicMC3(object):
         :param initial: Initial value in Markov chain.
         :return: Numpy array of shape (sample_size, self.ndim).
         """
-        # try to find an initial value
         if initial is None:
-            it = 0
-            while it < 1000:
-                initial = self.sample_is.proposal(None)
-                if self.target.pdf(initial) != 0:
-                    break
-            if self.target.pdf(initial) == 0:
-                raise RuntimeError("Could not find a suitable initial value "
-                                   "using the multi channel distribution.")
+            initial = self.initial_state()
 
         return self.mixing_sampler.sample(sample_size, initial, **kwargs)
 
@@ -101,8 +136,7 @@ class MC3Uniform(BasicMC3):
 
     def __init__(self, fn, channels, delta, beta=.5):
         ndim = channels.ndim
-        sample_local = DefaultMetropolis(
-            ndim, fn, UniformLocal(ndim, delta))
+        sample_local = DefaultMetropolis(fn, UniformLocal(ndim, delta))
         super().__init__(fn, channels, sample_local, beta)
 
     @property
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import numpy as np
+from ..core.densities.gaussian import Gaussian
+from ..core.integration.importance import MultiChannelMC
+from ..core.integration.multi_channel import MultiChannel
+from ..core.integration.stratified import StratifiedMC
+from ..core.integration.stratified_volume import GridVolumes
+from ..core.integration.vegas import VegasMC
+
+from unittest import TestCase
+
+
+def peak(x, y):
+    return np.exp(-((x - .3) ** 2 + (y - .6) ** 2) / .02)
+
+
+class IntegratorStateTest(TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'state.npz')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _check_warm_start(self, trained, loaded, integrate):
+        """ Both integrators give the same result for the same seed. """
+        np.random.seed(1)
+        expected = integrate(trained)
+        np.random.seed(1)
+        result = integrate(loaded)
+        self.assertEqual(result.integral, expected.integral)
+        self.assertEqual(result.integral_err, expected.integral_err)
+        self.assertTrue(np.array_equal(result.data, expected.data))
+
+    def _check_vegas(self, **kwargs):
+        vegas = VegasMC(2, divisions=20, **kwargs)
+        vegas(peak, 2000, 5)
+        # the grid was adapted
+        self.assertFalse(np.allclose(vegas.state['bounds'][0],
+                                     np.linspace(0, 1, 21)))
+        vegas.save_state(self.path)
+
+        loaded = VegasMC(2, divisions=20, **kwargs)
+        loaded.load_state(self.path)
+        for bounds, loaded_bounds in zip(vegas.state['bounds'],
+                                         loaded.state['bounds']):
+            self.assertTrue(np.array_equal(bounds, loaded_bounds))
+        self._check_warm_start(
+            vegas, loaded, lambda mc: mc(peak, 1000, 2, apriori=False))
+
+    def test_vegas(self):
+        self._check_vegas()
+
+    def test_vegas_plus(self):
+        self._check_vegas(beta=.75, strata=4)
+
+    def test_vegas_mismatch(self):
+        VegasMC(2, divisions=20).save_state(self.path)
+        with self.assertRaises(RuntimeError):
+            VegasMC(2, divisions=10).load_state(self.path)
+        with self.assertRaises(RuntimeError):
+            VegasMC(3, divisions=20).load_state(self.path)
+
+    def test_stratified(self):
+        volumes = GridVolumes(bounds=[[0, .2, 1], [0, .5, .7, 1]],
+                              base_counts={(0, 1): 30}, default_base_count=5)
+        stratified = StratifiedMC(volumes)
+        stratified.save_state(self.path)
+
+        loaded = StratifiedMC(GridVolumes(ndim=2))
+        loaded.load_state(self.path)
+        self.assertEqual(loaded.volumes.base_counts, {(0, 1): 30})
+        self.assertEqual(loaded.volumes.total_base_count,
+                         volumes.total_base_count)
+        self._check_warm_start(stratified, loaded, lambda mc: mc(peak, 10))
+
+    def _channels(self):
+        return MultiChannel([Gaussian(2, mu=[.3, .6], scale=.1),
+                             Gaussian(2, mu=[.7, .2], scale=.1),
+                             Gaussian(2, mu=.5, scale=.5)])
+
+    def test_multi_channel(self):
+        multi_channel = MultiChannelMC(self._channels())
+        multi_channel(peak, [1000] * 5, [], [])
+        # the weights were adapted
+        self.assertFalse(np.allclose(
+            multi_channel.channels.channels_weight, 1. / 3))
+        multi_channel.save_state(self.path)
+
+        loaded = MultiChannelMC(self._channels())
+        loaded.load_state(self.path)
+        self.assertTrue(np.array_equal(
+            loaded.channels.channels_weight,
+            multi_channel.channels.channels_weight))
+        self._check_warm_start(
+            multi_channel, loaded,
+            lambda mc: mc(peak, [], [], [1000], apriori=False))
+
+        # channel count and integrator type must match
+        with self.assertRaises(RuntimeError):
+            MultiChannelMC(MultiChannel(
+                [Gaussian(2), Gaussian(2)])).load_state(self.path)
+        with self.assertRaises(RuntimeError):
+            VegasMC(2).load_state(self.path)
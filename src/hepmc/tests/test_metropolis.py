@@ -0,0 +1,210 @@
+import numpy as np
+from ..core.densities.gaussian import Gaussian
+from ..core.integration.multi_channel import MultiChannel
+from ..core.markov.base import StateCache, MarkovUpdate, \
+    MixingMarkovUpdate, CompositeMarkovUpdate
+from ..core.markov.metropolis import DefaultMetropolis, MetropolisState
+from ..core.markov.metropolis_delayed import DelayedAcceptanceMetropolis
+from ..core.util import count_calls
+
+from unittest import TestCase
+
+
+class DelayedAcceptanceTest(TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.target = Gaussian(2, mu=.5, scale=.1)
+        # surrogate with wrong location and width
+        surrogate = Gaussian(2, mu=.55, scale=.13)
+        self.surrogate_pot = surrogate.pot
+
+    def test_moments(self):
+        met = DelayedAcceptanceMetropolis(
+            self.target, self.surrogate_pot, cov=.01)
+        sample = met.sample(20000, [.5, .5], burnin=500)
+        self.assertTrue(np.allclose(np.mean(sample.data, axis=0), .5,
+                                    atol=.02))
+        self.assertTrue(np.allclose(np.std(sample.data, axis=0), .1,
+                                    atol=.015))
+
+    def test_moments_chains(self):
+        met = DelayedAcceptanceMetropolis(
+            self.target, self.surrogate_pot, cov=.01)
+        samples = met.sample_chains(500, np.full((40, 2), .5), burnin=100)
+        data = np.concatenate([sample.data for sample in samples])
+        self.assertTrue(np.allclose(np.mean(data, axis=0), .5, atol=.02))
+        self.assertTrue(np.allclose(np.std(data, axis=0), .1, atol=.015))
+
+    def test_screening_rate(self):
+        count_calls(self.target, 'pot')
+        met = DelayedAcceptanceMetropolis(
+            self.target, self.surrogate_pot, cov=.01)
+        self.assertEqual(met.screening_rate, 0)
+        met.sample(2000, [.5, .5])
+
+        self.assertEqual(met.generated, 2000)
+        self.assertGreater(met.screening_rate, 0)
+        self.assertLess(met.screening_rate, 1)
+        # the target is only evaluated for the initial and screened states
+        self.assertEqual(self.target.pot.count, met.screened + 1)
+
+    def test_exact_surrogate(self):
+        # nothing is rejected in the second stage
+        met = DelayedAcceptanceMetropolis(self.target, self.target.pot,
+                                          cov=.01)
+        sample = met.sample(1000, [.5, .5])
+        self.assertEqual(np.count_nonzero(sample.accepted), met.screened)
+
+
+class StateCacheTest(TestCase):
+
+    def test_lru(self):
+        target = Gaussian(1)
+        cache = StateCache(2)
+        cache.update([0.], target, pot=0.)
+        cache.update([1.], target, pot=1.)
+        # a lookup makes the state the most recent one
+        self.assertEqual(cache.get([0.], target), {'pot': 0.})
+        cache.update([2.], target, pot=2.)
+
+        self.assertEqual(cache.get([1.], target), {})
+        self.assertEqual(cache.get([0.], target), {'pot': 0.})
+        self.assertEqual(cache.get([2.], target), {'pot': 2.})
+        # values are separate for each target
+        self.assertEqual(cache.get([2.], Gaussian(1)), {})
+
+    def test_collected_target(self):
+        cache = StateCache()
+        cache.update([0.], Gaussian(1), pot=0.)
+        # new targets may be allocated where the first one was
+        for _ in range(10):
+            self.assertEqual(cache.get([0.], Gaussian(1)), {})
+
+    def test_restore(self):
+        target = Gaussian(1)
+        cache = StateCache()
+        cache.update([1.], target, pot=3., pot_gradient=None)
+        self.assertEqual(cache.get([1.], target), {'pot': 3.})
+
+        state = cache.restore(MetropolisState([1.]), target)
+        self.assertEqual(state.pot, 3.)
+        # set values are not replaced
+        state = cache.restore(MetropolisState([1.], pot=5.), target)
+        self.assertEqual(state.pot, 5.)
+
+    def _run_mixing(self, cache_size):
+        np.random.seed(42)
+        target = Gaussian(2, mu=.5, scale=.1)
+        count_calls(target, 'pot')
+        # the maps drop the potential stored on the states
+        updates = [DefaultMetropolis(target, cov=.01) for _ in range(2)]
+        mixing = MixingMarkovUpdate(
+            updates, in_maps={0: np.array, 1: np.array},
+            cache_size=cache_size)
+        sample = mixing.sample(500, [.5, .5])
+        return sample, target.pot.count
+
+    def test_evaluation_count(self):
+        sample, count = self._run_mixing(16)
+        sample_uncached, count_uncached = self._run_mixing(0)
+
+        # one evaluation per candidate and one for the initial state
+        self.assertEqual(count, 500 + 1)
+        self.assertGreater(count_uncached, count)
+        self.assertTrue(np.array_equal(sample.data, sample_uncached.data))
+
+
+class BufferedMetropolisTest(TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        # two well separated channels, rvs returns the points ordered
+        self.proposal = MultiChannel(
+            [Gaussian(1, mu=.2, scale=.05), Gaussian(1, mu=.8, scale=.05)])
+
+    def test_not_state_independent(self):
+        with self.assertRaises(ValueError):
+            DefaultMetropolis(Gaussian(1), buffer_size=100)
+
+    def test_candidate_order(self):
+        # independence sampler for its own proposal, all are accepted
+        met = DefaultMetropolis(self.proposal, self.proposal,
+                                buffer_size=1000)
+        sample = met.sample(2000, [.2])
+        self.assertTrue(np.all(sample.accepted))
+
+        # consecutive blocks are not taken from a single channel
+        upper = sample.data[:, 0] > .5
+        for block in upper.reshape(20, 100):
+            self.assertGreater(np.mean(block), .25)
+            self.assertLess(np.mean(block), .75)
+        self.assertLess(abs(np.corrcoef(upper[:-1], upper[1:])[0, 1]), .1)
+
+    def test_moments(self):
+        target = Gaussian(1, mu=.75, scale=.1)
+        buffered = DefaultMetropolis(target, self.proposal, buffer_size=500)
+        sample_buffered = buffered.sample(10000, [.8])
+        unbuffered = DefaultMetropolis(target, self.proposal)
+        sample_unbuffered = unbuffered.sample(10000, [.8])
+
+        for sample in sample_buffered, sample_unbuffered:
+            self.assertAlmostEqual(np.mean(sample.data), .75, delta=.01)
+            self.assertAlmostEqual(np.std(sample.data), .1, delta=.01)
+
+    def test_extend_buffer(self):
+        met = DefaultMetropolis(self.proposal, self.proposal,
+                                buffer_size=100)
+        xs = np.linspace(.1, .9, 50).reshape(50, 1)
+        met.extend_buffer(xs, self.proposal.pot(xs),
+                          self.proposal.proposal_mlogpdf(None, xs))
+
+        candidates = met.proposals(np.zeros((50, 1)))
+        # the given points are used first, but not in the given order
+        self.assertTrue(np.array_equal(np.sort(candidates, axis=0), xs))
+        self.assertFalse(np.array_equal(candidates, xs))
+        self.assertTrue(np.allclose(candidates.pot,
+                                    self.proposal.pot(candidates)))
+        # then new ones are generated
+        self.assertEqual(met.proposals(np.zeros((10, 1))).shape, (10, 1))
+
+        with self.assertRaises(ValueError):
+            DefaultMetropolis(self.proposal, self.proposal).extend_buffer(
+                xs, self.proposal.pot(xs), self.proposal.pot(xs))
+
+
+class ShiftUpdate(MarkovUpdate):
+    """ Moves the state by shift, without reporting acceptance. """
+
+    def __init__(self, target, shift):
+        super().__init__(target)
+        self.shift = shift
+
+    def next_state(self, state, iteration):
+        return (np.asarray(state) + self.shift) % 1
+
+
+class CompositeUpdateTest(TestCase):
+
+    def test_unknown_acceptance(self):
+        target = Gaussian(1)
+        composite = CompositeMarkovUpdate(
+            1, [ShiftUpdate(target, .1), ShiftUpdate(target, 0.)])
+        sample = composite.sample(100, [.5])
+        self.assertIsNone(composite.last_accepted)
+        # the states are compared instead
+        self.assertTrue(np.all(sample.accepted))
+
+        composite = CompositeMarkovUpdate(
+            1, [ShiftUpdate(target, 0.), ShiftUpdate(target, 0.)])
+        self.assertFalse(np.any(composite.sample(100, [.5]).accepted))
+
+    def test_reported_acceptance(self):
+        np.random.seed(42)
+        target = Gaussian(1, mu=.5, scale=.1)
+        updates = [DefaultMetropolis(target, cov=.01) for _ in range(2)]
+        composite = CompositeMarkovUpdate(1, updates)
+        sample = composite.sample(1000, [.5])
+        self.assertIsInstance(composite.last_accepted, bool)
+        self.assertGreater(np.mean(sample.accepted), .5)
+        self.assertLess(np.mean(sample.accepted), 1)
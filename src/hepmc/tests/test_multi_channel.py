@@ -0,0 +1,70 @@
+import numpy as np
+from ..core.densities.gaussian import Gaussian
+from ..core.integration.multi_channel import MultiChannel, _GaussianStack
+
+from unittest import TestCase
+
+
+class OtherGaussian(Gaussian):
+    """ Not stacked, MultiChannel evaluates it on its own. """
+    pass
+
+
+class MultiChannelTest(TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.channels = [
+            Gaussian(2, mu=[.2, .3], scale=.05),
+            Gaussian(2, mu=[.7, .6], cov=[[.02, .01], [.01, .03]]),
+            OtherGaussian(2, mu=[.5, .9], scale=.1)]
+        self.weights = np.array([.5, .3, .2])
+        self.multi_channel = MultiChannel(self.channels, self.weights)
+
+    def test_pdf(self):
+        xs = np.random.rand(100, 2)
+        expected = sum(weight * channel.pdf(xs) for weight, channel
+                       in zip(self.weights, self.channels))
+        self.assertTrue(np.allclose(self.multi_channel.pdf(xs), expected))
+        self.assertTrue(np.allclose(self.multi_channel.pot(xs),
+                                    -np.log(expected)))
+
+    def test_pot_gradient(self):
+        xs = np.random.rand(100, 2)
+        eps = 1e-6
+        expected = np.stack(
+            [(self.multi_channel.pot(xs + step) -
+              self.multi_channel.pot(xs - step)) / (2 * eps)
+             for step in np.eye(2) * eps], axis=1)
+        self.assertTrue(np.allclose(self.multi_channel.pot_gradient(xs),
+                                    expected, rtol=1e-5, atol=1e-5))
+
+    def test_tail(self):
+        # all channel pdfs underflow, the nearest channel dominates
+        multi_channel = MultiChannel([Gaussian(1, mu=.2, scale=.01),
+                                      OtherGaussian(1, mu=.8, scale=.01)])
+        xs = np.array([[-4.], [5.]])
+        self.assertTrue(np.all(multi_channel.pdf(xs) == 0))
+        self.assertTrue(np.all(np.isfinite(multi_channel.pot(xs))))
+        gradient = multi_channel.pot_gradient(xs)
+        self.assertTrue(np.allclose(gradient, [[-4.2e4], [4.2e4]]))
+
+    def test_stack_narrow_channel(self):
+        # narrow channels far from each other
+        channels = [Gaussian(2, mu=[.05, .1], scale=1e-6),
+                    Gaussian(2, mu=[.95, .9], scale=.3),
+                    Gaussian(2, mu=[.9, .05],
+                             cov=np.array([[4., 1.], [1., 1.]]) * 1e-12)]
+        stack = _GaussianStack(channels)
+        xs = np.concatenate([
+            channels[0].mean + np.random.randn(50, 2) * 1e-6,
+            channels[2].mean + np.random.randn(50, 2) * 1e-6])
+
+        expected = np.array([channel.pot(xs) for channel in channels])
+        self.assertTrue(np.allclose(stack.pot(xs), expected, rtol=1e-10,
+                                    atol=0))
+        weights = np.random.rand(3, 100)
+        expected = sum(weight[:, np.newaxis] * channel.pot_gradient(xs)
+                       for weight, channel in zip(weights, channels))
+        self.assertTrue(np.allclose(stack.weighted_pot_gradient(xs, weights),
+                                    expected, rtol=1e-10, atol=0))
@@ -0,0 +1,40 @@
+import numpy as np
+from ..core.densities.gaussian import Gaussian
+from ..core.markov.base import MarkovUpdate
+from ..core.markov.metropolis import DefaultMetropolis
+from ..core.markov.parallel import ParallelChains
+
+from unittest import TestCase
+
+
+class CountingUpdate(MarkovUpdate):
+    """ Moves the state by a step growing with each call. """
+
+    def __init__(self, target):
+        super().__init__(target)
+        self.steps = 0
+
+    def next_state(self, state, iteration):
+        self.steps += 1
+        return (np.asarray(state) + .01 * self.steps) % 1
+
+
+class ParallelChainsTest(TestCase):
+
+    def test_independent_chains(self):
+        # a single worker runs all chains, each from a fresh update
+        parallel = ParallelChains(CountingUpdate(Gaussian(1)), processes=1)
+        sample = parallel.sample(50, np.full((4, 1), .5), burnin=10)
+        for index in range(1, 4):
+            self.assertTrue(np.array_equal(sample.chain(index).data,
+                                           sample.chain(0).data))
+
+    def test_seed(self):
+        update = DefaultMetropolis(Gaussian(2, mu=.5, scale=.1), cov=.01)
+        init_states = np.full((6, 2), .5)
+        samples = [ParallelChains(update, processes, seed=42).sample(
+            200, init_states, burnin=20) for processes in (1, 3)]
+        self.assertEqual(samples[0].chain_count, 6)
+        self.assertTrue(np.array_equal(samples[0].data, samples[1].data))
+        self.assertTrue(np.array_equal(samples[0].accepted,
+                                       samples[1].accepted))
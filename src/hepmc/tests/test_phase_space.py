@@ -0,0 +1,156 @@
+import numpy as np
+from scipy.optimize import brentq
+from ..core.densities.gaussian import Gaussian
+from ..core.densities.sarge import Sarge
+from ..core.phase_space.mapping import MappedDensity
+from ..core.phase_space.rambo import Rambo, RamboOnDiet, solve_mass_ratio
+from ..core.util import count_calls
+
+from unittest import TestCase
+
+MINKOWSKI = np.diag([1, -1, -1, -1])
+
+
+def finite_difference_jacobian(fn, xs, eps=1e-6):
+    """ Central differences, shape (N, ndim_out, ndim). """
+    columns = []
+    for d in range(xs.shape[1]):
+        step = np.zeros(xs.shape[1])
+        step[d] = eps
+        columns.append((fn(xs + step) - fn(xs - step)) / (2 * eps))
+    return np.stack(columns, axis=-1)
+
+
+class SolveMassRatioTest(TestCase):
+
+    def test_brentq(self):
+        np.random.seed(42)
+        r = np.concatenate(([0., 1e-12, .5, 1 - 1e-12, 1.],
+                            np.random.rand(200)))
+        for k in range(1, 6):
+            expected = [brentq(lambda u: (k + 1) * u ** (2 * k) -
+                               k * u ** (2 * (k + 1)) - r_i,
+                               0, 1, xtol=1e-15) for r_i in r]
+            self.assertTrue(np.allclose(solve_mass_ratio(r, k), expected,
+                                        rtol=0, atol=1e-10))
+
+    def test_shape(self):
+        r = np.random.rand(3, 4)
+        self.assertEqual(solve_mass_ratio(r, 2).shape, (3, 4))
+        self.assertEqual(solve_mass_ratio(np.empty(0), 2).shape, (0,))
+
+
+class MappingTest(object):
+    """ Checks of the map, its Jacobian and its inverse. """
+
+    def test_jacobian(self):
+        ps, jacobian = self.mapping.map_and_jacobian(self.xs)
+        self.assertTrue(np.allclose(ps, self.mapping.map(self.xs)))
+        expected = finite_difference_jacobian(self.mapping.map, self.xs)
+        self.assertTrue(np.allclose(jacobian, expected, rtol=1e-5,
+                                    atol=1e-5 * self.e_cm))
+
+    def test_inverse(self):
+        ps = self.mapping.map(self.xs)
+        xs = self.mapping.map_inverse(ps)
+        self.assertTrue(np.all((0 < xs) & (xs < 1)))
+        self.assertTrue(np.allclose(self.mapping.map(xs), ps,
+                                    atol=1e-8 * self.e_cm))
+
+    def test_momenta(self):
+        ps = self.mapping.map(self.xs).reshape(-1, self.nparticles, 4)
+        total = ps.sum(axis=1)
+        self.assertTrue(np.allclose(total, [self.e_cm, 0, 0, 0],
+                                    atol=1e-8 * self.e_cm))
+        masses = np.einsum('kpi,ij,kpj->kp', ps, MINKOWSKI, ps)
+        self.assertTrue(np.allclose(masses, 0, atol=1e-8 * self.e_cm ** 2))
+
+    def test_mapped_gradient(self):
+        # smooth density of the momenta
+        density = Gaussian(self.nparticles * 4, scale=self.e_cm)
+        mapped = MappedDensity(density, self.mapping)
+        expected = np.squeeze(finite_difference_jacobian(
+            lambda xs: mapped.pot(xs)[:, np.newaxis], self.xs), axis=1)
+        self.assertTrue(np.allclose(mapped.pot_gradient(self.xs), expected,
+                                    rtol=1e-5, atol=1e-5))
+        pot, gradient = mapped.pot_and_gradient(self.xs)
+        self.assertTrue(np.allclose(pot, mapped.pot(self.xs)))
+        self.assertTrue(np.allclose(gradient, expected, rtol=1e-5, atol=1e-5))
+
+    def test_mapped_gradient_maps_once(self):
+        density = Gaussian(self.nparticles * 4, scale=self.e_cm)
+        mapped = MappedDensity(density, self.mapping)
+        count_calls(self.mapping, 'map', 'map_and_jacobian')
+        mapped.pot_gradient(self.xs)
+        mapped.pot_and_gradient(self.xs)
+        self.assertEqual(self.mapping.map.count, 0)
+        # counted per point
+        self.assertEqual(self.mapping.map_and_jacobian.count,
+                         2 * self.xs.shape[0])
+
+    def test_cut_statistics(self):
+        density = Gaussian(self.nparticles * 4, scale=self.e_cm)
+        # energy of the first particle
+        mapped = MappedDensity(density, self.mapping,
+                               cut=lambda ps: ps[:, 0] > self.e_cm / 3)
+        pot = mapped.pot(self.xs)
+        passed = np.isfinite(pot)
+        self.assertEqual(mapped.cut_trials, self.xs.shape[0])
+        self.assertEqual(mapped.cut_passed, np.count_nonzero(passed))
+
+        # the gradient methods are not counted
+        pot_grad, gradient = mapped.pot_and_gradient(self.xs)
+        self.assertTrue(np.array_equal(pot_grad, pot))
+        self.assertTrue(np.all(np.isinf(gradient[~passed])))
+        mapped.pot_gradient(self.xs)
+        self.assertEqual(mapped.cut_trials, self.xs.shape[0])
+
+
+class RamboTest(TestCase, MappingTest):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.e_cm = 100.
+        self.nparticles = 3
+        self.mapping = Rambo(self.e_cm, self.nparticles)
+        self.xs = np.random.uniform(.05, .95, (20, self.mapping.ndim))
+
+
+class RamboOnDietTest(TestCase, MappingTest):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.e_cm = 100.
+        self.nparticles = 4
+        self.mapping = RamboOnDiet(self.e_cm, self.nparticles)
+        self.xs = np.random.uniform(.05, .95, (20, self.mapping.ndim))
+
+    def test_bijective(self):
+        xs = self.mapping.map_inverse(self.mapping.map(self.xs))
+        self.assertTrue(np.allclose(xs, self.xs))
+
+
+class SargeTest(TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.e_cm = 100.
+        self.nout = 4
+        self.sarge = Sarge(2, self.nout, self.e_cm)
+
+    def test_momenta(self):
+        ps = self.sarge.rvs(1000)
+        self.assertEqual(ps.shape, (1000, self.nout * 4))
+
+        ps = ps.reshape(-1, self.nout, 4)
+        total = ps.sum(axis=1)
+        self.assertTrue(np.allclose(total, [self.e_cm, 0, 0, 0],
+                                    atol=1e-8 * self.e_cm))
+        masses = np.einsum('kpi,ij,kpj->kp', ps, MINKOWSKI, ps)
+        self.assertTrue(np.allclose(masses, 0, atol=1e-8 * self.e_cm ** 2))
+        self.assertTrue(np.all(ps[:, :, 0] > 0))
+
+    def test_pdf(self):
+        pdf = self.sarge.pdf(self.sarge.rvs(100))
+        self.assertEqual(pdf.shape, (100,))
+        self.assertTrue(np.all(np.isfinite(pdf) & (pdf > 0)))
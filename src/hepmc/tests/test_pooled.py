@@ -0,0 +1,82 @@
+import os
+import numpy as np
+from ..core.densities.gaussian import Gaussian
+from ..core.densities.pooled import PooledDensity
+
+from unittest import TestCase
+
+# state of a worker process, set by StandInDensity.init_worker
+_worker = dict()
+
+
+class ProcessBound(object):
+    """ Stand-in for a worker pool, only usable in its own process. """
+
+    def __init__(self):
+        self.pid = os.getpid()
+
+    def __call__(self, fn, xs):
+        if os.getpid() != self.pid:
+            raise RuntimeError("Used in a different process.")
+        return fn(xs)
+
+
+class StandInDensity(Gaussian):
+    """ Density that drops its pool when pickled, like ee_qq_ng.
+
+    Pickled copies initialize the worker state and evaluate in the
+    calling process.
+    """
+
+    def __init__(self, ndim):
+        super().__init__(ndim, mu=.5, scale=.2)
+        self.pool = ProcessBound()
+
+    def __getstate__(self):
+        self_dict = self.__dict__.copy()
+        self_dict['pool'] = None
+        return self_dict
+
+    def init_worker(self):
+        _worker['pid'] = os.getpid()
+
+    def pdf(self, xs):
+        if self.pool is not None:
+            return self.pool(super().pdf, xs)
+        if 'pid' not in _worker:
+            self.init_worker()
+        return super().pdf(xs)
+
+
+class PooledDensityTest(TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.xs = np.random.rand(1000, 2)
+
+    def test_methods(self):
+        density = Gaussian(2, mu=.5, scale=.2)
+        with PooledDensity(density, processes=2, capacity=300) as pooled:
+            self.assertTrue(np.allclose(pooled.pdf(self.xs),
+                                        density.pdf(self.xs)))
+            self.assertTrue(np.allclose(pooled.pot(self.xs),
+                                        density.pot(self.xs)))
+            self.assertTrue(np.allclose(pooled.pot_gradient(self.xs),
+                                        density.pot_gradient(self.xs)))
+            pot, gradient = pooled.pot_and_gradient(self.xs)
+            self.assertTrue(np.allclose(pot, density.pot(self.xs)))
+            self.assertTrue(np.allclose(gradient,
+                                        density.pot_gradient(self.xs)))
+        # evaluated in process once closed
+        self.assertTrue(np.allclose(pooled.pdf(self.xs),
+                                    density.pdf(self.xs)))
+
+    def test_pickled_copies(self):
+        density = StandInDensity(2)
+        expected = Gaussian(2, mu=.5, scale=.2).pdf(self.xs)
+        self.assertTrue(np.allclose(density.pdf(self.xs), expected))
+
+        # the workers evaluate copies without the pool, also if forked
+        with PooledDensity(density, processes=2) as pooled:
+            self.assertTrue(np.allclose(pooled.pdf(self.xs), expected))
+        self.assertNotIn('pid', _worker)
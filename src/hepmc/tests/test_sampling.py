@@ -0,0 +1,110 @@
+import os
+import tempfile
+import numpy as np
+from ..core.densities.gaussian import Gaussian
+from ..core.markov.metropolis import DefaultMetropolis
+from ..core.sampling import Sample, SampleWriter
+
+from unittest import TestCase
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedGaussian(Gaussian):
+    """ Gaussian that fails after a number of potential evaluations. """
+
+    def __init__(self, ndim, evaluations, **kwargs):
+        super().__init__(ndim, **kwargs)
+        self.evaluations = evaluations
+
+    def pot(self, xs):
+        if self.evaluations == 0:
+            raise Interrupted()
+        self.evaluations -= 1
+        return super().pot(xs)
+
+
+class SampleWriterTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'sample')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_chunks(self):
+        data = np.random.rand(250, 3)
+        pot = np.random.rand(250)
+        with SampleWriter(self.path, 250, 3, ['pot'], chunk_size=100) as writer:
+            for i in range(120):
+                writer.append(data[i], pot=pot[i])
+            # only complete chunks are on disk
+            self.assertEqual(Sample.load(self.path).size, 100)
+            for i in range(120, 250):
+                writer.append(data[i], pot=pot[i])
+
+        sample = Sample.load(self.path)
+        self.assertTrue(np.array_equal(sample.data, data))
+        self.assertTrue(np.array_equal(sample.pot, pot))
+
+    def test_unknown_field(self):
+        with self.assertRaises(ValueError):
+            SampleWriter(self.path, 10, 1, ['unknown'])
+
+
+class ChainStreamTest(TestCase):
+
+    sample_size = 1000
+    burnin = 300
+    chunk_size = 100
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.target = Gaussian(2, mu=.5, scale=.1)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def _sample(self, target, **kwargs):
+        met = DefaultMetropolis(target, cov=.01)
+        return met.sample(self.sample_size, [.5, .5], burnin=self.burnin,
+                          chunk_size=self.chunk_size, **kwargs)
+
+    def test_stream(self):
+        np.random.seed(42)
+        sample = self._sample(self.target)
+        np.random.seed(42)
+        streamed = self._sample(self.target, out=self._path('chain'))
+
+        self.assertTrue(np.array_equal(sample.data, streamed.data))
+        self.assertTrue(np.array_equal(sample.accepted, streamed.accepted))
+        self.assertTrue(np.allclose(streamed.pot,
+                                    self.target.pot(streamed.data)))
+
+    def _check_resume(self, evaluations):
+        np.random.seed(42)
+        sample = self._sample(self.target, out=self._path('complete'))
+
+        np.random.seed(42)
+        interrupted = InterruptedGaussian(2, evaluations, mu=.5, scale=.1)
+        with self.assertRaises(Interrupted):
+            self._sample(interrupted, out=self._path('resumed'))
+        # a different seed, the random state is part of the checkpoint
+        np.random.seed(1)
+        resumed = self._sample(self.target, resume=self._path('resumed'))
+
+        self.assertTrue(np.array_equal(sample.data, resumed.data))
+        self.assertTrue(np.array_equal(sample.accepted, resumed.accepted))
+        self.assertTrue(np.array_equal(sample.pot, resumed.pot))
+
+    def test_resume_burnin(self):
+        self._check_resume(self.burnin - 50)
+
+    def test_resume_sampling(self):
+        self._check_resume(self.burnin + 450)